@@ -11,26 +11,29 @@ from rich.console import Console
 from llama_index.core import (
     ServiceContext,
     VectorStoreIndex,
-    StorageContext,
-    load_index_from_storage,
 )
-
 from llama_index.core.schema import TextNode
 
+
 console = Console()
 
 # Import Ollama
 # You need to install llama-index-llms-ollama to use Ollama
 from llama_index.llms.ollama import Ollama
-from langchain_community.embeddings import OllamaEmbeddings
 
 # Import load_dotenv from the dotenv module
 from dotenv import load_dotenv
 
-from llamaindex_course.demo_medical.fhir_reader import (
-    read_fhir_file,
-    get_fhir_resource_types,
+from llamaindex_course.demo_medical.fhir_ingest import ingest_fhir_files
+from llamaindex_course.demo_medical.fhir_nodes import (
+    build_encounter_nodes,
+    build_resource_nodes,
 )
+from llamaindex_course.demo_medical.fhir_renderer import measure_rendering
+from llamaindex_course.llamaindex.embedding_cache import CachedEmbedding
+from llamaindex_course.llamaindex.incremental_index import refresh_node_index
+from llamaindex_course.llamaindex.mmap_vector_store import load_index
+from llamaindex_course.llamaindex.ollama_embedding import OllamaBatchEmbedding
 
 # Load the .env file
 load_dotenv()
@@ -41,16 +44,37 @@ LLM_MODEL = "mistral:latest"
 # check if storage already exists
 PERSIST_DIR = os.environ.get("PERSIST_DIR")
 
+# With incremental indexing only the new or changed nodes are embedded and the
+# nodes that are no longer produced are deleted from the persisted index
+INCREMENTAL_INDEXING = True
+
 # You need to set this variable to True if you want to remove the existing storage
-# and recreate the index from the documents
+# and recreate the index from the documents (when INCREMENTAL_INDEXING is False)
 REMOVE_EXISTING_STORAGE = True
 
 # Example of a FHIR file
-FILE_TO_OPEN = "data_json/0d5f5a77-b49d-4f8b-887f-70e9de390751.json"
+# FHIR_FILES can be set to a file, a directory or a glob pattern
+# (eg. "data_json/*.json" or "bulk_export/*.ndjson") to index many files
+FILE_TO_OPEN = os.environ.get(
+    "FHIR_FILES", "data_json/0d5f5a77-b49d-4f8b-887f-70e9de390751.json"
+)
 
 # Get the full path of the file
 FULL_PATH = os.path.join(os.getcwd(), FILE_TO_OPEN)
 
+# Set FHIR_CACHE_DIR to keep the parsed bundles in a binary cache between runs
+FHIR_CACHE_DIR = os.environ.get("FHIR_CACHE_DIR")
+
+# "encounter" groups the resources of each encounter in a few dense nodes
+# (fewer embedding calls), "resource" creates one node per resource
+NODE_MODE = os.environ.get("FHIR_NODE_MODE", "encounter")
+
+# Maximum number of tokens of a node in "encounter" mode
+MAX_NODE_TOKENS = 512
+
+# Resource types added to the index
+INDEXED_RESOURCE_TYPES = ("Patient", "Observation", "Condition", "Encounter")
+
 
 def get_service_context() -> ServiceContext:
     """
@@ -58,42 +82,60 @@ def get_service_context() -> ServiceContext:
     """
     service_context = ServiceContext.from_defaults(
         llm=Ollama(model=LLM_MODEL, tokens=8096, request_timeout=120, temperature=0.0),
-        embed_model=OllamaEmbeddings(model=EMBEDDING_MODEL, show_progress=True),
+        embed_model=CachedEmbedding(OllamaBatchEmbedding(model_name=EMBEDDING_MODEL)),
     )
     return service_context
 
 
+def build_fhir_nodes(file_path: str) -> List[TextNode]:
+    """
+    Build the nodes of the FHIR file (or the files matching a directory or a glob pattern)
+    """
+    # Stream the files (in parallel when there are several of them) and group
+    # the resources by type, only the indexed resource types are kept in memory
+    bundle_index = ingest_fhir_files(
+        file_path, resource_types=INDEXED_RESOURCE_TYPES, cache_dir=FHIR_CACHE_DIR
+    )
+
+    # Render the resources as compact texts and build the nodes
+    if NODE_MODE == "encounter":
+        resource_nodes = build_encounter_nodes(bundle_index, max_tokens=MAX_NODE_TOKENS)
+    else:
+        resource_nodes = build_resource_nodes(
+            bundle_index, resource_types=list(INDEXED_RESOURCE_TYPES)
+        )
+    for resource_node in resource_nodes:
+        console.print(f"Adding node {resource_node.text} to the index")
+
+    resources = [
+        resource
+        for resource_type in INDEXED_RESOURCE_TYPES
+        for resource in bundle_index.get_resources(resource_type)
+    ]
+    stats = measure_rendering(resources)
+    logging.info(
+        "Rendered %s resources in %s nodes: %s -> %s tokens (x%.1f), "
+        "%s -> %s characters (x%.1f)",
+        stats.resources,
+        len(resource_nodes),
+        stats.original_tokens,
+        stats.rendered_tokens,
+        stats.token_reduction,
+        stats.original_chars,
+        stats.rendered_chars,
+        stats.char_reduction,
+    )
+
+    return resource_nodes
+
+
 def index_fhir_file(file_path: str) -> VectorStoreIndex:
     """ "
-    Index the FHIR file
+    Index the FHIR file (or the files matching a directory or a glob pattern)
     """
-    resources = []
-    data = read_fhir_file(file_path)
-    # Get patient resource type
-    patient = get_fhir_resource_types(data, "Patient")
-    resources.append(patient)
-    # Get Observation resource type
-    observations = get_fhir_resource_types(data, "Observation")
-    # Add the observations to the resources list
-    resources.extend(observations)
-    # Get Condition resource type
-    conditions = get_fhir_resource_types(data, "Condition")
-    resources.extend(conditions)
-    # Get Encounter resource type
-    encounters = get_fhir_resource_types(data, "Encounter")
-    resources.extend(encounters)
-
-    # Add the resources to the vector store
-    resource_nodes: List[TextNode] = []
-    id = 0
-    for resource in resources:
-        console.print(f"Adding resource {resource} to the index")
-        # generate an unique id for the resource
-        id = id + 1
-        resource_node = TextNode(text=str(resource), id=str(id) )
-        resource_nodes.append(resource_node)
-
-    vector_store = VectorStoreIndex(nodes=resource_nodes)
+    vector_store = VectorStoreIndex(
+        nodes=build_fhir_nodes(file_path), service_context=get_service_context()
+    )
     return vector_store
 
 
@@ -101,7 +143,15 @@ def get_vector_store_index() -> VectorStoreIndex:
     """
     Get the vector store index
     """
-    if REMOVE_EXISTING_STORAGE and os.path.exists(PERSIST_DIR):
+    if INCREMENTAL_INDEXING:
+        # the node ids are derived from their content: an unchanged bundle
+        # is not embedded again
+        index, stats = refresh_node_index(
+            build_fhir_nodes(FULL_PATH), PERSIST_DIR, service_context=get_service_context()
+        )
+        logging.info("Incremental indexing: %s", stats)
+
+    elif REMOVE_EXISTING_STORAGE and os.path.exists(PERSIST_DIR):
         # remove the existing storage
 
         logging.info("Removing existing storage at %s", PERSIST_DIR)
@@ -114,7 +164,7 @@ def get_vector_store_index() -> VectorStoreIndex:
 
     else:
         # load the index from the storage
-        index = load_index_from_storage(PERSIST_DIR)
+        index = load_index(PERSIST_DIR, service_context=get_service_context())
 
     return index
 
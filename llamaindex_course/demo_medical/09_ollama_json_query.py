@@ -9,20 +9,22 @@ import sys
 from llama_index.core import (
     ServiceContext,
     VectorStoreIndex,
-    StorageContext,
     SimpleDirectoryReader,
-    load_index_from_storage,
 )
 
 # Import Ollama
 # You need to install llama-index-llms-ollama to use Ollama
 from llama_index.llms.ollama import Ollama
-from langchain_community.embeddings import OllamaEmbeddings
 #from llama_index.core.node_parser import JSONNodeParser
 
 # Import load_dotenv from the dotenv module
 from dotenv import load_dotenv
 
+from llamaindex_course.llamaindex.embedding_cache import CachedEmbedding
+from llamaindex_course.llamaindex.incremental_index import refresh_index
+from llamaindex_course.llamaindex.mmap_vector_store import load_index
+from llamaindex_course.llamaindex.ollama_embedding import OllamaBatchEmbedding
+
 # Load the .env file
 load_dotenv()
 
@@ -38,18 +40,32 @@ LLM_MODEL ="mistral:latest"
 # Define the service context
 service_context = ServiceContext.from_defaults(
     llm=Ollama(model=LLM_MODEL, tokens=8096, request_timeout=120, temperature=0.0),
-    embed_model=OllamaEmbeddings(model=EMBEDDING_MODEL, show_progress=True),
+    embed_model=CachedEmbedding(OllamaBatchEmbedding(model_name=EMBEDDING_MODEL)),
 )
 
 # check if storage already exists
 PERSIST_DIR = os.environ.get("PERSIST_DIR")
 
+# With incremental indexing only the new or changed documents are embedded and
+# the documents whose file disappeared are removed from the index
+INCREMENTAL_INDEXING = True
+
 # You need to set this variable to True if you want to remove the existing storage
-# and recreate the index from the documents
+# and recreate the index from the documents (when INCREMENTAL_INDEXING is False)
 REMOVE_EXISTING_STORAGE = True
 
 
-if REMOVE_EXISTING_STORAGE and os.path.exists(PERSIST_DIR):
+if INCREMENTAL_INDEXING:
+    # filename_as_id gives the documents stable ids between runs
+    documents = SimpleDirectoryReader("data_json", filename_as_id=True).load_data(
+        show_progress=True
+    )
+    index, stats = refresh_index(
+        documents, PERSIST_DIR, service_context=service_context, show_progress=True
+    )
+    logger.info("Incremental indexing: %s", stats)
+
+elif REMOVE_EXISTING_STORAGE and os.path.exists(PERSIST_DIR):
     # remove the existing storage
     import shutil
 
@@ -72,8 +88,7 @@ else:
     # We can load the existing index from the storage
     # create the directory if it does not exist
 
-    storage_context = StorageContext.from_defaults(persist_dir=PERSIST_DIR)
-    index = load_index_from_storage(storage_context, service_context=service_context)
+    index = load_index(PERSIST_DIR, service_context=service_context)
 
 
 
@@ -0,0 +1,280 @@
+""" Binary cache of parsed FHIR Bundles, keyed by file path, mtime and content hash """
+
+import os
+import sys
+import json
+import mmap
+import struct
+import marshal
+import hashlib
+from typing import Collection, Dict, List, NamedTuple, Optional, Tuple
+
+from rich.console import Console
+
+from llamaindex_course.demo_medical.fhir_reader import (
+    FULL_PATH,
+    FhirBundleIndex,
+    iter_fhir_entries,
+)
+
+# Directory of the cache, can be set with the FHIR_CACHE_DIR environment variable
+CACHE_DIR = os.environ.get("FHIR_CACHE_DIR", ".fhir_cache")
+
+# Cache file layout: magic, header length, marshal'ed header, then one
+# marshal'ed list of entries per resource type. The header maps each
+# resource type to the (offset, length) of its section, so that a warm load
+# only decodes the sections of the requested resource types from the
+# memory-mapped file.
+_MAGIC = b"FHIRBC01"
+_HEADER_LENGTH = struct.Struct("<Q")
+
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class CacheStats(NamedTuple):
+    """Counters of a FhirBundleCache"""
+
+    hits: int
+    misses: int
+
+    @property
+    def hit_rate(self) -> float:
+        """Ratio of the loads served from the cache"""
+        return self.hits / max(self.hits + self.misses, 1)
+
+
+def hash_file(file_path: str) -> str:
+    """SHA-256 of the content of a file"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(_HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_atomic(file_path: str, data: bytes) -> None:
+    """Write a file so that readers never see a partial file"""
+    temporary_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(data)
+    os.replace(temporary_path, file_path)
+
+
+class FhirBundleCache:
+    """Cache of parsed FHIR Bundles grouped by resource type
+
+    Each source file has a small key file recording its mtime, size and
+    content hash. When the mtime and size are unchanged the content is not
+    hashed again; when they changed the file is hashed and the cached
+    bundle is reused if the content is the same. The parsed bundles are
+    stored once per content hash, so copies of a bundle share the cache.
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self) -> CacheStats:
+        """Hit and miss counters"""
+        return CacheStats(self.hits, self.misses)
+
+    def _key_path(self, file_path: str) -> str:
+        path_hash = hashlib.sha1(os.path.abspath(file_path).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{path_hash}.key")
+
+    def _bundle_path(self, content_hash: str) -> str:
+        return os.path.join(self.cache_dir, f"{content_hash}.bundle")
+
+    def _content_hash(self, file_path: str) -> str:
+        """Content hash of a file, read from its key file when mtime and size did not change"""
+        status = os.stat(file_path)
+        key_path = self._key_path(file_path)
+        try:
+            with open(key_path, "r", encoding="utf-8") as file:
+                key = json.load(file)
+            if key["mtime_ns"] == status.st_mtime_ns and key["size"] == status.st_size:
+                return key["hash"]
+        except (OSError, ValueError, KeyError):
+            pass
+        content_hash = hash_file(file_path)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        key = {
+            "path": os.path.abspath(file_path),
+            "mtime_ns": status.st_mtime_ns,
+            "size": status.st_size,
+            "hash": content_hash,
+        }
+        _write_atomic(key_path, json.dumps(key).encode("utf-8"))
+        return content_hash
+
+    def load_grouped(
+        self, file_path: str, resource_types: Optional[Collection[str]] = None
+    ) -> Tuple[Dict[str, List[dict]], bool]:
+        """Load the entries of a bundle grouped by resource type
+
+        Args:
+            file_path: The path to the bundle
+            resource_types: If given, only these resource types are loaded
+        Returns:
+            The entries grouped by resource type, and True if the cache was hit
+        """
+        bundle_path = self._bundle_path(self._content_hash(file_path))
+        grouped = self._read_bundle(bundle_path, resource_types)
+        if grouped is not None:
+            self.hits += 1
+            return grouped, True
+
+        self.misses += 1
+        grouped = {}
+        for entry in iter_fhir_entries(file_path):
+            grouped.setdefault(entry["resource"]["resourceType"], []).append(entry)
+        self._write_bundle(bundle_path, grouped)
+        if resource_types is not None:
+            grouped = {
+                resource_type: entries
+                for resource_type, entries in grouped.items()
+                if resource_type in resource_types
+            }
+        return grouped, False
+
+    def load(
+        self, file_path: str, resource_types: Optional[Collection[str]] = None
+    ) -> FhirBundleIndex:
+        """Load a bundle as a FhirBundleIndex, from the cache when possible
+
+        Args:
+            file_path: The path to the bundle
+            resource_types: If given, only these resource types are loaded
+        Returns:
+            The FhirBundleIndex of the bundle
+        """
+        grouped, _ = self.load_grouped(file_path, resource_types)
+        bundle_index = FhirBundleIndex()
+        for entries in grouped.values():
+            for entry in entries:
+                bundle_index.add(entry)
+        return bundle_index
+
+    @staticmethod
+    def _write_bundle(bundle_path: str, grouped: Dict[str, List[dict]]) -> None:
+        sections = {
+            resource_type: marshal.dumps(entries)
+            for resource_type, entries in grouped.items()
+        }
+        header = {}
+        offset = 0
+        for resource_type, section in sections.items():
+            header[resource_type] = (offset, len(section))
+            offset += len(section)
+        header_bytes = marshal.dumps(header)
+        os.makedirs(os.path.dirname(bundle_path) or ".", exist_ok=True)
+        _write_atomic(
+            bundle_path,
+            b"".join(
+                [_MAGIC, _HEADER_LENGTH.pack(len(header_bytes)), header_bytes]
+                + list(sections.values())
+            ),
+        )
+
+    @staticmethod
+    def _read_bundle(
+        bundle_path: str, resource_types: Optional[Collection[str]]
+    ) -> Optional[Dict[str, List[dict]]]:
+        """Decode the requested sections of a cached bundle, None if it is not cached
+
+        A truncated or corrupt file, or one written by another marshal
+        version, is deleted and treated as a miss: the bundle is parsed and
+        cached again.
+        """
+        try:
+            file = open(bundle_path, "rb")  # pylint: disable=consider-using-with
+        except FileNotFoundError:
+            return None
+        try:
+            with file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as view:
+                    if bytes(view[: len(_MAGIC)]) != _MAGIC:
+                        return None
+                    start = len(_MAGIC) + _HEADER_LENGTH.size
+                    (header_length,) = _HEADER_LENGTH.unpack(view[len(_MAGIC) : start])
+                    header = marshal.loads(view[start : start + header_length])
+                    data_start = start + header_length
+                    grouped = {}
+                    for resource_type, (offset, length) in header.items():
+                        if resource_types is not None and resource_type not in resource_types:
+                            continue
+                        if data_start + offset + length > len(view):
+                            raise EOFError(f"{bundle_path} is truncated")
+                        grouped[resource_type] = marshal.loads(
+                            view[data_start + offset : data_start + offset + length]
+                        )
+                    return grouped
+        except (ValueError, EOFError, TypeError, struct.error):
+            try:
+                os.remove(bundle_path)
+            except FileNotFoundError:
+                pass
+            return None
+
+    def invalidate(self, file_path: Optional[str] = None) -> int:
+        """Remove cached bundles
+
+        Args:
+            file_path: The bundle to remove from the cache, None to clear the cache
+        Returns:
+            The number of files removed from the cache directory
+        """
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        if file_path is None:
+            names = [
+                name
+                for name in os.listdir(self.cache_dir)
+                if name.endswith((".key", ".bundle"))
+            ]
+        else:
+            key_path = self._key_path(file_path)
+            names = [os.path.basename(key_path)]
+            try:
+                with open(key_path, "r", encoding="utf-8") as file:
+                    names.append(f"{json.load(file)['hash']}.bundle")
+            except (OSError, ValueError, KeyError):
+                pass
+        removed = 0
+        for name in names:
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+
+def main():
+    """
+    Manage the cache
+
+    Usage:
+        python -m llamaindex_course.demo_medical.fhir_cache load [file]
+        python -m llamaindex_course.demo_medical.fhir_cache invalidate [file]
+    """
+    console = Console()
+    command = sys.argv[1] if len(sys.argv) > 1 else "load"
+    file_path = sys.argv[2] if len(sys.argv) > 2 else None
+    cache = FhirBundleCache()
+
+    if command == "invalidate":
+        removed = cache.invalidate(file_path)
+        console.print(f"Removed {removed} files from {cache.cache_dir}")
+    elif command == "load":
+        bundle_index = cache.load(file_path or FULL_PATH)
+        console.print(f"Loaded {len(bundle_index)} resources, {cache.stats}")
+    else:
+        console.print(f"Unknown command {command}, use load or invalidate")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
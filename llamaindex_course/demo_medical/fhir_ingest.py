@@ -0,0 +1,229 @@
+""" Parallel ingestion of many FHIR files: JSON Bundles and Bulk Data NDJSON """
+
+import os
+import glob
+import json
+import logging
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Collection, Dict, Iterator, List, Optional, Tuple
+
+from rich.console import Console
+
+from llamaindex_course.demo_medical.fhir_cache import FhirBundleCache
+from llamaindex_course.demo_medical.fhir_reader import (
+    FhirBundleIndex,
+    iter_fhir_entries,
+)
+
+# Extensions of the files picked up when a directory is ingested
+BUNDLE_EXTENSIONS = (".json",)
+NDJSON_EXTENSIONS = (".ndjson", ".jsonl")
+
+# NDJSON files are split in byte ranges of this size so that one large
+# Bulk Data export is parsed by several workers
+NDJSON_CHUNK_BYTES = 16 * 1024 * 1024
+
+# Number of resources per list yielded by iter_ndjson_resources
+NDJSON_BATCH_SIZE = 1000
+
+# A task is (path, start offset, end offset), offsets are None for a bundle
+_Task = Tuple[str, Optional[int], Optional[int]]
+
+
+def _is_ndjson(file_path: str) -> bool:
+    return file_path.lower().endswith(NDJSON_EXTENSIONS)
+
+
+def expand_fhir_paths(path_or_pattern: str) -> List[str]:
+    """Expand a file, a directory or a glob pattern into a sorted list of files
+    Args:
+        path_or_pattern: A file, a directory or a glob pattern (eg. "data_json/*.json")
+    Returns:
+        The list of files
+    """
+    if os.path.isdir(path_or_pattern):
+        return sorted(
+            os.path.join(path_or_pattern, name)
+            for name in os.listdir(path_or_pattern)
+            if name.lower().endswith(BUNDLE_EXTENSIONS + NDJSON_EXTENSIONS)
+        )
+    if glob.has_magic(path_or_pattern):
+        return sorted(glob.glob(path_or_pattern, recursive=True))
+    return [path_or_pattern]
+
+
+def _iter_ndjson_lines(file_path: str, start: int, end: Optional[int]) -> Iterator[bytes]:
+    """Yield the lines that start in the byte range [start, end) of a file"""
+    with open(file_path, "rb") as file:
+        if start > 0:
+            # The line that contains start belongs to the previous range
+            file.seek(start - 1)
+            file.readline()
+        while end is None or file.tell() < end:
+            line = file.readline()
+            if not line:
+                break
+            yield line
+
+
+def iter_ndjson_resources(
+    file_path: str,
+    resource_types: Optional[Collection[str]] = None,
+    batch_size: int = NDJSON_BATCH_SIZE,
+    start: int = 0,
+    end: Optional[int] = None,
+) -> Iterator[List[dict]]:
+    """Read a FHIR Bulk Data NDJSON file (one resource per line) in batches
+
+    Only one batch of resources is kept in memory at a time.
+
+    Args:
+        file_path: The path to the file
+        resource_types: If given, only these resource types are kept
+        batch_size: Number of resources per yielded list
+        start: Offset of the first byte to read
+        end: Offset after which no new line is read, None for the end of the file
+    Returns:
+        An iterator over lists of resources
+    """
+    batch = []
+    for line in _iter_ndjson_lines(file_path, start, end):
+        if not line.strip():
+            continue
+        resource = json.loads(line)
+        if resource_types is not None and resource["resourceType"] not in resource_types:
+            continue
+        batch.append(resource)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _plan_tasks(file_paths: List[str]) -> List[_Task]:
+    """Split the files into tasks, one per bundle and one per NDJSON byte range"""
+    tasks: List[_Task] = []
+    for file_path in file_paths:
+        if not _is_ndjson(file_path):
+            tasks.append((file_path, None, None))
+            continue
+        size = os.path.getsize(file_path)
+        for start in range(0, max(size, 1), NDJSON_CHUNK_BYTES):
+            tasks.append((file_path, start, min(start + NDJSON_CHUNK_BYTES, size)))
+    return tasks
+
+
+def _run_task(
+    task: _Task,
+    resource_types: Optional[Collection[str]],
+    cache_dir: Optional[str] = None,
+) -> Tuple[Dict[str, List[dict]], Optional[bool]]:
+    """Parse one task and group its entries by resource type
+
+    Returns the grouped entries, and whether the bundle cache was hit
+    (None when the cache is not used)
+    """
+    file_path, start, end = task
+    grouped: Dict[str, List[dict]] = {}
+    if start is None and cache_dir is not None:
+        return FhirBundleCache(cache_dir).load_grouped(file_path, resource_types)
+    if start is None:
+        for entry in iter_fhir_entries(file_path, resource_types=resource_types):
+            grouped.setdefault(entry["resource"]["resourceType"], []).append(entry)
+    else:
+        for batch in iter_ndjson_resources(
+            file_path, resource_types=resource_types, start=start, end=end
+        ):
+            for resource in batch:
+                grouped.setdefault(resource["resourceType"], []).append(
+                    {"resource": resource}
+                )
+    return grouped, None
+
+
+def ingest_fhir_files(
+    path_or_pattern: str,
+    resource_types: Optional[Collection[str]] = None,
+    max_workers: Optional[int] = None,
+    cache_dir: Optional[str] = None,
+) -> FhirBundleIndex:
+    """Parse many FHIR files in parallel and merge them in one index
+
+    Bundles (.json) are parsed one per task, NDJSON files (.ndjson, .jsonl)
+    are split in byte ranges of NDJSON_CHUNK_BYTES. The tasks run in a
+    process pool and the per-type results are merged in file order.
+
+    Args:
+        path_or_pattern: A file, a directory or a glob pattern
+        resource_types: If given, only these resource types are kept
+        max_workers: Number of worker processes, defaults to the number of CPUs.
+        With 1 worker (or a single task) the files are parsed in this process
+        cache_dir: If given, the bundles are loaded through a FhirBundleCache
+        stored in this directory
+    Returns:
+        The merged FhirBundleIndex
+    """
+    if resource_types is not None:
+        resource_types = frozenset(resource_types)
+    tasks = _plan_tasks(expand_fhir_paths(path_or_pattern))
+    bundle_index = FhirBundleIndex()
+    cache_stats = {True: 0, False: 0, None: 0}
+
+    if max_workers == 1 or len(tasks) <= 1:
+        for task in tasks:
+            _merge(bundle_index, cache_stats, _run_task(task, resource_types, cache_dir))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(
+                _run_task,
+                tasks,
+                [resource_types] * len(tasks),
+                [cache_dir] * len(tasks),
+                chunksize=max(
+                    1, len(tasks) // (4 * (max_workers or os.cpu_count() or 1))
+                ),
+            )
+            for result in results:
+                _merge(bundle_index, cache_stats, result)
+
+    if cache_dir is not None:
+        logging.info(
+            "FHIR bundle cache: %s hits, %s misses",
+            cache_stats[True],
+            cache_stats[False],
+        )
+    return bundle_index
+
+
+def _merge(
+    bundle_index: FhirBundleIndex,
+    cache_stats: Dict[Optional[bool], int],
+    result: Tuple[Dict[str, List[dict]], Optional[bool]],
+) -> None:
+    """Add the entries grouped by a task to the index"""
+    grouped, cache_hit = result
+    cache_stats[cache_hit] += 1
+    for entries in grouped.values():
+        for entry in entries:
+            bundle_index.add(entry)
+
+
+def main():
+    """
+    Ingest the FHIR files given on the command line and print the resource counts
+
+    Usage: python -m llamaindex_course.demo_medical.fhir_ingest "data_json/*.json" [workers]
+    """
+    console = Console()
+    path_or_pattern = sys.argv[1] if len(sys.argv) > 1 else "data_json"
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    bundle_index = ingest_fhir_files(path_or_pattern, max_workers=max_workers)
+    console.print(f"Ingested {len(bundle_index)} resources from {path_or_pattern}")
+    console.print(bundle_index.counts())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+""" Build the nodes of the FHIR index: one node per resource or grouped by encounter """
+
+import hashlib
+from typing import Callable, Dict, List, Optional
+
+from llama_index.core.schema import TextNode
+from llama_index.core.utils import get_tokenizer
+
+from llamaindex_course.demo_medical.fhir_reader import FhirBundleIndex
+from llamaindex_course.demo_medical.fhir_reference_graph import FhirReferenceGraph
+from llamaindex_course.demo_medical.fhir_renderer import ResourceRenderer, render_resource
+
+# Maximum number of tokens of an encounter node
+DEFAULT_NODE_TOKENS = 512
+
+# Metadata that only identify the source of a node, not sent to the models
+_ID_METADATA = ["patient", "encounter"]
+
+
+def node_id(text: str, *source: str) -> str:
+    """Stable node id derived from the content of the node and its source
+
+    The source (patient, encounter, resource) is part of the hash: two
+    patients whose records render to the same text get two nodes.
+    """
+    return hashlib.sha256("\0".join([*source, text]).encode("utf-8")).hexdigest()
+
+
+def _make_node(text: str, metadata: Dict[str, str], *source: str) -> TextNode:
+    source = source or tuple(metadata.get(key, "") for key in _ID_METADATA)
+    return TextNode(
+        id_=node_id(text, *source),
+        text=text,
+        metadata=metadata,
+        excluded_embed_metadata_keys=list(_ID_METADATA),
+        excluded_llm_metadata_keys=list(_ID_METADATA),
+    )
+
+
+def build_resource_nodes(
+    bundle_index: FhirBundleIndex,
+    resource_types: Optional[List[str]] = None,
+    renderers: Optional[Dict[str, ResourceRenderer]] = None,
+) -> List[TextNode]:
+    """Build one node per resource
+
+    Args:
+        bundle_index: The resources
+        resource_types: The resource types to index, defaults to every type
+        renderers: Renderers by resource type (see fhir_renderer.render_resource)
+    Returns:
+        The nodes
+    """
+    nodes = []
+    for resource_type in resource_types or bundle_index.resource_types:
+        for resource in bundle_index.get_resources(resource_type):
+            source = f"{resource_type}/{resource.get('id', '')}"
+            nodes.append(_make_node(render_resource(resource, renderers), {}, source))
+    return nodes
+
+
+def _pack(
+    header: str,
+    lines: List[str],
+    max_tokens: int,
+    count_tokens: Callable[[str], int],
+    metadata: Dict[str, str],
+) -> List[TextNode]:
+    """Pack the lines under a header in as few nodes as the token budget allows
+
+    The header is repeated at the top of every node. A line larger than the
+    budget is not split, it gets a node of its own.
+    """
+    nodes = []
+    header_tokens = count_tokens(header)
+    current: List[str] = []
+    current_tokens = header_tokens
+    for line in lines:
+        line_tokens = count_tokens(line) + 1
+        if current and current_tokens + line_tokens > max_tokens:
+            nodes.append(_make_node("\n".join([header] + current), metadata))
+            current = []
+            current_tokens = header_tokens
+        current.append(line)
+        current_tokens += line_tokens
+    if current or not nodes:
+        nodes.append(_make_node("\n".join([header] + current), metadata))
+    return nodes
+
+
+def build_encounter_nodes(
+    bundle_index: FhirBundleIndex,
+    max_tokens: int = DEFAULT_NODE_TOKENS,
+    tokenizer: Optional[Callable[[str], List]] = None,
+    renderers: Optional[Dict[str, ResourceRenderer]] = None,
+) -> List[TextNode]:
+    """Build nodes grouping the resources by encounter
+
+    Each patient gets a header node. Each encounter gets one node (or more
+    when its resources exceed max_tokens) starting with the encounter and
+    followed by the resources that reference it (observations, conditions,
+    procedures, ...). The resources that are not attached to an encounter
+    are grouped in "Other records" nodes.
+
+    Args:
+        bundle_index: The resources
+        max_tokens: Maximum number of tokens of a node
+        tokenizer: The tokenizer used to count the tokens, defaults to the
+        llama_index tokenizer
+        renderers: Renderers by resource type (see fhir_renderer.render_resource)
+    Returns:
+        The nodes, with ids derived from their content, patient and encounter
+    """
+    tokenizer = tokenizer or get_tokenizer()
+
+    def count_tokens(text: str) -> int:
+        return len(tokenizer(text))
+
+    def render(key: str) -> str:
+        return render_resource(graph.get_resource(key), renderers)
+
+    def start_date(key: str) -> str:
+        return (graph.get_resource(key).get("period") or {}).get("start", "")
+
+    graph = FhirReferenceGraph.from_bundle_index(bundle_index)
+    nodes: List[TextNode] = []
+    placed = set()
+
+    def add_encounter(encounter_key: str, metadata: Dict[str, str]) -> None:
+        placed.add(encounter_key)
+        lines = []
+        for key in graph.referenced_by(encounter_key):
+            if key not in placed:
+                placed.add(key)
+                lines.append(render(key))
+        metadata = {
+            **metadata,
+            "encounter": encounter_key,
+            "date": start_date(encounter_key)[:10],
+        }
+        nodes.extend(_pack(render(encounter_key), lines, max_tokens, count_tokens, metadata))
+
+    for patient_key in graph.keys("Patient"):
+        placed.add(patient_key)
+        nodes.append(_make_node(render(patient_key), {"patient": patient_key}))
+        for encounter_key in sorted(
+            graph.referenced_by(patient_key, "Encounter"), key=start_date
+        ):
+            add_encounter(encounter_key, {"patient": patient_key})
+
+    # Encounters whose patient is not in the bundle index
+    for encounter_key in sorted(graph.keys("Encounter"), key=start_date):
+        if encounter_key not in placed:
+            add_encounter(encounter_key, {})
+
+    remaining = [render(key) for key in graph.keys() if key not in placed]
+    if remaining:
+        nodes.extend(_pack("Other records", remaining, max_tokens, count_tokens, {}))
+    return nodes
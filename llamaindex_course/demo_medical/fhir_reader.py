@@ -1,6 +1,6 @@
 import os
 import json
-from typing import List
+from typing import Any, Collection, Dict, Iterable, Iterator, List, Optional, Union
 from rich.console import Console
 
 # rich is a Python library for rich text and beautiful formatting in the terminal.
@@ -34,11 +34,252 @@ def read_fhir_file(file_path: str) -> dict:
         raise ValueError("The document does not appear to be a FHIR Bundle")
 
 
-def get_fhir_resource_types(data: dict, resource_type: str) -> List[dict]:
+# Size of the blocks read from disk by the streaming reader
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_JSON_WHITESPACE = " \t\n\r"
+
+# Characters that can continue a number after a prefix decoded as a number
+_JSON_NUMBER_CHARS = "0123456789.eE+-"
+
+
+class _BundleStreamParser:
+    """Incremental parser for the top level object of a FHIR Bundle
+
+    Only a window of the file is kept in memory: each entry of the "entry"
+    array is decoded on its own with the C JSON decoder and the consumed
+    part of the buffer is dropped when the next block is read.
+    """
+
+    def __init__(self, file, chunk_size: int):
+        self._file = file
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, size: int = 0) -> bool:
+        """Read the next block of the file, False at the end of the file"""
+        if self._eof:
+            return False
+        chunk = self._file.read(max(size, self._chunk_size))
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos :] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        """Skip the whitespaces and return the next character without consuming it"""
+        while True:
+            while (
+                self._pos < len(self._buffer)
+                and self._buffer[self._pos] in _JSON_WHITESPACE
+            ):
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of the FHIR document")
+
+    def _expect(self, chars: str) -> str:
+        """Consume the next character, it must be one of chars"""
+        char = self._peek()
+        if char not in chars:
+            raise ValueError(
+                f"The document does not appear to be a FHIR Bundle: expected one of "
+                f"{chars!r}, got {char!r}"
+            )
+        self._pos += 1
+        return char
+
+    def _decode(self) -> Any:
+        """Decode the next JSON value, reading more of the file if it is truncated"""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                # Double the pending window so a large value is not re-parsed
+                # once per block
+                if not self._fill(len(self._buffer) - self._pos):
+                    raise
+                continue
+            # A number can be cut at the end of the buffer, after its integer
+            # part ("12" of "12.5") or its exponent mark ("1" of "1e3")
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                number_end = end
+                while (
+                    number_end < len(self._buffer)
+                    and self._buffer[number_end] in _JSON_NUMBER_CHARS
+                ):
+                    number_end += 1
+                if number_end == len(self._buffer) and self._fill():
+                    continue
+            self._pos = end
+            return value
+
+    def iter_entries(
+        self, resource_types: Optional[Collection[str]]
+    ) -> Iterator[dict]:
+        """Yield the entries of the bundle, keeping only the given resource types"""
+        is_bundle = False
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+        else:
+            while True:
+                key = self._decode()
+                self._expect(":")
+                if key == "entry":
+                    self._expect("[")
+                    if self._peek() == "]":
+                        self._pos += 1
+                    else:
+                        while True:
+                            entry = self._decode()
+                            if (
+                                resource_types is None
+                                or entry["resource"]["resourceType"] in resource_types
+                            ):
+                                yield entry
+                            if self._expect(",]") == "]":
+                                break
+                else:
+                    value = self._decode()
+                    if key == "resourceType":
+                        if value != "Bundle":
+                            raise ValueError(
+                                "The document does not appear to be a FHIR Bundle"
+                            )
+                        is_bundle = True
+                if self._expect(",}") == "}":
+                    break
+        if not is_bundle:
+            raise ValueError("The document does not appear to be a FHIR Bundle")
+
+
+def iter_fhir_entries(
+    file_path: str,
+    resource_types: Optional[Collection[str]] = None,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+) -> Iterator[dict]:
+    """Read a FHIR Bundle incrementally and yield its entries one by one
+
+    Unlike read_fhir_file the whole bundle is never loaded in memory, so
+    large bundles (bulk exports) are processed with a bounded memory.
+
+    Args:
+        file_path: The path to the file
+        resource_types: If given, only the entries whose resource has one of
+        these types are yielded (eg. {"Patient", "Observation"})
+        chunk_size: Size of the blocks read from the file
+    Returns:
+        An iterator over the entries of the bundle
+    Raises:
+        ValueError: if the document is not a FHIR Bundle
+    """
+    if resource_types is not None:
+        resource_types = frozenset(resource_types)
+    with open(file_path, "r", encoding="utf-8") as file:
+        yield from _BundleStreamParser(file, chunk_size).iter_entries(resource_types)
+
+
+class FhirBundleIndex:
+    """Index of the resources of a FHIR Bundle built in a single pass
+
+    The entries are grouped by resource type, by (resource type, id) and by
+    fullUrl so that every lookup is a dictionary access instead of a scan
+    of the whole entry list.
+    """
+
+    def __init__(self, entries: Optional[Iterable[dict]] = None):
+        """Build the index
+        Args:
+            entries: The entries of the bundle (as returned by read_fhir_file)
+        """
+        self._entries: List[dict] = []
+        self._by_type: Dict[str, List[dict]] = {}
+        self._by_id: Dict[str, Dict[str, dict]] = {}
+        self._by_full_url: Dict[str, dict] = {}
+        if entries is not None:
+            for entry in entries:
+                self.add(entry)
+
+    def add(self, entry: dict) -> None:
+        """Add a bundle entry to the index
+        Args:
+            entry: A bundle entry with a "resource" and optionally a "fullUrl"
+        """
+        resource = entry["resource"]
+        resource_type = resource["resourceType"]
+        self._entries.append(entry)
+        self._by_type.setdefault(resource_type, []).append(resource)
+        if "id" in resource:
+            self._by_id.setdefault(resource_type, {})[resource["id"]] = resource
+        if "fullUrl" in entry:
+            self._by_full_url[entry["fullUrl"]] = resource
+
+    @property
+    def entries(self) -> List[dict]:
+        """The entries of the bundle, in order of insertion"""
+        return list(self._entries)
+
+    @property
+    def resource_types(self) -> List[str]:
+        """The resource types present in the bundle, in order of first appearance"""
+        return list(self._by_type)
+
+    def get_resources(self, resource_type: str) -> List[dict]:
+        """Get all the resources of a given type
+        Args:
+            resource_type: The resource type (eg. "Patient", "Observation")
+        Returns:
+            The resources as a list of dictionaries or an empty list
+        """
+        return list(self._by_type.get(resource_type, []))
+
+    def get_by_id(self, resource_type: str, resource_id: str) -> Optional[dict]:
+        """Get a resource from its type and id, None if it does not exist"""
+        return self._by_id.get(resource_type, {}).get(resource_id)
+
+    def get_by_full_url(self, full_url: str) -> Optional[dict]:
+        """Get a resource from its fullUrl (eg. "urn:uuid:..."), None if it does not exist"""
+        return self._by_full_url.get(full_url)
+
+    def count(self, resource_type: str) -> int:
+        """Number of resources of a given type"""
+        return len(self._by_type.get(resource_type, []))
+
+    def counts(self) -> Dict[str, int]:
+        """Number of resources per resource type"""
+        return {
+            resource_type: len(resources)
+            for resource_type, resources in self._by_type.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _as_bundle_index(data: Union[List[dict], FhirBundleIndex]) -> FhirBundleIndex:
+    """Return data as a FhirBundleIndex, building it if needed"""
+    if isinstance(data, FhirBundleIndex):
+        return data
+    return FhirBundleIndex(data)
+
+
+def get_fhir_resource_types(
+    data: Union[List[dict], FhirBundleIndex], resource_type: str
+) -> List[dict]:
     """Get the FHIR resource type from the data
 
+    Passing a FhirBundleIndex avoids scanning the entries again on every call.
+
     Args:
-        data: The data
+        data: The entries of the bundle or a FhirBundleIndex
         resource_type: The resource type it can be
         "Patient", "Observation", "Condition", "Procedure",
         "MedicationRequest", "CarePlan", "CareTeam", "Encounter",
@@ -47,21 +288,12 @@ def get_fhir_resource_types(data: dict, resource_type: str) -> List[dict]:
     Returns:
         The resource type as a list of dictionaries or an empty list
     """
-    entry_list = []
-    for entry in data:
-        if entry["resource"]["resourceType"] == resource_type:
-            entry_list.append(entry["resource"])
-    return entry_list
+    return _as_bundle_index(data).get_resources(resource_type)
 
 
-def get_list_of_resources(data: dict) -> List[str]:
+def get_list_of_resources(data: Union[List[dict], FhirBundleIndex]) -> List[str]:
     """Get a list of resources from the data"""
-    resource_list = []
-    for entry in data:
-        # Add the resource type to the list if it is not already there
-        if entry["resource"]["resourceType"] not in resource_list:
-            resource_list.append(entry["resource"]["resourceType"])
-    return resource_list
+    return _as_bundle_index(data).resource_types
 
 
 # Example of resources types in HRIR format
@@ -96,9 +328,13 @@ def main():
     # Example of entry is a Patient, an Observation, a Condition, etc.
     data = read_fhir_file(FULL_PATH)
 
+    # Group the resources by type in a single pass over the entries
+    # so that every lookup below is a dictionary access
+    bundle_index = FhirBundleIndex(data)
+
     # Get list of resources in the data
     # A resource is a data type that is used to represent a record in FHIR
-    resource_list = get_list_of_resources(data)
+    resource_list = get_list_of_resources(bundle_index)
     console.print("The list of resources presents in the data is:")
     console.print(resource_list)
 
@@ -106,7 +342,7 @@ def main():
     # The patient is a resource that represents a person receiving care
     # It contains information about the patient
     # Example of information is the name
-    patient = get_fhir_resource_types(data, "Patient")
+    patient = get_fhir_resource_types(bundle_index, "Patient")
     console.print("Patient is:")
     console.print(patient)
 
@@ -118,7 +354,7 @@ def main():
     # Example of value is the systolic and diastolic pressure
     # Example of unit is mmHg
     # Example of observation is the temperature
-    observations = get_fhir_resource_types(data, "Observation")
+    observations = get_fhir_resource_types(bundle_index, "Observation")
     console.print("The Oservation are:",style="bold")
     console.print(observations)
 
@@ -134,7 +370,7 @@ def main():
     # Example of information is the onset date of the diagnosis
     # Example of onset date is the date when the diagnosis was made
     # Example of information is the abatement date of the diagnosis
-    conditions = get_fhir_resource_types(data, "Condition")
+    conditions = get_fhir_resource_types(bundle_index, "Condition")
     console.print("Conditions are:")
     console.print(conditions)
 
@@ -145,7 +381,7 @@ def main():
     # Example of code is the ICD-10 code, ICD-10 code (eg. 01.23, 01.24)
     # Example of information is the status of the procedure
     # Example of status is the completed or in-progress status
-    procedures = get_fhir_resource_types(data, "Procedure")
+    procedures = get_fhir_resource_types(bundle_index, "Procedure")
     console.print("Procedures are:")
     console.print(procedures)
 
@@ -160,7 +396,7 @@ def main():
     # Example of dosage is the dose quantity, dose unit, dose timing
     # Example of information is the duration of the medication
     # Example of duration is the duration quantity, duration unit
-    medications = get_fhir_resource_types(data, "MedicationRequest")
+    medications = get_fhir_resource_types(bundle_index, "MedicationRequest")
     console.print("Medications are:")
     console.print(medications)
 
@@ -177,7 +413,7 @@ def main():
     # Example of goal is the goal description, goal status
     # Example of information is the activity of the care plan
     # Example of activity is the activity description, activity status
-    care_plans = get_fhir_resource_types(data, "CarePlan")
+    care_plans = get_fhir_resource_types(bundle_index, "CarePlan")
     console.print("Care plans are:")
     console.print(care_plans)
 
@@ -194,7 +430,7 @@ def main():
     # Example of managing organization is the organization name, organization type
     # Example of information is the reason of the care team
     # Example of reason is the reason description, reason code
-    care_teams = get_fhir_resource_types(data, "CareTeam")
+    care_teams = get_fhir_resource_types(bundle_index, "CareTeam")
     console.print("Care teams are:")
     console.print(care_teams)
 
@@ -212,7 +448,7 @@ def main():
     # Example of period is the start date, end date
     # Example of information is the reason of the encounter
     # Example of reason is the reason description, reason code
-    encounters = get_fhir_resource_types(data, "Encounter")
+    encounters = get_fhir_resource_types(bundle_index, "Encounter")
     console.print("Encounters are:", style="bold")
     console.print(encounters)
 
@@ -228,7 +464,7 @@ def main():
     # Example of information is the result of the diagnostic report
     # Example of result is the result value, result unit
     # Example of information is the conclusion of the diagnostic report
-    diagnostic_reports = get_fhir_resource_types(data, "DiagnosticReport")
+    diagnostic_reports = get_fhir_resource_types(bundle_index, "DiagnosticReport")
     console.print("Diagnostic reports are:")
     console.print(diagnostic_reports)
 
@@ -244,7 +480,7 @@ def main():
     # Example of information is the patient of the immunization
     # Example of patient is the patient name
     # Example of information is the encounter of the immunization
-    immunizations = get_fhir_resource_types(data, "Immunization")
+    immunizations = get_fhir_resource_types(bundle_index, "Immunization")
     console.print("Immunizations are:")
     console.print(immunizations)
 
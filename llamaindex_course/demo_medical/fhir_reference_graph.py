@@ -0,0 +1,161 @@
+""" Reference graph of the resources of a FHIR Bundle """
+
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from rich.console import Console
+
+from llamaindex_course.demo_medical.fhir_reader import (
+    FULL_PATH,
+    FhirBundleIndex,
+    iter_fhir_entries,
+)
+
+
+def resource_key(entry: dict) -> str:
+    """Key of the resource of an entry in the graph
+
+    The fullUrl of the entry (eg. "urn:uuid:..."), or "ResourceType/id" for
+    the resources without a fullUrl (eg. resources read from NDJSON files).
+    """
+    if "fullUrl" in entry:
+        return entry["fullUrl"]
+    resource = entry["resource"]
+    return f"{resource['resourceType']}/{resource.get('id')}"
+
+
+def iter_references(value: Any) -> Iterator[str]:
+    """Yield the "reference" strings found anywhere in a resource"""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key == "reference" and isinstance(item, str):
+                yield item
+            else:
+                yield from iter_references(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from iter_references(item)
+
+
+class FhirReferenceGraph:
+    """Graph of the references between the resources of a bundle
+
+    The graph is built once with adjacency lists in both directions:
+    the resources a resource points to, and the resources pointing to it
+    grouped by resource type. Every hop is a dictionary lookup, for example:
+
+    - graph.referenced_by(encounter_key, "Observation"): observations of an encounter
+    - graph.referenced_by(patient_key): everything about a patient
+    - graph.references(claim_key): what a claim points to
+    """
+
+    def __init__(self, entries: Iterable[dict]):
+        """Build the graph
+        Args:
+            entries: The entries of the bundle (as returned by read_fhir_file)
+        """
+        self._resources: Dict[str, dict] = {}
+        # "ResourceType/id" aliases of the keys, to resolve relative references
+        self._aliases: Dict[str, str] = {}
+        self._outgoing: Dict[str, List[str]] = {}
+        self._incoming: Dict[str, Dict[str, List[str]]] = {}
+
+        entries = list(entries)
+        for entry in entries:
+            key = resource_key(entry)
+            resource = entry["resource"]
+            self._resources[key] = resource
+            if "id" in resource:
+                self._aliases[f"{resource['resourceType']}/{resource['id']}"] = key
+
+        for entry in entries:
+            source = resource_key(entry)
+            source_type = entry["resource"]["resourceType"]
+            targets: List[str] = []
+            seen = {source}
+            for reference in iter_references(entry["resource"]):
+                target = self._resolve_key(reference)
+                if target is None or target in seen:
+                    continue
+                seen.add(target)
+                targets.append(target)
+                self._incoming.setdefault(target, {}).setdefault(
+                    source_type, []
+                ).append(source)
+            self._outgoing[source] = targets
+
+    @classmethod
+    def from_bundle_index(cls, bundle_index: FhirBundleIndex) -> "FhirReferenceGraph":
+        """Build the graph from the entries of a FhirBundleIndex"""
+        return cls(bundle_index.entries)
+
+    def _resolve_key(self, reference: str) -> Optional[str]:
+        if reference in self._resources:
+            return reference
+        return self._aliases.get(reference)
+
+    def __len__(self) -> int:
+        return len(self._resources)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._resources
+
+    def keys(self, resource_type: Optional[str] = None) -> List[str]:
+        """Keys of the resources, optionally only those of a resource type"""
+        return [
+            key
+            for key, resource in self._resources.items()
+            if resource_type is None or resource["resourceType"] == resource_type
+        ]
+
+    def get_resource(self, key: str) -> Optional[dict]:
+        """Get a resource from its key, None if it is not in the bundle"""
+        return self._resources.get(key)
+
+    def resolve(self, reference: str) -> Optional[dict]:
+        """Get the resource a reference points to ("urn:uuid:..." or "Type/id")"""
+        key = self._resolve_key(reference)
+        return None if key is None else self._resources[key]
+
+    def references(self, key: str) -> List[str]:
+        """Keys of the resources the resource points to"""
+        return list(self._outgoing.get(key, []))
+
+    def referenced_by(self, key: str, resource_type: Optional[str] = None) -> List[str]:
+        """Keys of the resources pointing to the resource
+
+        Args:
+            key: The key of the resource
+            resource_type: If given, only the resources of this type
+        Returns:
+            The keys of the resources
+        """
+        incoming = self._incoming.get(key, {})
+        if resource_type is not None:
+            return list(incoming.get(resource_type, []))
+        return [source for sources in incoming.values() for source in sources]
+
+    def referenced_by_resources(
+        self, key: str, resource_type: Optional[str] = None
+    ) -> List[dict]:
+        """Resources pointing to the resource (see referenced_by)"""
+        return [
+            self._resources[source] for source in self.referenced_by(key, resource_type)
+        ]
+
+
+def main():
+    """
+    Print the resources attached to each encounter of the example bundle
+    """
+    console = Console()
+    graph = FhirReferenceGraph(iter_fhir_entries(FULL_PATH))
+    for key in graph.keys("Encounter"):
+        resource = graph.get_resource(key)
+        attached = graph.referenced_by(key)
+        console.print(f"Encounter {key} ({resource['period']['start']}):", style="bold")
+        for source in attached:
+            console.print(f"  {graph.get_resource(source)['resourceType']} {source}")
+
+
+if __name__ == "__main__":
+    main()
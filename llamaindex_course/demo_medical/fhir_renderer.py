@@ -0,0 +1,376 @@
+""" Compact text rendering of FHIR resources for indexing """
+
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from rich.console import Console
+
+from llamaindex_course.demo_medical.fhir_reader import FULL_PATH, iter_fhir_entries
+
+# A renderer turns a resource into a compact text
+ResourceRenderer = Callable[[dict], str]
+
+# A tokenizer returns the tokens of a text
+Tokenizer = Callable[[str], List[Any]]
+
+# Fields that are never rendered: identifiers, technical metadata and the
+# generated narrative (which repeats the other fields as HTML)
+PRUNED_FIELDS = frozenset(
+    {
+        "resourceType",
+        "id",
+        "meta",
+        "text",
+        "identifier",
+        "extension",
+        "modifierExtension",
+        "contained",
+        "system",
+        "request",
+        "fullUrl",
+        "telecom",
+    }
+)
+
+
+def _date(value: Optional[str]) -> str:
+    """Keep the date part of a FHIR date time"""
+    return (value or "")[:10]
+
+
+def _concept(concept: Optional[dict]) -> str:
+    """Text of a CodeableConcept: its text, or the display (or code) of its first coding"""
+    if not concept:
+        return ""
+    if concept.get("text"):
+        return concept["text"]
+    for coding in concept.get("coding", []):
+        if coding.get("display") or coding.get("code"):
+            return coding.get("display") or coding["code"]
+    return ""
+
+
+def _concepts(concepts: Optional[List[dict]]) -> str:
+    return ", ".join(filter(None, (_concept(concept) for concept in concepts or [])))
+
+
+def _quantity(quantity: Optional[dict]) -> str:
+    if not quantity or quantity.get("value") is None:
+        return ""
+    value = quantity["value"]
+    if isinstance(value, float):
+        value = f"{value:g}"
+    return f"{value} {quantity.get('unit') or quantity.get('code') or ''}".strip()
+
+
+def _money(money: Optional[dict]) -> str:
+    if not money or money.get("value") is None:
+        return ""
+    return f"{money['value']:.2f} {money.get('currency', '')}".strip()
+
+
+def _display(reference: Optional[dict]) -> str:
+    """Display of a reference, the reference itself (an uuid) is not rendered"""
+    return (reference or {}).get("display", "")
+
+
+def _period(period: Optional[dict]) -> str:
+    if not period:
+        return ""
+    start, end = _date(period.get("start")), _date(period.get("end"))
+    if end and end != start:
+        return f"{start} to {end}"
+    return start
+
+
+def _join(*parts: str) -> str:
+    """Join the non empty parts of a rendering"""
+    return ", ".join(part for part in parts if part)
+
+
+def _labeled(label: str, value: str) -> str:
+    return f"{label} {value}" if value else ""
+
+
+def _observation_value(observation: dict) -> str:
+    if "valueQuantity" in observation:
+        return _quantity(observation["valueQuantity"])
+    if "valueCodeableConcept" in observation:
+        return _concept(observation["valueCodeableConcept"])
+    for key in ("valueString", "valueBoolean", "valueInteger"):
+        if key in observation:
+            return str(observation[key])
+    return ""
+
+
+def render_patient(patient: dict) -> str:
+    """Render a Patient"""
+    names = patient.get("name") or [{}]
+    name = " ".join(names[0].get("given", []) + [names[0].get("family", "")]).strip()
+    address = (patient.get("address") or [{}])[0]
+    return "Patient: " + _join(
+        name,
+        patient.get("gender", ""),
+        _labeled("born", _date(patient.get("birthDate"))),
+        _labeled("deceased", _date(patient.get("deceasedDateTime"))),
+        _concept(patient.get("maritalStatus")),
+        _join(address.get("city", ""), address.get("state", "")),
+    )
+
+
+def render_observation(observation: dict) -> str:
+    """Render an Observation, with its components (eg. blood pressure)"""
+    components = [
+        f"{_concept(component.get('code'))} {_observation_value(component)}"
+        for component in observation.get("component", [])
+    ]
+    value = _observation_value(observation) or "; ".join(components)
+    return (
+        f"Observation {_date(observation.get('effectiveDateTime'))}: "
+        f"{_concept(observation.get('code'))} = {value}"
+    )
+
+
+def render_condition(condition: dict) -> str:
+    """Render a Condition"""
+    return "Condition: " + _join(
+        _concept(condition.get("code")),
+        _concept(condition.get("clinicalStatus")),
+        _labeled("onset", _date(condition.get("onsetDateTime"))),
+        _labeled("abated", _date(condition.get("abatementDateTime"))),
+    )
+
+
+def render_encounter(encounter: dict) -> str:
+    """Render an Encounter"""
+    participants = ", ".join(
+        filter(
+            None,
+            (_display(participant.get("individual")) for participant in encounter.get("participant", [])),
+        )
+    )
+    return f"Encounter {_period(encounter.get('period'))}: " + _join(
+        _concepts(encounter.get("type")),
+        (encounter.get("class") or {}).get("code", ""),
+        _labeled("reason", _concepts(encounter.get("reasonCode"))),
+        _labeled("with", participants),
+        _labeled("at", _display(encounter.get("serviceProvider"))),
+    )
+
+
+def render_procedure(procedure: dict) -> str:
+    """Render a Procedure"""
+    performed = _period(procedure.get("performedPeriod")) or _date(
+        procedure.get("performedDateTime")
+    )
+    return f"Procedure {performed}: " + _join(
+        _concept(procedure.get("code")),
+        procedure.get("status", ""),
+        _labeled(
+            "reason",
+            ", ".join(_display(reason) for reason in procedure.get("reasonReference", [])),
+        ),
+    )
+
+
+def render_immunization(immunization: dict) -> str:
+    """Render an Immunization"""
+    return (
+        f"Immunization {_date(immunization.get('occurrenceDateTime'))}: "
+        + _join(_concept(immunization.get("vaccineCode")), immunization.get("status", ""))
+    )
+
+
+def render_medication_request(medication_request: dict) -> str:
+    """Render a MedicationRequest"""
+    return f"Medication {_date(medication_request.get('authoredOn'))}: " + _join(
+        _concept(medication_request.get("medicationCodeableConcept"))
+        or _display(medication_request.get("medicationReference")),
+        medication_request.get("status", ""),
+        _labeled("by", _display(medication_request.get("requester"))),
+    )
+
+
+def render_diagnostic_report(report: dict) -> str:
+    """Render a DiagnosticReport"""
+    results = ", ".join(_display(result) for result in report.get("result", []))
+    return f"Diagnostic report {_date(report.get('effectiveDateTime'))}: " + _join(
+        _concept(report.get("code")), _labeled("results", results)
+    )
+
+
+def render_care_plan(care_plan: dict) -> str:
+    """Render a CarePlan"""
+    activities = ", ".join(
+        _concept(activity.get("detail", {}).get("code"))
+        for activity in care_plan.get("activity", [])
+    )
+    return f"Care plan {_period(care_plan.get('period'))}: " + _join(
+        _concepts(care_plan.get("category")),
+        care_plan.get("status", ""),
+        _labeled("activities", activities),
+    )
+
+
+def render_claim(claim: dict) -> str:
+    """Render a Claim"""
+    items = ", ".join(
+        _concept(item.get("productOrService")) for item in claim.get("item", [])
+    )
+    return f"Claim {_period(claim.get('billablePeriod'))}: " + _join(
+        _concept(claim.get("type")),
+        _labeled("provider", _display(claim.get("provider"))),
+        _labeled("items", items),
+        _labeled("total", _money(claim.get("total"))),
+    )
+
+
+def _compact_value(value: Any) -> str:
+    """Render any value: concepts, quantities, references, periods and nested fields"""
+    if isinstance(value, dict):
+        if "coding" in value or ("text" in value and len(value) == 1):
+            return _concept(value)
+        if "reference" in value:
+            return _display(value)
+        if "value" in value and ("unit" in value or "code" in value):
+            return _quantity(value)
+        if "value" in value and "currency" in value:
+            return _money(value)
+        if set(value) <= {"start", "end"}:
+            return _period(value)
+        return "; ".join(
+            f"{key} {rendered}"
+            for key, rendered in (
+                (key, _compact_value(item))
+                for key, item in value.items()
+                if key not in PRUNED_FIELDS
+            )
+            if rendered
+        )
+    if isinstance(value, list):
+        return ", ".join(filter(None, (_compact_value(item) for item in value)))
+    if isinstance(value, str) and len(value) >= 19 and value[4] == "-" and value[10] == "T":
+        return _date(value)
+    if isinstance(value, bool):
+        return "yes" if value else "no"
+    return str(value)
+
+
+def render_generic(resource: dict) -> str:
+    """Render a resource without a dedicated renderer, pruning the technical fields"""
+    fields = (
+        (key, _compact_value(value))
+        for key, value in resource.items()
+        if key not in PRUNED_FIELDS
+    )
+    return f"{resource['resourceType']}: " + "; ".join(
+        f"{key} {rendered}" for key, rendered in fields if rendered
+    )
+
+
+# Renderers by resource type, render_generic is used for the other types
+RENDERERS: Dict[str, ResourceRenderer] = {
+    "Patient": render_patient,
+    "Observation": render_observation,
+    "Condition": render_condition,
+    "Encounter": render_encounter,
+    "Procedure": render_procedure,
+    "Immunization": render_immunization,
+    "MedicationRequest": render_medication_request,
+    "DiagnosticReport": render_diagnostic_report,
+    "CarePlan": render_care_plan,
+    "Claim": render_claim,
+}
+
+
+def render_resource(
+    resource: dict, renderers: Optional[Dict[str, ResourceRenderer]] = None
+) -> str:
+    """Render a resource as a compact text
+
+    Args:
+        resource: The resource
+        renderers: Renderers by resource type, defaults to RENDERERS.
+        Pass {**RENDERERS, "Observation": my_renderer} to override a type
+    Returns:
+        The text: display names, values with units, dates and status
+    """
+    renderers = RENDERERS if renderers is None else renderers
+    renderer = renderers.get(resource["resourceType"], render_generic)
+    return renderer(resource)
+
+
+class RenderStats(NamedTuple):
+    """Size of the resources rendered with str() and with render_resource"""
+
+    resources: int
+    original_chars: int
+    rendered_chars: int
+    original_tokens: int
+    rendered_tokens: int
+
+    @property
+    def char_reduction(self) -> float:
+        """Ratio original / rendered number of characters"""
+        return self.original_chars / max(self.rendered_chars, 1)
+
+    @property
+    def token_reduction(self) -> float:
+        """Ratio original / rendered number of tokens"""
+        return self.original_tokens / max(self.rendered_tokens, 1)
+
+
+def measure_rendering(
+    resources: Iterable[dict],
+    renderers: Optional[Dict[str, ResourceRenderer]] = None,
+    tokenizer: Optional[Tokenizer] = None,
+) -> RenderStats:
+    """Compare the size of str(resource) and render_resource(resource)
+
+    Args:
+        resources: The resources
+        renderers: Renderers by resource type, defaults to RENDERERS
+        tokenizer: The tokenizer, defaults to the llama_index tokenizer
+    Returns:
+        The number of characters and tokens of both renderings
+    """
+    if tokenizer is None:
+        # pylint: disable=import-outside-toplevel
+        from llama_index.core.utils import get_tokenizer
+
+        tokenizer = get_tokenizer()
+    count = original_chars = rendered_chars = original_tokens = rendered_tokens = 0
+    for resource in resources:
+        original = str(resource)
+        rendered = render_resource(resource, renderers)
+        count += 1
+        original_chars += len(original)
+        rendered_chars += len(rendered)
+        original_tokens += len(tokenizer(original))
+        rendered_tokens += len(tokenizer(rendered))
+    return RenderStats(
+        count, original_chars, rendered_chars, original_tokens, rendered_tokens
+    )
+
+
+def main():
+    """
+    Render the resources of the example bundle and print the size reduction
+    """
+    console = Console()
+    resources = [entry["resource"] for entry in iter_fhir_entries(FULL_PATH)]
+    seen_types = set()
+    for resource in resources:
+        if resource["resourceType"] not in seen_types:
+            seen_types.add(resource["resourceType"])
+            console.print(render_resource(resource))
+    stats = measure_rendering(resources)
+    console.print(
+        f"{stats.resources} resources: {stats.original_chars} -> {stats.rendered_chars} "
+        f"characters (x{stats.char_reduction:.1f}), {stats.original_tokens} -> "
+        f"{stats.rendered_tokens} tokens (x{stats.token_reduction:.1f})",
+        style="bold",
+    )
+
+
+if __name__ == "__main__":
+    main()
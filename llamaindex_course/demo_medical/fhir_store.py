@@ -0,0 +1,222 @@
+""" SQLite store of FHIR resources with indexes on patient, encounter, code and date """
+
+import os
+import sys
+import json
+import sqlite3
+from typing import Dict, Iterable, List, Optional
+
+from rich.console import Console
+
+from llamaindex_course.demo_medical.fhir_ingest import ingest_fhir_files
+from llamaindex_course.demo_medical.fhir_reader import FULL_PATH, FhirBundleIndex
+from llamaindex_course.demo_medical.fhir_reference_graph import resource_key
+
+# Path of the database, can be set with the FHIR_DB_PATH environment variable
+DB_PATH = os.environ.get("FHIR_DB_PATH", "fhir.db")
+
+# Number of rows inserted per executemany call
+INSERT_BATCH_SIZE = 1000
+
+# One generic table: the resource is stored as JSON and the columns used by
+# the queries are JSON1 generated columns, so that they can be indexed
+# without a table per resource type.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS resources (
+    key TEXT PRIMARY KEY,
+    resource_type TEXT NOT NULL,
+    resource_id TEXT,
+    resource TEXT NOT NULL,
+    patient_ref TEXT GENERATED ALWAYS AS (coalesce(
+        json_extract(resource, '$.subject.reference'),
+        json_extract(resource, '$.patient.reference'),
+        json_extract(resource, '$.beneficiary.reference')
+    )) VIRTUAL,
+    encounter_ref TEXT GENERATED ALWAYS AS (
+        json_extract(resource, '$.encounter.reference')
+    ) VIRTUAL,
+    code TEXT GENERATED ALWAYS AS (coalesce(
+        json_extract(resource, '$.code.coding[0].code'),
+        json_extract(resource, '$.vaccineCode.coding[0].code'),
+        json_extract(resource, '$.medicationCodeableConcept.coding[0].code'),
+        json_extract(resource, '$.type[0].coding[0].code')
+    )) VIRTUAL,
+    effective TEXT GENERATED ALWAYS AS (coalesce(
+        json_extract(resource, '$.effectiveDateTime'),
+        json_extract(resource, '$.onsetDateTime'),
+        json_extract(resource, '$.occurrenceDateTime'),
+        json_extract(resource, '$.authoredOn'),
+        json_extract(resource, '$.period.start'),
+        json_extract(resource, '$.performedPeriod.start'),
+        json_extract(resource, '$.billablePeriod.start')
+    )) VIRTUAL
+);
+CREATE INDEX IF NOT EXISTS resources_patient
+    ON resources (patient_ref, resource_type, effective);
+CREATE INDEX IF NOT EXISTS resources_encounter
+    ON resources (encounter_ref, resource_type);
+CREATE INDEX IF NOT EXISTS resources_code
+    ON resources (resource_type, code, effective);
+"""
+
+
+class FhirResourceStore:
+    """Persistent store of FHIR resources in SQLite
+
+    Structured lookups such as "all the conditions of a patient" or "the
+    observations of an encounter" are answered from the indexes instead of
+    scanning the bundles.
+    """
+
+    def __init__(self, db_path: str = DB_PATH):
+        """Open (and create if needed) the database
+        Args:
+            db_path: The path to the database, ":memory:" for an in-memory database
+        """
+        self.db_path = db_path
+        self._connection = sqlite3.connect(db_path)
+        self._connection.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        """Close the database"""
+        self._connection.close()
+
+    def __enter__(self) -> "FhirResourceStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def ingest(self, entries: Iterable[dict], batch_size: int = INSERT_BATCH_SIZE) -> int:
+        """Insert (or replace) bundle entries in the store
+
+        The rows are inserted with executemany in batches, in one transaction.
+
+        Args:
+            entries: The entries of a bundle (with a "resource" and optionally a "fullUrl")
+            batch_size: Number of rows per executemany call
+        Returns:
+            The number of entries inserted
+        """
+        count = 0
+        batch = []
+        with self._connection:
+            for entry in entries:
+                resource = entry["resource"]
+                batch.append(
+                    (
+                        resource_key(entry),
+                        resource["resourceType"],
+                        resource.get("id"),
+                        json.dumps(resource, separators=(",", ":")),
+                    )
+                )
+                if len(batch) >= batch_size:
+                    count += self._insert(batch)
+                    batch = []
+            count += self._insert(batch)
+        return count
+
+    def ingest_bundle_index(self, bundle_index: FhirBundleIndex) -> int:
+        """Insert the entries of a FhirBundleIndex in the store"""
+        return self.ingest(bundle_index.entries)
+
+    def _insert(self, rows: List[tuple]) -> int:
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO resources (key, resource_type, resource_id, resource) "
+            "VALUES (?, ?, ?, ?)",
+            rows,
+        )
+        return len(rows)
+
+    def get(self, key: str) -> Optional[dict]:
+        """Get a resource from its key (fullUrl or "ResourceType/id")"""
+        row = self._connection.execute(
+            "SELECT resource FROM resources WHERE key = ?", (key,)
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def find(
+        self,
+        resource_type: Optional[str] = None,
+        patient: Optional[str] = None,
+        encounter: Optional[str] = None,
+        code: Optional[str] = None,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> List[dict]:
+        """Find resources, sorted by date
+
+        Args:
+            resource_type: The resource type (eg. "Condition")
+            patient: Reference of the patient (eg. "urn:uuid:...")
+            encounter: Reference of the encounter
+            code: The code of the resource (eg. a LOINC or SNOMED CT code)
+            start: First date (ISO 8601, included)
+            end: Last date (ISO 8601, excluded)
+            limit: Maximum number of resources
+        Returns:
+            The resources
+        """
+        conditions = []
+        parameters: List[object] = []
+        for column, value in (
+            ("resource_type", resource_type),
+            ("patient_ref", patient),
+            ("encounter_ref", encounter),
+            ("code", code),
+        ):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                parameters.append(value)
+        if start is not None:
+            conditions.append("effective >= ?")
+            parameters.append(start)
+        if end is not None:
+            conditions.append("effective < ?")
+            parameters.append(end)
+
+        query = "SELECT resource FROM resources"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY effective"
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit)
+        return [json.loads(row[0]) for row in self._connection.execute(query, parameters)]
+
+    def counts(self) -> Dict[str, int]:
+        """Number of resources per resource type"""
+        return dict(
+            self._connection.execute(
+                "SELECT resource_type, count(*) FROM resources GROUP BY resource_type"
+            )
+        )
+
+
+def main():
+    """
+    Load FHIR files in the store and run a few structured queries
+
+    Usage: python -m llamaindex_course.demo_medical.fhir_store [file, directory or glob]
+    """
+    console = Console()
+    path_or_pattern = sys.argv[1] if len(sys.argv) > 1 else FULL_PATH
+
+    with FhirResourceStore() as store:
+        count = store.ingest_bundle_index(ingest_fhir_files(path_or_pattern))
+        console.print(f"Loaded {count} resources in {store.db_path}")
+        console.print(store.counts())
+
+        for patient in store.find("Patient"):
+            patient_ref = f"urn:uuid:{patient['id']}"
+            console.print(f"Conditions of patient {patient_ref}:", style="bold")
+            for condition in store.find("Condition", patient=patient_ref):
+                console.print(
+                    f"{condition['onsetDateTime'][:10]} {condition['code']['text']}"
+                )
+
+
+if __name__ == "__main__":
+    main()
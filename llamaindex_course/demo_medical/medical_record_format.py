@@ -0,0 +1,276 @@
+""" Typed models for FHIR Bundles with a fast, lazily validated loading path """
+
+import json
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Type
+
+from pydantic import BaseModel, ConfigDict, Field, SerializeAsAny, field_validator
+
+
+class Coding(BaseModel):
+    """
+    A code defined by a terminology system (LOINC, SNOMED CT, RxNorm, ...)
+    """
+
+    model_config = ConfigDict(extra="allow")
+
+    system: Optional[str] = None
+    code: Optional[str] = None
+    display: Optional[str] = None
+
+
+class CodeableConcept(BaseModel):
+    """
+    A concept defined by one or more codings and an optional text
+    """
+
+    model_config = ConfigDict(extra="allow")
+
+    coding: List[Coding] = Field(default_factory=list)
+    text: Optional[str] = None
+
+
+class Reference(BaseModel):
+    """
+    A reference to another resource (eg. "urn:uuid:...")
+    """
+
+    model_config = ConfigDict(extra="allow")
+
+    reference: Optional[str] = None
+    display: Optional[str] = None
+
+
+class Quantity(BaseModel):
+    """
+    A measured amount with its unit
+    """
+
+    model_config = ConfigDict(extra="allow")
+
+    value: Optional[float] = None
+    unit: Optional[str] = None
+    system: Optional[str] = None
+    code: Optional[str] = None
+
+
+class Period(BaseModel):
+    """
+    A time period defined by a start and an end date
+    """
+
+    model_config = ConfigDict(extra="allow")
+
+    start: Optional[str] = None
+    end: Optional[str] = None
+
+
+class Resource(BaseModel):
+    """
+    A FHIR resource, the fields that are not modeled are kept as extra fields
+    """
+
+    model_config = ConfigDict(extra="allow")
+
+    resourceType: str
+    id: Optional[str] = None
+    name: Optional[Any] = None
+
+    def validate_resource(self) -> "Resource":
+        """Validate the resource against the model of its resource type
+
+        Resources loaded with the fast path of read_medical_file are not
+        validated, their nested values are plain dictionaries. This method
+        returns the typed and validated model (eg. an Observation).
+
+        Returns:
+            The validated resource
+        Raises:
+            pydantic.ValidationError: if the resource is not valid
+        """
+        model = RESOURCE_MODELS.get(self.resourceType, Resource)
+        return model.model_validate(self.model_dump(exclude_unset=True))
+
+
+class Patient(Resource):
+    """
+    A person receiving care
+    """
+
+    name: List[Dict[str, Any]] = Field(default_factory=list)
+    gender: Optional[str] = None
+    birthDate: Optional[str] = None
+
+
+class Encounter(Resource):
+    """
+    A contact between a patient and a healthcare provider
+    """
+
+    status: Optional[str] = None
+    type: List[CodeableConcept] = Field(default_factory=list)
+    subject: Optional[Reference] = None
+    period: Optional[Period] = None
+    reasonCode: List[CodeableConcept] = Field(default_factory=list)
+
+
+class Observation(Resource):
+    """
+    A measurement or an assertion made about a patient (vital sign, lab result, ...)
+    """
+
+    status: Optional[str] = None
+    category: List[CodeableConcept] = Field(default_factory=list)
+    code: CodeableConcept
+    subject: Optional[Reference] = None
+    encounter: Optional[Reference] = None
+    effectiveDateTime: Optional[str] = None
+    issued: Optional[str] = None
+    valueQuantity: Optional[Quantity] = None
+    valueCodeableConcept: Optional[CodeableConcept] = None
+    component: List[Dict[str, Any]] = Field(default_factory=list)
+
+
+class Condition(Resource):
+    """
+    A diagnosis
+    """
+
+    clinicalStatus: Optional[CodeableConcept] = None
+    verificationStatus: Optional[CodeableConcept] = None
+    code: CodeableConcept
+    subject: Optional[Reference] = None
+    encounter: Optional[Reference] = None
+    onsetDateTime: Optional[str] = None
+    abatementDateTime: Optional[str] = None
+
+
+# Typed models by resource type, the other resource types use Resource
+RESOURCE_MODELS: Dict[str, Type[Resource]] = {
+    "Patient": Patient,
+    "Encounter": Encounter,
+    "Observation": Observation,
+    "Condition": Condition,
+}
+
+
+class Entry(BaseModel):
+    """
+    An entry of a FHIR Bundle
+    """
+
+    model_config = ConfigDict(extra="allow")
+
+    fullUrl: Optional[str] = None
+    resource: SerializeAsAny[Resource]
+
+    @field_validator("resource", mode="before")
+    @classmethod
+    def _validate_typed_resource(cls, value: Any) -> Any:
+        """Validate the resource with the model of its resource type"""
+        if isinstance(value, dict):
+            model = RESOURCE_MODELS.get(value.get("resourceType"), Resource)
+            return model.model_validate(value)
+        return value
+
+
+class Bundle(BaseModel):
+    """
+    A FHIR Bundle: a collection of resources
+    """
+
+    model_config = ConfigDict(extra="allow")
+
+    resourceType: str = "Bundle"
+    type: Optional[str] = None
+    entry: List[Entry] = Field(default_factory=list)
+
+    @field_validator("resourceType")
+    @classmethod
+    def _check_bundle(cls, value: str) -> str:
+        if value != "Bundle":
+            raise ValueError("The document does not appear to be a FHIR Bundle")
+        return value
+
+    def get_resources(self, resource_type: str) -> List[Resource]:
+        """Get the resources of a given type"""
+        return [
+            entry.resource
+            for entry in self.entry
+            if entry.resource.resourceType == resource_type
+        ]
+
+    def validate_resources(self, resource_type: Optional[str] = None) -> List[Resource]:
+        """Validate the resources on demand
+
+        Args:
+            resource_type: If given, only the resources of this type are validated
+        Returns:
+            The validated resources
+        """
+        return [
+            entry.resource.validate_resource()
+            for entry in self.entry
+            if resource_type is None or entry.resource.resourceType == resource_type
+        ]
+
+
+# Resource types whose string values are interned in compact mode.
+# Observations repeat the same coding systems, codes, units and references
+# hundreds of times in a bundle
+COMPACT_RESOURCE_TYPES = frozenset({"Observation"})
+
+
+def _intern_strings(value: Any) -> Any:
+    """Intern the strings of a decoded JSON value so that repeated ones share memory"""
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, dict):
+        return {key: _intern_strings(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_intern_strings(item) for item in value]
+    return value
+
+
+def _construct_bundle(data: dict, compact: bool = False) -> Bundle:
+    """Build a Bundle from decoded JSON without validating the resources"""
+    if data.get("resourceType") != "Bundle":
+        raise ValueError("The document does not appear to be a FHIR Bundle")
+    entries = []
+    for entry in data.get("entry", []):
+        resource = entry["resource"]
+        if compact and resource.get("resourceType") in COMPACT_RESOURCE_TYPES:
+            resource = _intern_strings(resource)
+        entry_fields = dict(entry)
+        entry_fields["resource"] = Resource.model_construct(**resource)
+        entries.append(Entry.model_construct(**entry_fields))
+    bundle_fields = {key: value for key, value in data.items() if key != "entry"}
+    return Bundle.model_construct(entry=entries, **bundle_fields)
+
+
+def read_medical_file(
+    file_path: Path, validate: bool = False, compact: bool = False
+) -> Bundle:
+    """Read a FHIR Bundle from a JSON file
+
+    By default the bundle is built without pydantic validation: every
+    resource is a Resource whose nested values are plain dictionaries.
+    Call Resource.validate_resource or Bundle.validate_resources to validate
+    the resources that are actually used.
+
+    Args:
+        file_path: The path to the file
+        validate: Validate every resource with its typed model while reading
+        compact: Intern the strings of the Observations so that the codes,
+        units and references repeated across the bundle are stored once
+        (ignored when validate is True)
+    Returns:
+        The bundle
+    Raises:
+        ValueError: if the document is not a FHIR Bundle
+    """
+    raw = Path(file_path).read_bytes()
+    if validate:
+        return Bundle.model_validate_json(raw)
+    return _construct_bundle(json.loads(raw), compact=compact)
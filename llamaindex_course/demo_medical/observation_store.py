@@ -0,0 +1,300 @@
+""" Columnar store of FHIR Observations for vectorized vital-sign and lab queries """
+
+import re
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+from rich.console import Console
+
+from llamaindex_course.demo_medical.fhir_reader import (
+    FULL_PATH,
+    FhirBundleIndex,
+    iter_fhir_entries,
+)
+
+# A date can be given as an ISO 8601 string, a datetime or a numpy datetime64
+DateLike = Union[str, datetime, np.datetime64]
+
+
+class LatestValue(NamedTuple):
+    """Latest numeric value of an observation code"""
+
+    code: str
+    display: str
+    effective: np.datetime64
+    value: float
+    unit: str
+
+
+class CodeStats(NamedTuple):
+    """Statistics of the numeric values of an observation code"""
+
+    code: str
+    display: str
+    count: int
+    min: float
+    max: float
+    mean: float
+    unit: str
+
+
+# FHIR partial dates: a year, a year and month, or a date without a time
+_PARTIAL_DATE = re.compile(r"\d{4}(-\d{2}(-\d{2})?)?")
+
+# Units of numpy datetimes coarser than a second (a period, not an instant)
+_PERIOD_UNITS = ("Y", "M", "W", "D", "h", "m")
+
+
+def _to_epoch_seconds(value: Optional[DateLike], end_of_period: bool = False) -> int:
+    """Convert a date to seconds since the epoch (UTC)
+
+    A partial date ("2015", "2015-03", "2015-03-01") is a period: it is
+    converted to its first second, or to its last second when
+    end_of_period is True (the end of a range includes the whole day).
+    """
+    if isinstance(value, str) and _PARTIAL_DATE.fullmatch(value):
+        value = np.datetime64(value)
+    if isinstance(value, np.datetime64):
+        if end_of_period and np.datetime_data(value.dtype)[0] in _PERIOD_UNITS:
+            return int((value + 1).astype("datetime64[s]").astype(np.int64)) - 1
+        return int(value.astype("datetime64[s]").astype(np.int64))
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+def _reference(resource: dict, field: str) -> Optional[str]:
+    return (resource.get(field) or {}).get("reference")
+
+
+def _first_coding(concept: dict) -> Tuple[str, str]:
+    """Return the (code, display) of the first coding of a CodeableConcept"""
+    coding = (concept.get("coding") or [{}])[0]
+    code = coding.get("code", "")
+    return code, coding.get("display") or concept.get("text") or code
+
+
+class ObservationStore:
+    """Observations stored as NumPy columns
+
+    Each row is one value: an Observation with a valueQuantity, or one
+    component of a multi-component Observation (eg. the systolic and the
+    diastolic values of a blood pressure). The columns are:
+
+    - code: index in the codes vocabulary (LOINC code)
+    - value: the numeric value, NaN when the value is not a quantity
+    - unit: index in the units vocabulary
+    - effective: effective date time (datetime64[s], UTC)
+    - encounter: index in the encounters vocabulary, -1 when missing
+
+    The rows are sorted by code then by effective date time so that the
+    rows of a code are a contiguous slice found with a binary search.
+    """
+
+    def __init__(self, rows: Iterable[Tuple[str, str, float, str, int, Optional[str]]]):
+        """Build the columns
+        Args:
+            rows: Tuples of (code, display, value, unit, effective epoch seconds,
+            encounter reference)
+        """
+        codes: Dict[str, int] = {}
+        units: Dict[str, int] = {}
+        encounters: Dict[str, int] = {}
+        self.displays: Dict[str, str] = {}
+        code_column: List[int] = []
+        value_column: List[float] = []
+        unit_column: List[int] = []
+        effective_column: List[int] = []
+        encounter_column: List[int] = []
+        for code, display, value, unit, effective, encounter in rows:
+            code_column.append(codes.setdefault(code, len(codes)))
+            self.displays.setdefault(code, display)
+            value_column.append(value)
+            unit_column.append(units.setdefault(unit, len(units)))
+            effective_column.append(effective)
+            encounter_column.append(
+                -1 if encounter is None else encounters.setdefault(encounter, len(encounters))
+            )
+
+        self.codes = np.array(list(codes), dtype=object)
+        self.units = np.array(list(units), dtype=object)
+        self.encounters = np.array(list(encounters), dtype=object)
+
+        code_ids = np.array(code_column, dtype=np.int32)
+        effective = np.array(effective_column, dtype=np.int64)
+        order = np.lexsort((effective, code_ids))
+        self.code = code_ids[order]
+        self.value = np.array(value_column, dtype=np.float64)[order]
+        self.unit = np.array(unit_column, dtype=np.int32)[order]
+        self.effective = effective[order].astype("datetime64[s]")
+        self.encounter = np.array(encounter_column, dtype=np.int32)[order]
+        self._code_ids = codes
+        self._encounter_ids = encounters
+
+    @classmethod
+    def from_resources(cls, resources: Iterable[dict]) -> "ObservationStore":
+        """Build the store from Observation resources (other resource types are ignored)"""
+        return cls(_iter_rows(resources))
+
+    @classmethod
+    def from_bundle_index(cls, bundle_index: FhirBundleIndex) -> "ObservationStore":
+        """Build the store from the Observations of a FhirBundleIndex"""
+        return cls.from_resources(bundle_index.get_resources("Observation"))
+
+    def __len__(self) -> int:
+        return len(self.code)
+
+    def _code_slice(self, code: str) -> slice:
+        """Slice of the rows of a code"""
+        code_id = self._code_ids.get(code)
+        if code_id is None:
+            return slice(0, 0)
+        start, end = np.searchsorted(self.code, [code_id, code_id + 1])
+        return slice(int(start), int(end))
+
+    def trend(
+        self,
+        code: str,
+        start: Optional[DateLike] = None,
+        end: Optional[DateLike] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Values of a code over a date range, sorted by date
+
+        Args:
+            code: The observation code (eg. "8302-2" for the body height)
+            start: First date of the range (included), None for no lower bound
+            end: Last date of the range (included, a date without a time
+            includes the whole day), None for no upper bound
+        Returns:
+            The effective dates and the values as two arrays
+        """
+        rows = self._code_slice(code)
+        effective = self.effective[rows]
+        first = 0
+        last = len(effective)
+        if start is not None:
+            first = np.searchsorted(
+                effective, np.datetime64(_to_epoch_seconds(start), "s"), side="left"
+            )
+        if end is not None:
+            last = np.searchsorted(
+                effective,
+                np.datetime64(_to_epoch_seconds(end, end_of_period=True), "s"),
+                side="right",
+            )
+        return effective[first:last], self.value[rows][first:last]
+
+    def _numeric_groups(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Indices of the numeric rows and start offset of each code group in them"""
+        numeric = np.flatnonzero(~np.isnan(self.value))
+        if len(numeric) == 0:
+            return numeric, numeric
+        codes = self.code[numeric]
+        group_starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        return numeric, group_starts
+
+    def latest_values(self) -> Dict[str, LatestValue]:
+        """Latest numeric value of every code"""
+        numeric, group_starts = self._numeric_groups()
+        if len(numeric) == 0:
+            return {}
+        # The rows of a code are sorted by date: the latest is the last of the group
+        latest = numeric[np.r_[group_starts[1:], len(numeric)] - 1]
+        result = {}
+        for row in latest:
+            code = self.codes[self.code[row]]
+            result[code] = LatestValue(
+                code=code,
+                display=self.displays[code],
+                effective=self.effective[row],
+                value=float(self.value[row]),
+                unit=self.units[self.unit[row]],
+            )
+        return result
+
+    def stats(self) -> Dict[str, CodeStats]:
+        """Count, min, max and mean of the numeric values of every code"""
+        numeric, group_starts = self._numeric_groups()
+        if len(numeric) == 0:
+            return {}
+        values = self.value[numeric]
+        counts = np.diff(np.r_[group_starts, len(numeric)])
+        minimums = np.minimum.reduceat(values, group_starts)
+        maximums = np.maximum.reduceat(values, group_starts)
+        means = np.add.reduceat(values, group_starts) / counts
+        result = {}
+        for index, first in enumerate(group_starts):
+            row = numeric[first]
+            code = self.codes[self.code[row]]
+            result[code] = CodeStats(
+                code=code,
+                display=self.displays[code],
+                count=int(counts[index]),
+                min=float(minimums[index]),
+                max=float(maximums[index]),
+                mean=float(means[index]),
+                unit=self.units[self.unit[row]],
+            )
+        return result
+
+    def for_encounter(self, encounter_reference: str) -> np.ndarray:
+        """Indices of the rows of an encounter (eg. "urn:uuid:...")"""
+        encounter_id = self._encounter_ids.get(encounter_reference)
+        if encounter_id is None:
+            return np.empty(0, dtype=np.intp)
+        return np.flatnonzero(self.encounter == encounter_id)
+
+
+def _iter_rows(resources: Iterable[dict]):
+    """Yield one row per numeric value or component of the Observations"""
+    for resource in resources:
+        if resource.get("resourceType") != "Observation":
+            continue
+        effective_date = resource.get("effectiveDateTime") or (
+            resource.get("effectivePeriod") or {}
+        ).get("start")
+        if effective_date is None:
+            continue
+        effective = _to_epoch_seconds(effective_date)
+        encounter = _reference(resource, "encounter")
+        parts = resource.get("component") or [resource]
+        for part in parts:
+            code, display = _first_coding(part.get("code") or {})
+            quantity = part.get("valueQuantity")
+            if quantity is not None and quantity.get("value") is not None:
+                value = float(quantity["value"])
+                unit = quantity.get("unit") or quantity.get("code") or ""
+            else:
+                value = np.nan
+                unit = ""
+            yield code, display, value, unit, effective, encounter
+
+
+def main():
+    """
+    Print the latest value and the statistics of every observation code of the example bundle
+    """
+    console = Console()
+    store = ObservationStore.from_resources(
+        entry["resource"]
+        for entry in iter_fhir_entries(FULL_PATH, resource_types=["Observation"])
+    )
+    console.print(f"{len(store)} observation values for {len(store.codes)} codes")
+    console.print("Latest values:", style="bold")
+    for latest in store.latest_values().values():
+        console.print(
+            f"{latest.display}: {latest.value:g} {latest.unit} ({latest.effective})"
+        )
+    console.print("Statistics:", style="bold")
+    for code_stats in store.stats().values():
+        console.print(
+            f"{code_stats.display}: min {code_stats.min:g}, max {code_stats.max:g}, "
+            f"mean {code_stats.mean:.2f} {code_stats.unit} ({code_stats.count} values)"
+        )
+
+
+if __name__ == "__main__":
+    main()
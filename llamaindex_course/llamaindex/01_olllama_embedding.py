@@ -1,8 +1,11 @@
 """ Example of using the OllamaEmbeddings class to embed a query. """
 
-from sklearn.metrics.pairwise import cosine_similarity
 from langchain_community.embeddings import OllamaEmbeddings
 
+# Same result as sklearn.metrics.pairwise.cosine_similarity, see similarity.SimilarityIndex
+# to compare many embeddings at once
+from llamaindex_course.llamaindex.similarity import cosine_similarity
+
 TEXT_TO_ENCODE = "Dog"
 
 TEXT_TO_COMPARE = "Le chien"
@@ -8,11 +8,15 @@ import sys
 
 from llama_index.core import (
     VectorStoreIndex,
-    SimpleDirectoryReader,
 )
 
 # Import load_dotenv from the dotenv module
 from dotenv import load_dotenv
+
+from llamaindex_course.llamaindex.embedding_cache import CachedEmbedding
+from llamaindex_course.llamaindex.pdf_loader import load_documents
+from llamaindex_course.llamaindex.sharded_index import refresh_index_or_shards
+
 # Load the .env file
 # Use OPENAI_API_KEY to get the API key from the .env file
 
@@ -25,14 +29,42 @@ logging.getLogger().addHandler(logging.StreamHandler(stream=sys.stdout))
 # check if storage already exists
 PERSIST_DIR = os.environ.get("PERSIST_DIR")
 
-if os.path.exists(PERSIST_DIR):
-    # remove the existing storage
-    import shutil
-    shutil.rmtree(PERSIST_DIR)
-
-if not os.path.exists(PERSIST_DIR):
-    # load the documents and create the index
-    documents = SimpleDirectoryReader("data").load_data()
-    index = VectorStoreIndex.from_documents(documents)
-    # store it for later
-    index.storage_context.persist(persist_dir=PERSIST_DIR)
+# The embeddings are cached in EMBEDDING_CACHE_PATH (embeddings.db by default)
+# and shared by the scripts: unchanged chunks are never embedded twice
+EMBED_MODEL = CachedEmbedding("default")
+
+# With incremental indexing only the new or changed documents are embedded and
+# the documents whose file disappeared are removed from the index.
+# Set it to False to remove the existing storage and rebuild the whole index
+INCREMENTAL_INDEXING = True
+
+
+def main():
+    """Refresh the index in PERSIST_DIR, or rebuild it"""
+    if INCREMENTAL_INDEXING:
+        # filename_as_id gives the documents stable ids between runs. The PDF pages
+        # are extracted in parallel and cached in PDF_CACHE_PATH (pdf_pages.db by
+        # default): the unchanged PDFs are not parsed again
+        documents = load_documents("data", filename_as_id=True)
+        # The documents are partitioned into INDEX_SHARDS indexes (1 by default),
+        # split, embedded and persisted in parallel worker processes
+        stats = refresh_index_or_shards(documents, PERSIST_DIR, embed_model=EMBED_MODEL)
+        logging.info("Incremental indexing: %s", stats)
+
+    elif os.path.exists(PERSIST_DIR):
+        # remove the existing storage
+        import shutil
+        shutil.rmtree(PERSIST_DIR)
+
+    if not INCREMENTAL_INDEXING and not os.path.exists(PERSIST_DIR):
+        # load the documents and create the index
+        documents = load_documents("data")
+        index = VectorStoreIndex.from_documents(documents, embed_model=EMBED_MODEL)
+        # store it for later
+        index.storage_context.persist(persist_dir=PERSIST_DIR)
+
+
+# The PDFs are extracted, and the shards built, in worker processes which
+# import this script when they are spawned (Windows, macOS)
+if __name__ == "__main__":
+    main()
@@ -6,13 +6,13 @@ import os.path
 import logging
 import sys
 
-from llama_index.core import (
-    StorageContext,
-    load_index_from_storage
-)
-
 # Import load_dotenv from the dotenv module
 from dotenv import load_dotenv
+
+from llamaindex_course.llamaindex.answer_cache import SemanticCacheQueryEngine
+from llamaindex_course.llamaindex.sharded_index import load_indexes, persisted_query_engine
+from llamaindex_course.llamaindex.streaming_query import print_streaming
+
 # Load the .env file
 # Use OPENAI_API_KEY to get the API key from the .env file
 
@@ -29,12 +29,21 @@ if not os.path.exists(PERSIST_DIR):
     print(" No index found, please run 03_index_and_persist.py first")
     sys.exit(1)
 
-# load the index from storage
-storage_context = StorageContext.from_defaults(persist_dir=PERSIST_DIR)
-index = load_index_from_storage(storage_context)
-
-# Either way we can now query the index
-query_engine = index.as_query_engine()
-response = query_engine.query("Explain the result of Air Liquide in 2023 ? Make a summary")
-print(response)
+# load the index from storage (or its shards when it was built with
+# INDEX_SHARDS > 1), the embeddings are memory-mapped when the index was
+# persisted with an MmapVectorStore
+indexes = load_indexes(PERSIST_DIR)
+if len(indexes) > 1:
+    # every shard is queried and their top k nodes are merged (the answer
+    # cache needs a single index)
+    query_engine = persisted_query_engine(indexes, streaming=True)
+else:
+    # The answers of similar questions are served from answers.db until the index changes
+    query_engine = SemanticCacheQueryEngine(indexes[0][1], streaming=True)
+
+# Either way we can now query the index, the answer is printed as it is generated
+timings = print_streaming(
+    query_engine, "Explain the result of Air Liquide in 2023 ? Make a summary"
+)
+print(f"First token after {timings.time_to_first_token:.2f}s, answered in {timings.total:.2f}s")
 
@@ -8,7 +8,6 @@ import sys
 
 from llama_index.core import (
     VectorStoreIndex,
-    SimpleDirectoryReader,
 )
 
 
@@ -18,6 +17,11 @@ from llama_index.core.node_parser import SentenceSplitter
 
 # Import load_dotenv from the dotenv module
 from dotenv import load_dotenv
+
+from llamaindex_course.llamaindex.embedding_cache import CachedEmbedding
+from llamaindex_course.llamaindex.pdf_loader import load_documents
+from llamaindex_course.llamaindex.sharded_index import refresh_index_or_shards
+
 # Load the .env file
 # Use OPENAI_API_KEY to get the API key from the .env file
 
@@ -30,26 +34,64 @@ logging.getLogger().addHandler(logging.StreamHandler(stream=sys.stdout))
 # check if storage already exists
 PERSIST_DIR = os.environ.get("PERSIST_DIR")
 
-if os.path.exists(PERSIST_DIR):
-    # remove the existing storage
-    import shutil
-    shutil.rmtree(PERSIST_DIR)
-
-if not os.path.exists(PERSIST_DIR):
-    # load the documents and create the index
-    documents = SimpleDirectoryReader("data").load_data()
-
-    # log the number of documents
-    logging.info("Loaded %s documents", len(documents))
-
-    SPLIT_SIZE = 512
-
-    logging.info("Creating index with smaller chunks of %s tokens", SPLIT_SIZE)
-
-    index = VectorStoreIndex.from_documents(
-        documents, transformations=[SentenceSplitter(chunk_size=SPLIT_SIZE)])
-
-    logging.info("Index created")
-
-    # store it for later
-    index.storage_context.persist(persist_dir=PERSIST_DIR)
+# The embeddings are cached in EMBEDDING_CACHE_PATH (embeddings.db by default)
+# and shared by the scripts: unchanged chunks are never embedded twice
+EMBED_MODEL = CachedEmbedding("default")
+
+# Chunk size in tokens, can be set with the SPLIT_SIZE environment variable.
+# Compare the sizes on your corpus with the chunk_benchmark module. The splitter
+# is stored with the index in PERSIST_DIR: a new SPLIT_SIZE rebuilds the whole
+# index (the chunks already embedded are read from the embedding cache)
+SPLIT_SIZE = int(os.environ.get("SPLIT_SIZE", "512"))
+
+# With incremental indexing only the new or changed documents are embedded and
+# the documents whose file disappeared are removed from the index.
+# Set it to False to remove the existing storage and rebuild the whole index
+INCREMENTAL_INDEXING = True
+
+
+def main():
+    """Refresh the index in PERSIST_DIR, or rebuild it"""
+    if INCREMENTAL_INDEXING:
+        # filename_as_id gives the documents stable ids between runs. The PDF pages
+        # are extracted in parallel and cached in PDF_CACHE_PATH (pdf_pages.db by
+        # default): the unchanged PDFs are not parsed again
+        documents = load_documents("data", filename_as_id=True)
+        # A single index, or INDEX_SHARDS shards (see 03_index_and_persist.py)
+        stats = refresh_index_or_shards(
+            documents,
+            PERSIST_DIR,
+            embed_model=EMBED_MODEL,
+            transformations=[SentenceSplitter(chunk_size=SPLIT_SIZE)],
+        )
+        logging.info("Incremental indexing: %s", stats)
+
+    elif os.path.exists(PERSIST_DIR):
+        # remove the existing storage
+        import shutil
+        shutil.rmtree(PERSIST_DIR)
+
+    if not INCREMENTAL_INDEXING and not os.path.exists(PERSIST_DIR):
+        # load the documents and create the index
+        documents = load_documents("data")
+
+        # log the number of documents
+        logging.info("Loaded %s documents", len(documents))
+
+        logging.info("Creating index with smaller chunks of %s tokens", SPLIT_SIZE)
+
+        index = VectorStoreIndex.from_documents(
+            documents,
+            embed_model=EMBED_MODEL,
+            transformations=[SentenceSplitter(chunk_size=SPLIT_SIZE)])
+
+        logging.info("Index created")
+
+        # store it for later
+        index.storage_context.persist(persist_dir=PERSIST_DIR)
+
+
+# The PDFs are extracted, and the shards built, in worker processes which
+# import this script when they are spawned (Windows, macOS)
+if __name__ == "__main__":
+    main()
@@ -6,13 +6,12 @@ import os.path
 import logging
 import sys
 
-from llama_index.core import (
-    StorageContext,
-    load_index_from_storage
-)
-
 # Import load_dotenv from the dotenv module
 from dotenv import load_dotenv
+
+from llamaindex_course.llamaindex.context_packing import ContextPackingPostprocessor
+from llamaindex_course.llamaindex.sharded_index import load_indexes, persisted_query_engine
+
 # Load the .env file
 # Use OPENAI_API_KEY to get the API key from the .env file
 
@@ -29,12 +28,20 @@ if not os.path.exists(PERSIST_DIR):
     print(" No index found, please run 03_index_and_persist.py first")
     sys.exit(1)
 
-# load the index from storage
-storage_context = StorageContext.from_defaults(persist_dir=PERSIST_DIR)
-index = load_index_from_storage(storage_context)
-
-# Either way we can now query the index
-query_engine = index.as_query_engine(similarity_top_k=5)
+# load the index from storage (or its shards when it was built with
+# INDEX_SHARDS > 1), the embeddings are memory-mapped when the index was
+# persisted with an MmapVectorStore
+indexes = load_indexes(PERSIST_DIR)
+
+# Either way we can now query the index. The BM25 scores of the exact terms
+# (figures, segment names) are fused with the vector scores, so fewer chunks
+# are needed than with the vector search alone (similarity_top_k=5 before).
+# The redundant and least relevant sentences of the chunks are dropped to fit
+# in CONTEXT_TOKEN_BUDGET tokens (1024 by default)
+packing = ContextPackingPostprocessor()
+query_engine = persisted_query_engine(
+    indexes, similarity_top_k=3, hybrid=True, node_postprocessors=[packing])
 response = query_engine.query("Explain the result of Air Liquide in 2023 ? Make a summary")
 print(response)
+logging.info("Context packing: %s tokens saved", packing.stats.tokens_saved)
 
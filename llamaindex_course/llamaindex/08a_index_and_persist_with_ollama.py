@@ -9,18 +9,21 @@ import sys
 from llama_index.core import (
     ServiceContext,
     VectorStoreIndex,
-    SimpleDirectoryReader,
 )
 
 # Import Ollama
 # You need to install llama-index-llms-ollama to use Ollama
 from llama_index.llms.ollama import Ollama
-from langchain_community.embeddings import OllamaEmbeddings
 
 
 # Import load_dotenv from the dotenv module
 from dotenv import load_dotenv
 
+from llamaindex_course.llamaindex.embedding_cache import CachedEmbedding
+from llamaindex_course.llamaindex.ollama_embedding import OllamaBatchEmbedding
+from llamaindex_course.llamaindex.pdf_loader import load_documents
+from llamaindex_course.llamaindex.sharded_index import refresh_index_or_shards
+
 # Load the .env file
 load_dotenv()
 
@@ -35,21 +38,50 @@ LLM_MODEL = "mistral:latest"
 # check if storage already exists
 PERSIST_DIR = os.environ.get("PERSIST_DIR")
 
-if os.path.exists(PERSIST_DIR):
-    # remove the existing storage
-    import shutil
-    shutil.rmtree(PERSIST_DIR)
+# With incremental indexing only the new or changed documents are embedded and
+# the documents whose file disappeared are removed from the index.
+# Set it to False to remove the existing storage and rebuild the whole index
+INCREMENTAL_INDEXING = True
+
+
+def main():
+    """Refresh the index in PERSIST_DIR, or rebuild it"""
+    if INCREMENTAL_INDEXING:
+        # filename_as_id gives the documents stable ids between runs. The PDF pages
+        # are extracted in parallel and cached in PDF_CACHE_PATH (pdf_pages.db by
+        # default): the unchanged PDFs are not parsed again
+        documents = load_documents("data", filename_as_id=True)
+
+        service_context = ServiceContext.from_defaults(
+            llm=Ollama(model=LLM_MODEL),
+            embed_model=CachedEmbedding(OllamaBatchEmbedding(model_name=EMBEDDING_MODEL))
+        )
+        # The documents are partitioned into INDEX_SHARDS indexes (1 by default),
+        # split, embedded and persisted in parallel worker processes
+        stats = refresh_index_or_shards(documents, PERSIST_DIR, service_context=service_context)
+        logging.info("Incremental indexing: %s", stats)
+
+    elif os.path.exists(PERSIST_DIR):
+        # remove the existing storage
+        import shutil
+        shutil.rmtree(PERSIST_DIR)
+
+    if not INCREMENTAL_INDEXING and not os.path.exists(PERSIST_DIR):
+        # load the documents and create the index
+        documents = load_documents("data")
+
+        service_context = ServiceContext.from_defaults(
+            llm=Ollama(model=LLM_MODEL),
+            embed_model=CachedEmbedding(OllamaBatchEmbedding(model_name=EMBEDDING_MODEL))
+        )
+        index = VectorStoreIndex.from_documents(
+            documents, service_context=service_context)
 
-if not os.path.exists(PERSIST_DIR):
-    # load the documents and create the index
-    documents = SimpleDirectoryReader("data").load_data()
+        # store it for later
+        index.storage_context.persist(persist_dir=PERSIST_DIR)
 
-    service_context = ServiceContext.from_defaults(
-        llm=Ollama(model=LLM_MODEL),
-        embed_model=OllamaEmbeddings(model=EMBEDDING_MODEL)
-    )
-    index = VectorStoreIndex.from_documents(
-        documents, service_context=service_context)
 
-    # store it for later
-    index.storage_context.persist(persist_dir=PERSIST_DIR)
+# The PDFs are extracted, and the shards built, in worker processes which
+# import this script when they are spawned (Windows, macOS)
+if __name__ == "__main__":
+    main()
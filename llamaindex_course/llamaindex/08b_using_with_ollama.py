@@ -8,18 +8,18 @@ import sys
 
 from dotenv import load_dotenv
 
-from llama_index.core import (
-    ServiceContext,
-    StorageContext,
-    load_index_from_storage
-)
+from llama_index.core import ServiceContext
 
 # Import Ollama
 # You need to install llama-index-llms-ollama to use Ollama
 from llama_index.llms.ollama import Ollama
 
-# you need to install llama-index-embeddings-langchainto to use OllamaEmbeddings
-from langchain_community.embeddings import OllamaEmbeddings
+from llamaindex_course.llamaindex.answer_cache import SemanticCacheQueryEngine
+from llamaindex_course.llamaindex.context_packing import ContextPackingPostprocessor
+from llamaindex_course.llamaindex.embedding_cache import CachedEmbedding
+from llamaindex_course.llamaindex.ollama_embedding import OllamaBatchEmbedding
+from llamaindex_course.llamaindex.sharded_index import load_indexes, persisted_query_engine
+from llamaindex_course.llamaindex.streaming_query import print_streaming
 
 # nomic-embed-text is a powerful model that can be used for embeddings https://ollama.com/library/nomic-embed-text
 EMBEDDING_MODEL = "nomic-embed-text"
@@ -42,19 +42,33 @@ if not os.path.exists(PERSIST_DIR):
     print(" No index found, please run 08a_index_and_persist.py first")
     sys.exit(1)
 
-# load the index from storage
+# load the index from storage, the questions are embedded by the same client
+# (and cache) as the index in 08a
 service_context = ServiceContext.from_defaults(
     llm=Ollama(model=LLM_MODEL, tokens=1000, request_timeout=60),
-    embed_model=OllamaEmbeddings(model=EMBEDDING_MODEL)
+    embed_model=CachedEmbedding(OllamaBatchEmbedding(model_name=EMBEDDING_MODEL))
 )
 
-storage_context = StorageContext.from_defaults(persist_dir=PERSIST_DIR)
-index = load_index_from_storage(
-    storage_context, service_context=service_context)
+# The context is packed in CONTEXT_TOKEN_BUDGET tokens: the prompt evaluation
+# of Mistral on CPU grows with every token of context
+packing = ContextPackingPostprocessor()
+
+# the index, or its shards when it was built with INDEX_SHARDS > 1; the
+# embeddings are memory-mapped when the index was persisted with an MmapVectorStore
+indexes = load_indexes(PERSIST_DIR, service_context=service_context)
+if len(indexes) > 1:
+    # every shard is queried and their top k nodes are merged (the answer
+    # cache needs a single index)
+    query_engine = persisted_query_engine(
+        indexes, streaming=True, node_postprocessors=[packing])
+else:
+    # The answers of similar questions are served from answers.db until the index changes
+    query_engine = SemanticCacheQueryEngine(
+        indexes[0][1], streaming=True, node_postprocessors=[packing])
 
 # Either way we can now query the index
-query_engine = index.as_query_engine()
-response = query_engine.query(
-    "Explain the result of Air Liquide in 2023 ? Make a summary")
-# print the response
-print(response)
+# print the response as Ollama generates it
+timings = print_streaming(
+    query_engine, "Explain the result of Air Liquide in 2023 ? Make a summary")
+print(f"First token after {timings.time_to_first_token:.2f}s, answered in {timings.total:.2f}s")
+print(f"Context packing: {packing.stats.tokens_saved} tokens saved")
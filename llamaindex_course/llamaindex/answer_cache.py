@@ -0,0 +1,381 @@
+""" Semantic cache of the answers of a query engine, for repeated and near-duplicate questions """
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from typing import Any, Iterator, List, NamedTuple, Optional, Tuple
+
+# import the logging module
+import logging
+
+import numpy as np
+from rich.console import Console
+
+from llama_index.core import Settings
+from llama_index.core.base.base_query_engine import BaseQueryEngine
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.base.response.schema import RESPONSE_TYPE, Response, StreamingResponse
+from llama_index.core.indices.base import BaseIndex
+from llama_index.core.ingestion.pipeline import remove_unstable_values
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+
+from llamaindex_course.llamaindex.embedding_cache import model_key
+from llamaindex_course.llamaindex.similarity import normalize_rows
+
+logger = logging.getLogger(__name__)
+
+# Path of the cache, can be set with the ANSWER_CACHE_PATH environment variable
+ANSWER_CACHE_PATH = os.environ.get("ANSWER_CACHE_PATH", "answers.db")
+
+# Minimum cosine similarity between a question and a cached question to reuse
+# its answer, can be set with the ANSWER_CACHE_THRESHOLD environment variable.
+# Too low and a different question gets a wrong answer: keep it high
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.95"))
+
+# Maximum number of cached answers, the least recently used ones are evicted first
+DEFAULT_MAX_ENTRIES = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    id INTEGER PRIMARY KEY,
+    index_id TEXT NOT NULL,
+    version TEXT NOT NULL,
+    question TEXT NOT NULL,
+    embedding BLOB NOT NULL,
+    answer TEXT NOT NULL,
+    source_nodes TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS answers_index ON answers (index_id, version);
+CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used);
+"""
+
+
+class AnswerCacheStats(NamedTuple):
+    """Counters of a SemanticCacheQueryEngine"""
+
+    hits: int
+    misses: int
+    seconds_saved: float
+
+    @property
+    def hit_rate(self) -> float:
+        """Ratio of the questions answered from the cache"""
+        return self.hits / max(self.hits + self.misses, 1)
+
+
+def index_version(index: BaseIndex, embed_model: Optional[BaseEmbedding] = None) -> str:
+    """Hash of the content of the nodes of an index (and of the embedding model)
+
+    It changes when a node is added, removed or modified, eg. by
+    refresh_index, and not when the index is persisted again unchanged.
+    """
+    digest = hashlib.sha256()
+    if embed_model is not None:
+        digest.update(model_key(embed_model).encode("utf-8"))
+    for node_id, node in sorted(index.docstore.docs.items()):
+        digest.update(f"\0{node_id}\0{node.hash}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _describe(component: Any) -> str:
+    """Configuration of a pydantic component (LLM, postprocessor), its class otherwise"""
+    to_dict = getattr(component, "to_dict", None)
+    return remove_unstable_values(str(to_dict())) if to_dict else type(component).__name__
+
+
+def engine_version(query_engine: BaseQueryEngine) -> str:
+    """Hash of the configuration of a query engine
+
+    It covers the retriever (class, top k, vector store arguments, fusion
+    weight), the node postprocessors and their parameters, the response
+    synthesizer and its LLM, and the prompts: the same index queried with
+    another configuration gives other answers.
+    """
+    parts = [type(query_engine).__name__]
+    retriever = getattr(query_engine, "retriever", None)
+    if retriever is not None:
+        parts.append(type(retriever).__name__)
+        for name in ("similarity_top_k", "alpha", "kwargs"):
+            parts.append(f"{name}={getattr(retriever, name, getattr(retriever, f'_{name}', None))}")
+    synthesizer = getattr(query_engine, "_response_synthesizer", None)
+    if synthesizer is not None:
+        parts.append(type(synthesizer).__name__)
+        parts.append(_describe(getattr(synthesizer, "_llm", None)))
+    postprocessors = getattr(query_engine, "_node_postprocessors", [])
+    parts.extend(_describe(postprocessor) for postprocessor in postprocessors)
+    prompts = sorted(query_engine.get_prompts().items())
+    parts.extend(f"{name}={prompt.get_template()}" for name, prompt in prompts)
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+def _dump_source_nodes(source_nodes: List[NodeWithScore]) -> str:
+    return json.dumps(
+        [{"node": doc_to_json(node.node), "score": node.score} for node in source_nodes]
+    )
+
+
+def _load_source_nodes(data: str) -> List[NodeWithScore]:
+    return [
+        NodeWithScore(node=json_to_doc(item["node"]), score=item["score"])
+        for item in json.loads(data)
+    ]
+
+
+class SemanticCacheQueryEngine(BaseQueryEngine):
+    """Query engine answering from a cache when a similar question was answered
+
+    The question is embedded with the embedding model of the index and
+    compared with the cached questions: above similarity_threshold the
+    cached answer is returned, with its source nodes, without retrieval or
+    synthesis (response.metadata["cached"] is True). Otherwise the wrapped
+    query engine answers and the answer is cached.
+
+    The answers are cached in SQLite per index, per index version (see
+    index_version) and per configuration of the wrapped engine (see
+    engine_version: LLM, top k, postprocessors, prompts). When the nodes of
+    the index change, the answers of the previous version are deleted.
+    When the cache holds more than max_entries answers, the least recently
+    used ones are evicted.
+
+    A streaming answer is cached once it is consumed to the end; a cached
+    answer is returned whole, as a Response, even by a streaming engine.
+    """
+
+    def __init__(
+        self,
+        index: BaseIndex,
+        query_engine: Optional[BaseQueryEngine] = None,
+        embed_model: Optional[BaseEmbedding] = None,
+        cache_path: str = ANSWER_CACHE_PATH,
+        similarity_threshold: float = ANSWER_CACHE_THRESHOLD,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        **query_engine_kwargs: Any,
+    ):
+        """Put a cache in front of a query engine
+        Args:
+            index: The index queried
+            query_engine: The query engine, index.as_query_engine(**query_engine_kwargs) by default
+            embed_model: The model embedding the questions, the one of the index by default
+            cache_path: The path of the SQLite cache, ":memory:" for an in-memory cache
+            similarity_threshold: Minimum cosine similarity to reuse an answer
+            max_entries: Maximum number of cached answers
+        """
+        self.query_engine = query_engine or index.as_query_engine(**query_engine_kwargs)
+        super().__init__(callback_manager=self.query_engine.callback_manager)
+        # pylint: disable=protected-access
+        self.embed_model = embed_model or getattr(index, "_embed_model", None) or Settings.embed_model
+        self.index_id = index.index_id
+        self.index_version = index_version(index, self.embed_model)
+        self.version = f"{self.index_version}:{engine_version(self.query_engine)}"
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._seconds_saved = 0.0
+        self._row_ids: List[int] = []
+        self._embeddings: Optional[np.ndarray] = None
+
+        if os.path.dirname(cache_path):
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        self._connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self._connection.executescript(_SCHEMA)
+        with self._connection:
+            deleted = self._connection.execute(
+                "DELETE FROM answers WHERE index_id = ? AND version NOT LIKE ?",
+                (self.index_id, f"{self.index_version}:%"),
+            ).rowcount
+        if deleted:
+            logger.info("The index changed, deleted %s cached answers", deleted)
+        self._load_embeddings()
+
+    def _get_prompt_modules(self) -> dict:
+        return {"query_engine": self.query_engine}
+
+    @property
+    def stats(self) -> AnswerCacheStats:
+        """Hit and miss counters, and the time the hits saved"""
+        return AnswerCacheStats(self._hits, self._misses, self._seconds_saved)
+
+    def close(self) -> None:
+        """Close the cache"""
+        self._connection.close()
+
+    def __len__(self) -> int:
+        return len(self._row_ids)
+
+    def _load_embeddings(self) -> None:
+        """Read the normalized embeddings of the cached questions of this version"""
+        rows = self._connection.execute(
+            "SELECT id, embedding FROM answers WHERE index_id = ? AND version = ?",
+            (self.index_id, self.version),
+        ).fetchall()
+        self._row_ids = [row_id for row_id, _ in rows]
+        self._embeddings = (
+            np.array([array("f", embedding) for _, embedding in rows], dtype=np.float32)
+            if rows
+            else None
+        )
+
+    def _lookup(self, embedding: np.ndarray) -> Optional[Tuple[Response, float]]:
+        """The cached answer of the most similar question above the threshold"""
+        with self._lock:
+            if self._embeddings is None:
+                return None
+            scores = self._embeddings @ embedding
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                return None
+            row_id = self._row_ids[best]
+            with self._connection:
+                answer, source_nodes, seconds = self._connection.execute(
+                    "SELECT answer, source_nodes, seconds FROM answers WHERE id = ?", (row_id,)
+                ).fetchone()
+                self._connection.execute(
+                    "UPDATE answers SET last_used = ? WHERE id = ?", (time.time(), row_id)
+                )
+        response = Response(
+            response=answer,
+            source_nodes=_load_source_nodes(source_nodes),
+            metadata={"cached": True, "similarity": float(scores[best])},
+        )
+        return response, seconds
+
+    def _store(
+        self,
+        question: str,
+        embedding: np.ndarray,
+        answer: str,
+        source_nodes: List[NodeWithScore],
+        seconds: float,
+    ) -> None:
+        """Cache an answer and evict the least recently used answers"""
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO answers (index_id, version, question, embedding, answer, "
+                "source_nodes, seconds, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.index_id,
+                    self.version,
+                    question,
+                    embedding.astype(np.float32).tobytes(),
+                    answer,
+                    _dump_source_nodes(source_nodes),
+                    seconds,
+                    time.time(),
+                ),
+            )
+            (count,) = self._connection.execute("SELECT count(*) FROM answers").fetchone()
+            if count > self.max_entries:
+                self._connection.execute(
+                    "DELETE FROM answers WHERE id IN "
+                    "(SELECT id FROM answers ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+                self._load_embeddings()
+            else:
+                self._row_ids.append(cursor.lastrowid)
+                row = embedding[None, :].astype(np.float32)
+                self._embeddings = row if self._embeddings is None else np.concatenate([self._embeddings, row])
+
+    def _embed(self, query_bundle: QueryBundle) -> np.ndarray:
+        if query_bundle.embedding is None:
+            query_bundle.embedding = self.embed_model.get_agg_embedding_from_queries(
+                query_bundle.embedding_strs
+            )
+        return normalize_rows(np.array([query_bundle.embedding], dtype=np.float32))[0]
+
+    def _hit(self, embedding: np.ndarray, start: float) -> Optional[Response]:
+        cached = self._lookup(embedding)
+        if cached is None:
+            with self._lock:
+                self._misses += 1
+            return None
+        response, seconds = cached
+        with self._lock:
+            self._hits += 1
+            self._seconds_saved += max(seconds - (time.perf_counter() - start), 0.0)
+        return response
+
+    def _cache_response(
+        self, question: str, embedding: np.ndarray, response: RESPONSE_TYPE, start: float
+    ) -> RESPONSE_TYPE:
+        """Cache the answer of the query engine, when a streaming answer is consumed"""
+        if isinstance(response, Response):
+            self._store(
+                question,
+                embedding,
+                str(response.response),
+                response.source_nodes,
+                time.perf_counter() - start,
+            )
+        elif isinstance(response, StreamingResponse) and response.response_gen is not None:
+            tokens = response.response_gen
+
+            def cached_tokens() -> Iterator[str]:
+                answer = []
+                for token in tokens:
+                    answer.append(token)
+                    yield token
+                self._store(
+                    question,
+                    embedding,
+                    "".join(answer),
+                    response.source_nodes,
+                    time.perf_counter() - start,
+                )
+
+            response.response_gen = cached_tokens()
+        return response
+
+    def _query(self, query_bundle: QueryBundle) -> RESPONSE_TYPE:
+        start = time.perf_counter()
+        embedding = self._embed(query_bundle)
+        response = self._hit(embedding, start)
+        if response is not None:
+            return response
+        response = self.query_engine.query(query_bundle)
+        return self._cache_response(query_bundle.query_str, embedding, response, start)
+
+    async def _aquery(self, query_bundle: QueryBundle) -> RESPONSE_TYPE:
+        start = time.perf_counter()
+        if query_bundle.embedding is None:
+            query_bundle.embedding = await self.embed_model.aget_agg_embedding_from_queries(
+                query_bundle.embedding_strs
+            )
+        embedding = self._embed(query_bundle)
+        response = self._hit(embedding, start)
+        if response is not None:
+            return response
+        response = await self.query_engine.aquery(query_bundle)
+        return self._cache_response(query_bundle.query_str, embedding, response, start)
+
+
+def main():
+    """
+    Print the content of the cache
+
+    Usage: python -m llamaindex_course.llamaindex.answer_cache [cache path]
+    """
+    console = Console()
+    cache_path = sys.argv[1] if len(sys.argv) > 1 else ANSWER_CACHE_PATH
+    if not os.path.exists(cache_path):
+        console.print(f"No answer cache in {cache_path}")
+        return
+    with sqlite3.connect(cache_path) as connection:
+        for index_id, count, seconds in connection.execute(
+            "SELECT index_id, count(*), sum(seconds) FROM answers GROUP BY index_id"
+        ):
+            console.print(f"{index_id}: {count} answers, {seconds:.1f}s of queries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+""" Run a batch of questions concurrently against a loaded index """
+
+import os
+import sys
+import time
+import asyncio
+from typing import List, NamedTuple, Optional, Sequence
+
+# import the logging module
+import logging
+
+from rich.console import Console
+
+from llama_index.core import ServiceContext
+from llama_index.core.base.base_query_engine import BaseQueryEngine
+
+from llamaindex_course.llamaindex.embedding_cache import CachedEmbedding
+from llamaindex_course.llamaindex.ollama_embedding import OllamaBatchEmbedding
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of questions in flight, can be set with the
+# BATCH_QUERY_CONCURRENCY environment variable
+BATCH_QUERY_CONCURRENCY = int(os.environ.get("BATCH_QUERY_CONCURRENCY", "4"))
+
+# Run the questions in worker threads (see aquery_batch), can be set with the
+# BATCH_QUERY_THREADS environment variable: the Ollama LLM of 08a/08b has
+# blocking async methods, without threads its questions run one at a time
+BATCH_QUERY_THREADS = os.environ.get("BATCH_QUERY_THREADS", "0").lower() in ("1", "true", "yes")
+
+# Query the index with the Ollama models of 08a/08b (see ollama_service_context),
+# can be set with the BATCH_QUERY_OLLAMA environment variable. Without it the
+# index is queried with the default (OpenAI) models of 03
+BATCH_QUERY_OLLAMA = os.environ.get("BATCH_QUERY_OLLAMA", "0").lower() in ("1", "true", "yes")
+
+# The models of 08a/08b
+OLLAMA_EMBEDDING_MODEL = "nomic-embed-text"
+OLLAMA_LLM_MODEL = "mistral:latest"
+
+
+class QueryResult(NamedTuple):
+    """Answer of a question of a batch"""
+
+    question: str
+    answer: Optional[str]
+    latency: float
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        """True when the question was answered"""
+        return self.error is None
+
+
+class BatchStats(NamedTuple):
+    """Latencies of a batch of questions"""
+
+    questions: int
+    errors: int
+    seconds: float
+    mean_latency: float
+    max_latency: float
+
+    @property
+    def questions_per_minute(self) -> float:
+        """Throughput of the batch"""
+        return self.questions * 60 / self.seconds if self.seconds else 0.0
+
+
+def ollama_service_context() -> ServiceContext:
+    """The models of 08b: the Ollama LLM, and the cached Ollama embeddings the index was built with"""
+    # pylint: disable=import-outside-toplevel
+    # You need to install llama-index-llms-ollama to use Ollama
+    from llama_index.llms.ollama import Ollama
+
+    return ServiceContext.from_defaults(
+        llm=Ollama(model=OLLAMA_LLM_MODEL, tokens=1000, request_timeout=60),
+        embed_model=CachedEmbedding(OllamaBatchEmbedding(model_name=OLLAMA_EMBEDDING_MODEL)),
+    )
+
+
+def read_questions(path: str) -> List[str]:
+    """Read one question per line, skipping the empty lines and the # comments"""
+    with open(path, "r", encoding="utf-8") as file:
+        lines = [line.strip() for line in file]
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+async def _answer(
+    query_engine: BaseQueryEngine,
+    question: str,
+    semaphore: asyncio.Semaphore,
+    use_threads: bool,
+) -> QueryResult:
+    async with semaphore:
+        start = time.perf_counter()
+        try:
+            if use_threads:
+                response = await asyncio.to_thread(query_engine.query, question)
+            else:
+                response = await query_engine.aquery(question)
+        except Exception as error:  # pylint: disable=broad-except
+            # One failed question must not abort the rest of the batch
+            logger.warning("Question %r failed: %s", question, error)
+            return QueryResult(question, None, time.perf_counter() - start, repr(error))
+        return QueryResult(question, str(response), time.perf_counter() - start)
+
+
+async def aquery_batch(
+    query_engine: BaseQueryEngine,
+    questions: Sequence[str],
+    concurrency: int = BATCH_QUERY_CONCURRENCY,
+    use_threads: bool = False,
+) -> List[QueryResult]:
+    """Answer questions concurrently
+
+    Args:
+        query_engine: The query engine, eg. index.as_query_engine()
+        questions: The questions
+        concurrency: Maximum number of questions in flight
+        use_threads: Run the synchronous query in worker threads instead of
+        aquery, for the LLMs and embedding models whose async methods block
+    Returns:
+        One result per question, in the order of the questions
+    """
+    if concurrency <= 0:
+        raise ValueError(f"concurrency must be positive, got {concurrency}")
+    semaphore = asyncio.Semaphore(concurrency)
+    # gather returns the results in the order of the questions
+    return list(
+        await asyncio.gather(
+            *(_answer(query_engine, question, semaphore, use_threads) for question in questions)
+        )
+    )
+
+
+def query_batch(
+    query_engine: BaseQueryEngine,
+    questions: Sequence[str],
+    concurrency: int = BATCH_QUERY_CONCURRENCY,
+    use_threads: bool = False,
+) -> List[QueryResult]:
+    """Answer questions concurrently from synchronous code (see aquery_batch)"""
+    return asyncio.run(aquery_batch(query_engine, questions, concurrency, use_threads))
+
+
+def batch_stats(results: Sequence[QueryResult], seconds: float) -> BatchStats:
+    """Summarize the results of a batch that took seconds to run"""
+    latencies = [result.latency for result in results] or [0.0]
+    return BatchStats(
+        questions=len(results),
+        errors=sum(not result.ok for result in results),
+        seconds=seconds,
+        mean_latency=sum(latencies) / len(latencies),
+        max_latency=max(latencies),
+    )
+
+
+def main():
+    """
+    Answer the questions of a file with the index of PERSIST_DIR
+
+    Usage: python -m llamaindex_course.llamaindex.batch_query questions.txt [concurrency] [--ollama] [--threads]
+
+    --ollama (or BATCH_QUERY_OLLAMA=1) queries an index built by 08a with its
+    Ollama models, --threads (or BATCH_QUERY_THREADS=1) runs the questions in
+    worker threads, for the LLMs whose async methods block (Ollama)
+    """
+    # pylint: disable=import-outside-toplevel
+    from dotenv import load_dotenv
+
+    from llamaindex_course.llamaindex.sharded_index import load_indexes, persisted_query_engine
+
+    load_dotenv()
+    console = Console()
+    persist_dir = os.environ.get("PERSIST_DIR")
+    use_threads = BATCH_QUERY_THREADS or "--threads" in sys.argv
+    use_ollama = BATCH_QUERY_OLLAMA or "--ollama" in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg not in ("--threads", "--ollama")]
+    if not args or not persist_dir or not os.path.exists(persist_dir):
+        console.print(main.__doc__)
+        sys.exit(1)
+    questions = read_questions(args[0])
+    concurrency = int(args[1]) if len(args) > 1 else BATCH_QUERY_CONCURRENCY
+
+    index_kwargs = {"service_context": ollama_service_context()} if use_ollama else {}
+    query_engine = persisted_query_engine(load_indexes(persist_dir, **index_kwargs))
+    start = time.perf_counter()
+    results = query_batch(query_engine, questions, concurrency, use_threads)
+    stats = batch_stats(results, time.perf_counter() - start)
+
+    for result in results:
+        console.rule(f"{result.question} ({result.latency:.1f}s)")
+        console.print(result.answer if result.ok else f"[red]{result.error}[/red]")
+    console.print(
+        f"{stats.questions} questions ({stats.errors} errors) in {stats.seconds:.1f}s "
+        f"with {concurrency} in flight{' (threads)' if use_threads else ''}: "
+        f"{stats.questions_per_minute:.1f} questions/min, "
+        f"mean latency {stats.mean_latency:.1f}s, max {stats.max_latency:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
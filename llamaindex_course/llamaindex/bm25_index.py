@@ -0,0 +1,363 @@
+""" BM25 inverted index persisted next to a vector index, and hybrid BM25 + vector retrieval """
+
+import os
+import re
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# import the logging module
+import logging
+
+import numpy as np
+from rich.console import Console
+
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.indices.base import BaseIndex
+from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.schema import BaseNode, MetadataMode, NodeWithScore, QueryBundle
+from llama_index.core.settings import Settings, llm_from_settings_or_context
+
+logger = logging.getLogger(__name__)
+
+# File of the inverted index in a persist directory
+BM25_FNAME = "bm25.npz"
+
+# BM25 parameters: term frequency saturation and document length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Weight of the vector score in the fused score, the BM25 score gets
+# 1 - HYBRID_ALPHA; can be set with the HYBRID_ALPHA environment variable
+HYBRID_ALPHA = float(os.environ.get("HYBRID_ALPHA", "0.5"))
+
+# Candidates taken from each retriever per result before the fusion
+_CANDIDATE_FACTOR = 4
+
+# Words, and numbers with their decimal and thousands separators (27,6 or 3.5 or 2,345)
+_TOKEN_PATTERN = re.compile(r"\d+(?:[.,]\d+)*|\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase words and numbers of a text"""
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+def _pack(strings: List[str]) -> np.ndarray:
+    """Strings without new lines as one uint8 array, compact in a .npz"""
+    return np.frombuffer("\n".join(strings).encode("utf-8"), dtype=np.uint8)
+
+
+def _unpack(array: np.ndarray) -> List[str]:
+    return array.tobytes().decode("utf-8").split("\n") if array.size else []
+
+
+class BM25Index:
+    """Inverted index scoring nodes with BM25
+
+    The postings are kept in compressed sparse rows: the documents and the
+    term frequencies of term t are doc_ids[offsets[t]:offsets[t + 1]] and
+    term_frequencies[offsets[t]:offsets[t + 1]]. A query only reads the
+    postings of its terms.
+    """
+
+    def __init__(
+        self,
+        node_ids: List[str],
+        terms: List[str],
+        offsets: np.ndarray,
+        doc_ids: np.ndarray,
+        term_frequencies: np.ndarray,
+        doc_lengths: np.ndarray,
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+    ):
+        self.node_ids = node_ids
+        self.terms = {term: term_id for term_id, term in enumerate(terms)}
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.term_frequencies = term_frequencies
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        document_frequencies = np.diff(offsets)
+        # The idf of Lucene: positive even for the terms of most documents
+        self.idf = np.log(1 + (len(node_ids) - document_frequencies + 0.5) / (document_frequencies + 0.5))
+        average_length = doc_lengths.mean() if len(doc_lengths) else 1.0
+        self._length_norm = k1 * (1 - b + b * doc_lengths / max(average_length, 1e-9))
+
+    def __len__(self) -> int:
+        return len(self.node_ids)
+
+    @classmethod
+    def build(cls, texts: Iterable[Tuple[str, str]], k1: float = BM25_K1, b: float = BM25_B) -> "BM25Index":
+        """Index (node id, text) pairs"""
+        node_ids: List[str] = []
+        vocabulary: Dict[str, int] = {}
+        term_ids: List[int] = []
+        doc_ids: List[int] = []
+        counts: List[int] = []
+        doc_lengths: List[int] = []
+        for doc_id, (node_id, text) in enumerate(texts):
+            tokens = tokenize(text)
+            node_ids.append(node_id)
+            doc_lengths.append(len(tokens))
+            for term, count in Counter(tokens).items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_ids.append(doc_id)
+                counts.append(count)
+
+        term_ids_array = np.array(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids_array, kind="stable")
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids_array, minlength=len(vocabulary)), out=offsets[1:])
+        return cls(
+            node_ids,
+            list(vocabulary),
+            offsets,
+            np.array(doc_ids, dtype=np.int32)[order],
+            np.minimum(np.array(counts, dtype=np.int64)[order], np.iinfo(np.uint16).max).astype(np.uint16),
+            np.array(doc_lengths, dtype=np.float32),
+            k1,
+            b,
+        )
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every node for a query"""
+        scores = np.zeros(len(self.node_ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.terms.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = self.doc_ids[start:end]
+            frequencies = self.term_frequencies[start:end].astype(np.float32)
+            scores[docs] += (
+                self.idf[term_id] * frequencies * (self.k1 + 1) / (frequencies + self._length_norm[docs])
+            )
+        return scores
+
+    def top_k(self, query: str, top_k: int) -> List[Tuple[str, float]]:
+        """Top k (node id, score) of a query, the nodes without any query term excluded"""
+        scores = self.scores(query)
+        matching = np.flatnonzero(scores)
+        best = matching[np.argsort(-scores[matching], kind="stable")[:top_k]]
+        return [(self.node_ids[doc_id], float(scores[doc_id])) for doc_id in best]
+
+    def save(self, path: str) -> None:
+        """Write the index in a compressed .npz"""
+        temporary_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(
+            temporary_path,
+            node_ids=_pack(self.node_ids),
+            terms=_pack(list(self.terms)),
+            offsets=self.offsets,
+            doc_ids=self.doc_ids,
+            term_frequencies=self.term_frequencies,
+            doc_lengths=self.doc_lengths,
+            parameters=np.array([self.k1, self.b]),
+        )
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """Read an index written by save"""
+        with np.load(path) as data:
+            k1, b = data["parameters"]
+            return cls(
+                _unpack(data["node_ids"]),
+                _unpack(data["terms"]),
+                data["offsets"],
+                data["doc_ids"],
+                data["term_frequencies"],
+                data["doc_lengths"],
+                float(k1),
+                float(b),
+            )
+
+
+def bm25_index_exists(persist_dir: str) -> bool:
+    """True if persist_dir has a BM25 index"""
+    return os.path.exists(os.path.join(persist_dir, BM25_FNAME))
+
+
+def build_bm25_index(index: BaseIndex) -> BM25Index:
+    """BM25 index of the nodes of an index, read from its docstore"""
+    node_ids = list(index.index_struct.nodes_dict.values())
+    nodes = index.docstore.get_nodes(node_ids, raise_error=False)
+    return BM25Index.build(
+        (node.node_id, node.get_content(metadata_mode=MetadataMode.EMBED))
+        for node in nodes
+        if node is not None
+    )
+
+
+def persist_bm25_index(index: BaseIndex, persist_dir: str) -> BM25Index:
+    """Build the BM25 index of an index and write it in its persist directory"""
+    start = time.perf_counter()
+    bm25_index = build_bm25_index(index)
+    bm25_index.save(os.path.join(persist_dir, BM25_FNAME))
+    logger.info(
+        "Built the BM25 index of %s nodes (%s terms) in %.2fs",
+        len(bm25_index),
+        len(bm25_index.terms),
+        time.perf_counter() - start,
+    )
+    return bm25_index
+
+
+def load_bm25_index(index: BaseIndex, persist_dir: Optional[str] = None) -> BM25Index:
+    """The BM25 index of an index, read from persist_dir, built (and written there) when it is missing"""
+    if persist_dir is not None and bm25_index_exists(persist_dir):
+        return BM25Index.load(os.path.join(persist_dir, BM25_FNAME))
+    if persist_dir is not None:
+        return persist_bm25_index(index, persist_dir)
+    return build_bm25_index(index)
+
+
+def _normalized(scores: Dict[str, float]) -> Dict[str, float]:
+    """Scale the scores to [0, 1]: BM25 and cosine scores are not comparable as they are"""
+    if not scores:
+        return {}
+    low, high = min(scores.values()), max(scores.values())
+    if high == low:
+        return {node_id: 1.0 for node_id in scores}
+    return {node_id: (score - low) / (high - low) for node_id, score in scores.items()}
+
+
+class HybridRetriever(BaseRetriever):
+    """Retriever fusing the BM25 and the vector scores of the nodes
+
+    Vector search misses the exact terms (figures, segment names) that
+    BM25 matches, BM25 misses the paraphrases. Each retriever returns
+    similarity_top_k * 4 candidates, their scores are scaled to [0, 1] and
+    fused: alpha * vector + (1 - alpha) * bm25. With the fusion a lower
+    similarity_top_k reaches the same recall, so the prompt is shorter.
+
+    The BM25 index is read from the persist directory on the first query,
+    and built (and written) from the docstore when it is missing.
+    """
+
+    def __init__(
+        self,
+        index: BaseIndex,
+        persist_dir: Optional[str] = None,
+        similarity_top_k: int = 2,
+        alpha: float = HYBRID_ALPHA,
+        **retriever_kwargs: Any,
+    ):
+        """Create the retriever
+        Args:
+            index: The vector index
+            persist_dir: The persist directory of the index, where the BM25 index is kept
+            similarity_top_k: Number of nodes retrieved
+            alpha: Weight of the vector score, 1 for vector search only, 0 for BM25 only
+            retriever_kwargs: Arguments of the vector retriever
+        """
+        if not 0 <= alpha <= 1:
+            raise ValueError(f"alpha must be between 0 and 1, got {alpha}")
+        self.index = index
+        self.persist_dir = persist_dir
+        self.similarity_top_k = similarity_top_k
+        self.alpha = alpha
+        self.vector_retriever = self._vector_retriever(
+            similarity_top_k * _CANDIDATE_FACTOR, **retriever_kwargs
+        )
+        self._bm25_index: Optional[BM25Index] = None
+        super().__init__(callback_manager=self.vector_retriever.callback_manager)
+
+    @property
+    def bm25_index(self) -> BM25Index:
+        """The BM25 index, loaded on first use"""
+        if self._bm25_index is None:
+            self._bm25_index = load_bm25_index(self.index, self.persist_dir)
+        return self._bm25_index
+
+    def _vector_retriever(self, similarity_top_k: int, **retriever_kwargs: Any) -> BaseRetriever:
+        """The retriever of the vector candidates"""
+        return self.index.as_retriever(similarity_top_k=similarity_top_k, **retriever_kwargs)
+
+    def _bm25_top_k(self, query: str, top_k: int) -> List[Tuple[str, float]]:
+        """The BM25 candidates, (node id, score) best first"""
+        return self.bm25_index.top_k(query, top_k)
+
+    def _get_nodes(self, node_ids: Sequence[str]) -> List[BaseNode]:
+        """The nodes of BM25 candidates missed by the vector search"""
+        return self.index.docstore.get_nodes(list(node_ids))
+
+    def _fuse(self, vector_nodes: List[NodeWithScore], query: str) -> List[NodeWithScore]:
+        candidates = self.similarity_top_k * _CANDIDATE_FACTOR
+        vector_scores = _normalized({node.node.node_id: node.score or 0.0 for node in vector_nodes})
+        bm25_scores = _normalized(dict(self._bm25_top_k(query, candidates)))
+        fused = {
+            node_id: self.alpha * vector_scores.get(node_id, 0.0)
+            + (1 - self.alpha) * bm25_scores.get(node_id, 0.0)
+            for node_id in {**vector_scores, **bm25_scores}
+        }
+        best = sorted(fused, key=lambda node_id: (-fused[node_id], node_id))[: self.similarity_top_k]
+
+        nodes = {node.node.node_id: node.node for node in vector_nodes}
+        missing = [node_id for node_id in best if node_id not in nodes]
+        nodes.update({node.node_id: node for node in self._get_nodes(missing)})
+        return [NodeWithScore(node=nodes[node_id], score=fused[node_id]) for node_id in best]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return self._fuse(self.vector_retriever.retrieve(query_bundle), query_bundle.query_str)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return self._fuse(await self.vector_retriever.aretrieve(query_bundle), query_bundle.query_str)
+
+
+def hybrid_query_engine(
+    index: BaseIndex,
+    persist_dir: Optional[str] = None,
+    similarity_top_k: int = 2,
+    alpha: float = HYBRID_ALPHA,
+    **kwargs: Any,
+) -> RetrieverQueryEngine:
+    """Query engine of an index retrieving with a HybridRetriever
+
+    Args:
+        index: The vector index
+        persist_dir: The persist directory of the index
+        similarity_top_k: Number of nodes sent to the LLM
+        alpha: Weight of the vector score in the fused score
+        kwargs: Arguments of RetrieverQueryEngine.from_args (streaming, response_mode, ...)
+    """
+    retriever = HybridRetriever(index, persist_dir, similarity_top_k, alpha)
+    kwargs.setdefault("llm", llm_from_settings_or_context(Settings, index.service_context))
+    return RetrieverQueryEngine.from_args(retriever, **kwargs)
+
+
+def main():
+    """
+    Build the BM25 index of a persisted index (of each shard of a sharded one) and run a query with it
+
+    Usage: python -m llamaindex_course.llamaindex.bm25_index [persist dir] [query]
+    """
+    # pylint: disable=import-outside-toplevel
+    from llamaindex_course.llamaindex.sharded_index import load_indexes
+
+    console = Console()
+    persist_dir = sys.argv[1] if len(sys.argv) > 1 else os.environ.get("PERSIST_DIR")
+    if not persist_dir or not os.path.exists(persist_dir):
+        console.print("No index found, set PERSIST_DIR or pass a persist directory")
+        sys.exit(1)
+    bm25_indexes = []
+    for directory, index in load_indexes(persist_dir):
+        bm25_index = persist_bm25_index(index, directory)
+        size = os.path.getsize(os.path.join(directory, BM25_FNAME))
+        console.print(
+            f"{directory}: {len(bm25_index)} nodes, {len(bm25_index.terms)} terms, "
+            f"{len(bm25_index.doc_ids)} postings: {size / 1024:.1f} KB"
+        )
+        bm25_indexes.append(bm25_index)
+    if len(sys.argv) > 2:
+        hits = [hit for bm25_index in bm25_indexes for hit in bm25_index.top_k(sys.argv[2], 5)]
+        for node_id, score in sorted(hits, key=lambda hit: -hit[1])[:5]:
+            console.print(f"{score:8.3f} {node_id}")
+
+
+if __name__ == "__main__":
+    main()
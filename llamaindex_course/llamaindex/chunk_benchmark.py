@@ -0,0 +1,220 @@
+""" Benchmark the chunk size and overlap of an index: build cost, query latency and hit rate """
+
+import sys
+import json
+import time
+import tracemalloc
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+# import the logging module
+import logging
+
+import numpy as np
+from rich.console import Console
+from rich.table import Table
+
+from llama_index.core import Document, VectorStoreIndex
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.node_parser import SentenceSplitter
+
+from llamaindex_course.llamaindex.hashing_embedding import HashingEmbedding
+from llamaindex_course.llamaindex.mmap_vector_store import new_storage_context
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZES = (256, 512, 1024)
+DEFAULT_CHUNK_OVERLAPS = (0, 64)
+
+
+class LabeledQuestion(NamedTuple):
+    """A question and a passage of the corpus that answers it"""
+
+    question: str
+    expected: str
+
+
+class BenchmarkRow(NamedTuple):
+    """Cost and quality of an index built with a chunk size and overlap"""
+
+    chunk_size: int
+    chunk_overlap: int
+    nodes: int
+    build_seconds: float
+    peak_mb: float
+    p50_ms: float
+    p95_ms: float
+    hit_rate: float
+    mrr: float
+
+
+def read_questions(path: str) -> List[LabeledQuestion]:
+    """Read the labeled questions of a JSON file
+
+    The file holds a list of {"question": ..., "expected": ...}: expected is
+    a short passage of the corpus (a figure, a sentence) that a retrieved
+    chunk must contain to answer the question. The passages do not depend
+    on the chunking, so the same file labels every chunk size.
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        return [LabeledQuestion(item["question"], item["expected"]) for item in json.load(file)]
+
+
+def _normalized(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def _first_hit(texts: Sequence[str], expected: str) -> int:
+    """Rank (from 1) of the first text containing the expected passage, 0 when none does"""
+    expected = _normalized(expected)
+    for rank, text in enumerate(texts, start=1):
+        if expected in _normalized(text):
+            return rank
+    return 0
+
+
+def _build(
+    documents: Sequence[Document], chunk_size: int, chunk_overlap: int, embed_model: BaseEmbedding
+) -> VectorStoreIndex:
+    return VectorStoreIndex.from_documents(
+        documents,
+        embed_model=embed_model,
+        storage_context=new_storage_context(backend="exact"),
+        transformations=[SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)],
+    )
+
+
+def benchmark_settings(
+    documents: Sequence[Document],
+    questions: Sequence[LabeledQuestion],
+    chunk_size: int,
+    chunk_overlap: int,
+    top_k: int = 2,
+    embed_model: Optional[BaseEmbedding] = None,
+) -> BenchmarkRow:
+    """Build an index with a chunk size and overlap and measure it
+
+    Args:
+        documents: The corpus
+        questions: The labeled questions
+        chunk_size: The chunk size of the SentenceSplitter, in tokens
+        chunk_overlap: The chunk overlap of the SentenceSplitter, in tokens
+        top_k: Number of nodes retrieved per question
+        embed_model: The embedding model, a HashingEmbedding by default
+    Returns:
+        The build time and peak memory (Python allocations, including
+        numpy), measured in two builds as tracing the allocations slows the
+        build down, the number of nodes, the p50 and p95 retrieval latency,
+        the ratio of the questions whose passage is in the top k nodes, and
+        the mean reciprocal rank of the passage
+    """
+    embed_model = embed_model or HashingEmbedding()
+    start = time.perf_counter()
+    index = _build(documents, chunk_size, chunk_overlap, embed_model)
+    build_seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    try:
+        _build(documents, chunk_size, chunk_overlap, embed_model)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    retriever = index.as_retriever(similarity_top_k=top_k)
+    latencies = []
+    ranks = []
+    for question in questions:
+        start = time.perf_counter()
+        nodes = retriever.retrieve(question.question)
+        latencies.append(time.perf_counter() - start)
+        ranks.append(_first_hit([node.node.get_content() for node in nodes], question.expected))
+
+    p50, p95 = np.percentile(latencies, [50, 95]) * 1000 if latencies else (0.0, 0.0)
+    return BenchmarkRow(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        nodes=len(index.index_struct.nodes_dict),
+        build_seconds=build_seconds,
+        peak_mb=peak / 1024**2,
+        p50_ms=float(p50),
+        p95_ms=float(p95),
+        hit_rate=float(np.mean([rank > 0 for rank in ranks])) if ranks else 0.0,
+        mrr=float(np.mean([1 / rank if rank else 0.0 for rank in ranks])) if ranks else 0.0,
+    )
+
+
+def benchmark(
+    documents: Sequence[Document],
+    questions: Sequence[LabeledQuestion],
+    chunk_sizes: Sequence[int] = DEFAULT_CHUNK_SIZES,
+    chunk_overlaps: Sequence[int] = DEFAULT_CHUNK_OVERLAPS,
+    top_k: int = 2,
+) -> List[BenchmarkRow]:
+    """Measure every chunk size and overlap (see benchmark_settings)
+
+    The overlaps that are not smaller than the chunk size are skipped.
+    """
+    embed_model = HashingEmbedding()
+    rows = []
+    for chunk_size in chunk_sizes:
+        for chunk_overlap in chunk_overlaps:
+            if chunk_overlap >= chunk_size:
+                continue
+            row = benchmark_settings(documents, questions, chunk_size, chunk_overlap, top_k, embed_model)
+            logger.info("%s", row)
+            rows.append(row)
+    return rows
+
+
+def _table(rows: Sequence[BenchmarkRow], top_k: int) -> Table:
+    table = Table()
+    columns: Dict[str, str] = {
+        "chunk size": "chunk_size",
+        "overlap": "chunk_overlap",
+        "nodes": "nodes",
+        "build (s)": "build_seconds",
+        "peak (MB)": "peak_mb",
+        "p50 (ms)": "p50_ms",
+        "p95 (ms)": "p95_ms",
+        f"hit@{top_k}": "hit_rate",
+        "MRR": "mrr",
+    }
+    for header in columns:
+        table.add_column(header, justify="right")
+    for row in rows:
+        values = row._asdict()
+        table.add_row(
+            *(
+                f"{values[field]:.2f}" if isinstance(values[field], float) else str(values[field])
+                for field in columns.values()
+            )
+        )
+    return table
+
+
+def main():
+    """
+    Benchmark chunk sizes and overlaps on a corpus with a labeled question set
+
+    Usage: python -m llamaindex_course.llamaindex.chunk_benchmark questions.json [data dir] [sizes] [overlaps] [top k]
+    eg. python -m llamaindex_course.llamaindex.chunk_benchmark questions.json data 256,512,1024 0,64 2
+    """
+    # pylint: disable=import-outside-toplevel
+    from llamaindex_course.llamaindex.pdf_loader import load_documents
+
+    console = Console()
+    if len(sys.argv) < 2:
+        console.print(main.__doc__)
+        sys.exit(1)
+    questions = read_questions(sys.argv[1])
+    input_dir = sys.argv[2] if len(sys.argv) > 2 else "data"
+    chunk_sizes = [int(size) for size in sys.argv[3].split(",")] if len(sys.argv) > 3 else DEFAULT_CHUNK_SIZES
+    overlaps = [int(size) for size in sys.argv[4].split(",")] if len(sys.argv) > 4 else DEFAULT_CHUNK_OVERLAPS
+    top_k = int(sys.argv[5]) if len(sys.argv) > 5 else 2
+
+    documents = load_documents(input_dir)
+    console.print(f"{len(documents)} documents, {len(questions)} questions")
+    console.print(_table(benchmark(documents, questions, chunk_sizes, overlaps, top_k), top_k))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+""" Pack the retrieved chunks into a token budget before the synthesis """
+
+import os
+import re
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+# import the logging module
+import logging
+
+import numpy as np
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import BaseNode, MetadataMode, NodeWithScore, QueryBundle
+from llama_index.core.utils import get_tokenizer
+
+from llamaindex_course.llamaindex.hashing_embedding import HashingEmbedding
+from llamaindex_course.llamaindex.similarity import normalize_rows
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of tokens of context sent to the LLM, can be set with the
+# CONTEXT_TOKEN_BUDGET environment variable
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "1024"))
+
+# Two sentences more similar than this are redundant, only the best one is kept
+DEFAULT_REDUNDANCY_THRESHOLD = 0.9
+
+# End of a sentence: punctuation followed by a space and an upper case letter
+# or a digit (not "e.g. the" nor "27.6"), or a blank line
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(])|\n\s*\n")
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split a text into sentences, without a model (no nltk data to download)"""
+    return [sentence.strip() for sentence in _SENTENCE_END.split(text) if sentence.strip()]
+
+
+class PackingStats(NamedTuple):
+    """Tokens of the retrieved chunks and of the packed context"""
+
+    tokens_in: int
+    tokens_out: int
+
+    @property
+    def tokens_saved(self) -> int:
+        """Tokens not sent to the LLM"""
+        return self.tokens_in - self.tokens_out
+
+    @property
+    def ratio(self) -> float:
+        """Ratio of the tokens kept"""
+        return self.tokens_out / self.tokens_in if self.tokens_in else 1.0
+
+
+class ContextPackingPostprocessor(BaseNodePostprocessor):
+    """Keep the sentences of the retrieved nodes that matter, within a token budget
+
+    The nodes are split into sentences, and the sentences are ranked by
+    their similarity to the query. Best first, a sentence is kept unless
+    it is redundant with a kept sentence (eg. the overlap of two chunks,
+    or a figure repeated in the summary and the detail) or it does not fit
+    in the token budget. The kept sentences of each node stay in their
+    order, a node without any kept sentence is dropped. The tokens are
+    counted on the text sent to the LLM: the metadata of a node (page
+    label, file path) is counted once, with its first kept sentence.
+
+    The sentences are embedded with a HashingEmbedding by default: no model
+    call, it scores the word overlap. Pass the embedding model of the index
+    for a semantic ranking (with a CachedEmbedding the sentences are only
+    embedded once).
+
+    Use it as a node postprocessor:
+        index.as_query_engine(node_postprocessors=[ContextPackingPostprocessor()])
+    """
+
+    token_budget: int = Field(default=CONTEXT_TOKEN_BUDGET, gt=0, description="Maximum number of tokens kept")
+    redundancy_threshold: float = Field(
+        default=DEFAULT_REDUNDANCY_THRESHOLD,
+        description="Similarity above which a sentence is redundant with a kept one",
+    )
+    embed_model: BaseEmbedding = Field(
+        default_factory=HashingEmbedding, description="The model embedding the query and the sentences"
+    )
+
+    _tokenizer: Callable = PrivateAttr()
+    _tokens_in: int = PrivateAttr(default=0)
+    _tokens_out: int = PrivateAttr(default=0)
+    _last_stats: Optional[PackingStats] = PrivateAttr(default=None)
+
+    def __init__(self, tokenizer: Optional[Callable] = None, **kwargs):
+        """Create the postprocessor
+        Args:
+            tokenizer: The tokenizer counting the tokens, the global llama_index tokenizer by default
+            token_budget: Maximum number of tokens kept
+            redundancy_threshold: Similarity above which a sentence is redundant
+            embed_model: The model embedding the query and the sentences
+        """
+        super().__init__(**kwargs)
+        self._tokenizer = tokenizer or get_tokenizer()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ContextPackingPostprocessor"
+
+    @property
+    def stats(self) -> PackingStats:
+        """Tokens in and out, summed over every query"""
+        return PackingStats(self._tokens_in, self._tokens_out)
+
+    @property
+    def last_stats(self) -> Optional[PackingStats]:
+        """Tokens in and out of the last query"""
+        return self._last_stats
+
+    def _count(self, text: str) -> int:
+        return len(self._tokenizer(text))
+
+    def _llm_tokens(self, node: BaseNode) -> int:
+        """Tokens of a node as sent to the LLM, with its metadata"""
+        return self._count(node.get_content(metadata_mode=MetadataMode.LLM))
+
+    def _metadata_tokens(self, node: BaseNode) -> int:
+        """Tokens added by the metadata of a node to its text sent to the LLM"""
+        empty = node.copy()
+        empty.set_content("")
+        return self._llm_tokens(empty)
+
+    def _select(
+        self,
+        query: str,
+        sentences: List[Tuple[int, str]],
+        tokens: List[int],
+        metadata_tokens: List[int],
+    ) -> List[int]:
+        """Indices of the kept (node position, sentence)"""
+        texts = [sentence for _, sentence in sentences]
+        vectors = normalize_rows(np.array(self.embed_model.get_text_embedding_batch(texts)))
+        query_vector = normalize_rows(np.array([self.embed_model.get_query_embedding(query)]))[0]
+        kept: List[int] = []
+        kept_positions = set()
+        budget = self.token_budget
+        for index in np.argsort(-(vectors @ query_vector), kind="stable"):
+            position = sentences[index][0]
+            cost = tokens[index] + (0 if position in kept_positions else metadata_tokens[position])
+            if cost > budget:
+                continue
+            if kept and np.max(vectors[kept] @ vectors[index]) >= self.redundancy_threshold:
+                continue
+            kept.append(int(index))
+            kept_positions.add(position)
+            budget -= cost
+        return kept
+
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        if query_bundle is None or not nodes:
+            return nodes
+
+        # (node position, sentence) of every sentence of the nodes
+        sentences: List[Tuple[int, str]] = [
+            (position, sentence)
+            for position, node in enumerate(nodes)
+            for sentence in split_sentences(node.node.get_content())
+        ]
+        tokens = [self._count(sentence) for _, sentence in sentences]
+        metadata_tokens = [self._metadata_tokens(node.node) for node in nodes]
+        tokens_in = sum(self._llm_tokens(node.node) for node in nodes)
+        kept = (
+            set(self._select(query_bundle.query_str, sentences, tokens, metadata_tokens))
+            if sentences
+            else set()
+        )
+
+        packed = []
+        for position, node in enumerate(nodes):
+            text = " ".join(
+                sentence
+                for index, (sentence_position, sentence) in enumerate(sentences)
+                if sentence_position == position and index in kept
+            )
+            if text:
+                new_node = node.node.copy()
+                new_node.set_content(text)
+                packed.append(NodeWithScore(node=new_node, score=node.score))
+
+        tokens_out = sum(self._llm_tokens(node.node) for node in packed)
+        self._last_stats = PackingStats(tokens_in, tokens_out)
+        self._tokens_in += tokens_in
+        self._tokens_out += tokens_out
+        logger.info(
+            "Packed %s nodes into %s: %s tokens instead of %s (%s saved)",
+            len(nodes),
+            len(packed),
+            tokens_out,
+            tokens_in,
+            tokens_in - tokens_out,
+        )
+        return packed
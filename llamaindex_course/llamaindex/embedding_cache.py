@@ -0,0 +1,260 @@
+""" Persistent embedding cache shared by the indexing scripts """
+
+import os
+import sys
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from array import array
+from typing import Any, Dict, List, NamedTuple, Sequence
+
+# import the logging module
+import logging
+
+from rich.console import Console
+
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.embeddings.utils import EmbedType, resolve_embed_model
+
+logger = logging.getLogger(__name__)
+
+# Path of the cache, can be set with the EMBEDDING_CACHE_PATH environment variable
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "embeddings.db")
+
+# Maximum number of embeddings kept in the cache, the least recently used
+# embeddings are evicted first
+DEFAULT_MAX_ENTRIES = 200_000
+
+# Number of keys per SELECT ... IN (...) query (SQLite limits the number of parameters)
+_LOOKUP_BATCH_SIZE = 500
+
+# Seconds a writer waits for the other processes writing the cache (the
+# workers of a sharded build, see sharded_index)
+_BUSY_TIMEOUT = 60.0
+
+# The vectors are stored as float32 blobs: 3 KB for a 768 dimensions embedding
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key BLOB PRIMARY KEY,
+    model TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    last_used REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used);
+"""
+
+
+class EmbeddingCacheStats(NamedTuple):
+    """Counters of a CachedEmbedding"""
+
+    hits: int
+    misses: int
+
+    @property
+    def hit_rate(self) -> float:
+        """Ratio of the embeddings served from the cache"""
+        return self.hits / max(self.hits + self.misses, 1)
+
+
+def normalize_text(text: str) -> str:
+    """Normalize a text before hashing: NFC unicode form, no leading or trailing whitespace"""
+    return unicodedata.normalize("NFC", text).strip()
+
+
+def model_key(embed_model: BaseEmbedding) -> str:
+    """Identify the embedding model: the embeddings of two models are not interchangeable"""
+    return f"{embed_model.class_name()}:{embed_model.model_name}"
+
+
+class CachedEmbedding(BaseEmbedding):
+    """Embedding model serving the embeddings of known texts from a SQLite cache
+
+    The cache is keyed by the embedding model and the hash of the normalized
+    text (query and text embeddings are kept apart, some models embed them
+    differently). It is shared by every script using the same cache path, so
+    rebuilding an index with unchanged chunks does not call the embedding
+    model at all. When the cache holds more than max_entries embeddings, the
+    least recently used ones are evicted.
+
+    Use it as the embed_model of a ServiceContext:
+        embed_model=CachedEmbedding(OllamaBatchEmbedding(model_name=EMBEDDING_MODEL))
+    """
+
+    embed_model: BaseEmbedding = Field(description="The embedding model whose embeddings are cached")
+    cache_path: str = Field(default=EMBEDDING_CACHE_PATH, description="Path of the SQLite cache")
+    max_entries: int = Field(default=DEFAULT_MAX_ENTRIES, gt=0, description="Maximum number of cached embeddings")
+
+    _connection: sqlite3.Connection = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _hits: int = PrivateAttr(default=0)
+    _misses: int = PrivateAttr(default=0)
+
+    def __init__(
+        self,
+        embed_model: EmbedType = "default",
+        cache_path: str = EMBEDDING_CACHE_PATH,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        **kwargs: Any,
+    ):
+        """Wrap an embedding model
+        Args:
+            embed_model: The embedding model, anything accepted by ServiceContext.from_defaults
+            (a llama_index or langchain embedding model, "default", "local:...")
+            cache_path: The path of the SQLite cache, ":memory:" for an in-memory cache
+            max_entries: Maximum number of embeddings kept in the cache
+        """
+        embed_model = resolve_embed_model(embed_model)
+        kwargs.setdefault("embed_batch_size", embed_model.embed_batch_size)
+        super().__init__(
+            embed_model=embed_model,
+            cache_path=cache_path,
+            max_entries=max_entries,
+            model_name=embed_model.model_name,
+            **kwargs,
+        )
+        # pydantic validation stores a copy of the model, keep the model itself
+        # (and its connection pool and counters)
+        self.embed_model = embed_model
+        if os.path.dirname(cache_path):
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        self._connection = sqlite3.connect(cache_path, check_same_thread=False, timeout=_BUSY_TIMEOUT)
+        self._connection.executescript(_SCHEMA)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def stats(self) -> EmbeddingCacheStats:
+        """Hit and miss counters"""
+        return EmbeddingCacheStats(self._hits, self._misses)
+
+    def close(self) -> None:
+        """Close the cache"""
+        self._connection.close()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # A SQLite connection cannot be pickled: an unpickled copy (in a worker
+        # process of a sharded build, see sharded_index) opens its own
+        return {
+            "embed_model": self.embed_model,
+            "cache_path": self.cache_path,
+            "max_entries": self.max_entries,
+            "embed_batch_size": self.embed_batch_size,
+        }
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(**state)  # pylint: disable=unnecessary-dunder-call
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT count(*) FROM embeddings").fetchone()[0]
+
+    def __bool__(self) -> bool:
+        # llama_index tests "if embed_model": an empty cache is still a model
+        return True
+
+    def _key(self, kind: str, text: str) -> bytes:
+        return hashlib.sha256(
+            f"{model_key(self.embed_model)}\0{kind}\0{normalize_text(text)}".encode("utf-8")
+        ).digest()
+
+    def _lookup(self, keys: Sequence[bytes]) -> Dict[bytes, Embedding]:
+        """Read the cached embeddings of the keys and mark them as recently used"""
+        found: Dict[bytes, Embedding] = {}
+        now = time.time()
+        with self._lock, self._connection:
+            for start in range(0, len(keys), _LOOKUP_BATCH_SIZE):
+                batch = keys[start : start + _LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                for key, vector in self._connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                ):
+                    found[key] = array("f", vector).tolist()
+            self._connection.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(now, key) for key in found],
+            )
+        return found
+
+    def _store(self, embeddings: Dict[bytes, Embedding]) -> None:
+        """Write embeddings in the cache and evict the least recently used ones"""
+        now = time.time()
+        model = model_key(self.embed_model)
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (key, model, array("f", embedding).tobytes(), now)
+                    for key, embedding in embeddings.items()
+                ],
+            )
+            (count,) = self._connection.execute("SELECT count(*) FROM embeddings").fetchone()
+            if count > self.max_entries:
+                self._connection.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+                logger.info("Evicted %s embeddings from %s", count - self.max_entries, self.cache_path)
+
+    def _embed(self, kind: str, texts: List[str]) -> List[Embedding]:
+        keys = [self._key(kind, text) for text in texts]
+        cached = self._lookup(list(dict.fromkeys(keys)))
+
+        # Embed each missing text once, even when it appears several times
+        missing = {key: text for key, text in zip(keys, texts) if key not in cached}
+        if missing:
+            if kind == "query":
+                computed = [self.embed_model.get_query_embedding(text) for text in missing.values()]
+            else:
+                computed = self.embed_model.get_text_embedding_batch(list(missing.values()))
+            new_embeddings = dict(zip(missing, computed))
+            self._store(new_embeddings)
+            cached.update(new_embeddings)
+
+        with self._lock:
+            self._misses += len(missing)
+            self._hits += len(texts) - len(missing)
+        return [cached[key] for key in keys]
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._embed("query", [query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        # The SQLite lookup (and the model on a miss) must not block the event loop of batch_query
+        return await asyncio.to_thread(self._get_query_embedding, query)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._embed("text", [text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return self._embed("text", texts)
+
+
+def main():
+    """
+    Print the content of the cache
+
+    Usage: python -m llamaindex_course.llamaindex.embedding_cache [cache path]
+    """
+    console = Console()
+    cache_path = sys.argv[1] if len(sys.argv) > 1 else EMBEDDING_CACHE_PATH
+    if not os.path.exists(cache_path):
+        console.print(f"No embedding cache in {cache_path}")
+        return
+    with sqlite3.connect(cache_path) as connection:
+        for model, count, size in connection.execute(
+            "SELECT model, count(*), sum(length(vector)) FROM embeddings GROUP BY model"
+        ):
+            console.print(f"{model}: {count} embeddings, {size / 1024 / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+""" Deterministic local embedding model, no model download and no network """
+
+import hashlib
+from typing import Any
+
+import numpy as np
+
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import Field
+
+from llamaindex_course.llamaindex.bm25_index import tokenize
+
+
+class HashingEmbedding(BaseEmbedding):
+    """Deterministic local embedding: hashed bag of words
+
+    Each word (and each pair of consecutive words) is hashed to a
+    dimension and a sign, weighted by the log of its count, and the vector
+    is normalized. It needs no model and no network, gives the same
+    vectors on every run and embeds thousands of sentences per second:
+    chunk_benchmark compares settings offline with it, context_packing
+    scores sentences with it. It only captures word overlap, it does not
+    measure the quality of a real embedding model.
+    """
+
+    dimension: int = Field(default=1024, gt=0, description="Size of the vectors")
+
+    def __init__(self, dimension: int = 1024, **kwargs: Any):
+        super().__init__(dimension=dimension, model_name=f"hashing-{dimension}", **kwargs)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "HashingEmbedding"
+
+    def _embed(self, text: str) -> Embedding:
+        tokens = tokenize(text)
+        features = tokens + [f"{first} {second}" for first, second in zip(tokens, tokens[1:])]
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for feature in features:
+            # blake2b, not hash(): the str hash changes between processes
+            digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[digest % self.dimension] += 1.0 if digest >> 63 else -1.0
+        vector = np.sign(vector) * np.log1p(np.abs(vector))
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._embed(text)
@@ -0,0 +1,228 @@
+""" Incremental indexing: only re-embed the documents (or nodes) that changed """
+
+import os
+import json
+import shutil
+import hashlib
+
+# import the logging module
+import logging
+
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from llama_index.core import Document, VectorStoreIndex
+from llama_index.core.ingestion.pipeline import remove_unstable_values
+from llama_index.core.schema import BaseNode
+from llama_index.core.settings import (
+    Settings,
+    embed_model_from_settings_or_context,
+    transformations_from_settings_or_context,
+)
+
+from llamaindex_course.llamaindex.bm25_index import bm25_index_exists, persist_bm25_index
+from llamaindex_course.llamaindex.embedding_cache import CachedEmbedding, model_key
+from llamaindex_course.llamaindex.mmap_vector_store import load_index, new_storage_context
+
+logger = logging.getLogger(__name__)
+
+# File of the settings an index was built with, in its persist directory
+INDEX_SETTINGS_FNAME = "index_settings.json"
+
+
+class RefreshStats(NamedTuple):
+    """What an incremental refresh did"""
+
+    added: int
+    updated: int
+    unchanged: int
+    deleted: int
+
+    @property
+    def embedded(self) -> int:
+        """Number of documents (or nodes) that were embedded"""
+        return self.added + self.updated
+
+
+def index_exists(persist_dir: str) -> bool:
+    """True if an index was persisted in persist_dir"""
+    return os.path.exists(os.path.join(persist_dir, "docstore.json"))
+
+
+def index_settings(
+    index_kwargs: Dict[str, Any], with_transformations: bool = True
+) -> Dict[str, str]:
+    """What the nodes of an index depend on besides the documents
+
+    The embedding model (a CachedEmbedding is identified by the model it
+    wraps) and a hash of the configuration of the transformations (the
+    splitter and its chunk size, ...), from the index arguments or the
+    global Settings like VectorStoreIndex.
+    """
+    service_context = index_kwargs.get("service_context")
+    embed_model = index_kwargs.get("embed_model") or embed_model_from_settings_or_context(
+        Settings, service_context
+    )
+    if isinstance(embed_model, CachedEmbedding):
+        embed_model = embed_model.embed_model
+    settings = {"embed_model": model_key(embed_model)}
+    if with_transformations:
+        transformations = index_kwargs.get(
+            "transformations"
+        ) or transformations_from_settings_or_context(Settings, service_context)
+        settings["transformations"] = hashlib.sha256(
+            "\0".join(
+                remove_unstable_values(str(transformation.to_dict()))
+                for transformation in transformations
+            ).encode("utf-8")
+        ).hexdigest()
+    return settings
+
+
+def _stored_settings(persist_dir: str) -> Optional[Dict[str, str]]:
+    try:
+        with open(os.path.join(persist_dir, INDEX_SETTINGS_FNAME), "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_settings(persist_dir: str, settings: Dict[str, str]) -> None:
+    path = os.path.join(persist_dir, INDEX_SETTINGS_FNAME)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as file:
+        json.dump(settings, file)
+    os.replace(temporary_path, path)
+
+
+def _remove_if_settings_changed(persist_dir: str, settings: Dict[str, str]) -> None:
+    """Remove a persisted index built with other settings: it is rebuilt"""
+    if not index_exists(persist_dir):
+        return
+    stored = _stored_settings(persist_dir)
+    if stored == settings:
+        return
+    logger.warning(
+        "The index in %s was built with other settings (%s instead of %s), rebuilding it",
+        persist_dir,
+        stored,
+        settings,
+    )
+    shutil.rmtree(persist_dir)
+
+
+def _persist(index: VectorStoreIndex, persist_dir: str, settings: Dict[str, str]) -> None:
+    """Persist the index, the BM25 index of its nodes and the settings it was built with"""
+    index.storage_context.persist(persist_dir=persist_dir)
+    persist_bm25_index(index, persist_dir)
+    _write_settings(persist_dir, settings)
+
+
+def refresh_index(
+    documents: Sequence[Document], persist_dir: str, **index_kwargs: Any
+) -> Tuple[VectorStoreIndex, RefreshStats]:
+    """Create or incrementally update a persisted index from documents
+
+    The docstore keeps the hash of every document. A document whose hash
+    did not change is not embedded again, a new or changed document is
+    (re)inserted, and the documents that are no longer in the list (eg. a
+    deleted file) are removed with their nodes. The documents need stable
+    ids: use SimpleDirectoryReader(..., filename_as_id=True). The hashes do
+    not cover the transformations nor the embedding model: they are
+    recorded in the persist directory (see index_settings), and the index
+    is rebuilt when they changed (eg. another chunk size). A new index
+    stores its embeddings in an MmapVectorStore. The BM25 index of the
+    nodes (see bm25_index) is rebuilt whenever the index is persisted.
+
+    Args:
+        documents: The documents of the corpus
+        persist_dir: The directory of the persisted index
+        index_kwargs: Arguments of the index (service_context, transformations, ...)
+    Returns:
+        The index (persisted) and what was done
+    """
+    # Keep the nodes in the docstore even when the vector store keeps their
+    # text (chroma): the refresh reads the ref docs and node ids from it
+    index_kwargs.setdefault("store_nodes_override", True)
+    settings = index_settings(index_kwargs)
+    _remove_if_settings_changed(persist_dir, settings)
+    if not index_exists(persist_dir):
+        logger.info("Creating the index in %s", persist_dir)
+        index_kwargs.setdefault("storage_context", new_storage_context(persist_dir))
+        index = VectorStoreIndex.from_documents(documents, **index_kwargs)
+        _persist(index, persist_dir, settings)
+        return index, RefreshStats(len(documents), 0, 0, 0)
+
+    index = load_index(persist_dir, **index_kwargs)
+    existing_ids = set(index.ref_doc_info)
+    document_ids = {document.doc_id for document in documents}
+
+    refreshed = index.refresh_ref_docs(documents)
+    added = sum(
+        1
+        for document, changed in zip(documents, refreshed)
+        if changed and document.doc_id not in existing_ids
+    )
+    updated = sum(refreshed) - added
+
+    deleted_ids = existing_ids - document_ids
+    for ref_doc_id in deleted_ids:
+        index.delete_ref_doc(ref_doc_id, delete_from_docstore=True)
+
+    stats = RefreshStats(added, updated, len(documents) - sum(refreshed), len(deleted_ids))
+    if stats.embedded or stats.deleted or not bm25_index_exists(persist_dir):
+        _persist(index, persist_dir, settings)
+    logger.info("Refreshed the index in %s: %s", persist_dir, stats)
+    return index, stats
+
+
+def refresh_node_index(
+    nodes: List[BaseNode], persist_dir: str, **index_kwargs: Any
+) -> Tuple[VectorStoreIndex, RefreshStats]:
+    """Create or incrementally update a persisted index from nodes
+
+    The nodes must have ids derived from their content (eg. the nodes of
+    fhir_nodes): a node whose id is already in the index is unchanged, a
+    new id is embedded and inserted, and the ids that are no longer
+    produced are deleted. The index is rebuilt when the embedding model
+    changed.
+
+    Args:
+        nodes: The nodes of the corpus
+        persist_dir: The directory of the persisted index
+        index_kwargs: Arguments of the index (service_context, ...)
+    Returns:
+        The index (persisted) and what was done
+    """
+    # See refresh_index
+    index_kwargs.setdefault("store_nodes_override", True)
+    # The nodes are not transformed, only the embedding model matters
+    settings = index_settings(index_kwargs, with_transformations=False)
+    _remove_if_settings_changed(persist_dir, settings)
+    if not index_exists(persist_dir):
+        logger.info("Creating the index in %s", persist_dir)
+        index_kwargs.setdefault("storage_context", new_storage_context(persist_dir))
+        index = VectorStoreIndex(nodes=nodes, **index_kwargs)
+        _persist(index, persist_dir, settings)
+        return index, RefreshStats(len(nodes), 0, 0, 0)
+
+    index = load_index(persist_dir, **index_kwargs)
+    existing_ids = set(index.index_struct.nodes_dict.values())
+    node_ids = {node.node_id for node in nodes}
+
+    new_nodes = [node for node in nodes if node.node_id not in existing_ids]
+    if new_nodes:
+        index.insert_nodes(new_nodes)
+
+    deleted_ids = existing_ids - node_ids
+    if deleted_ids:
+        index.delete_nodes(list(deleted_ids), delete_from_docstore=True)
+        # delete_nodes leaves the ids in the index struct
+        for node_id in deleted_ids:
+            index.index_struct.delete(node_id)
+        index.storage_context.index_store.add_index_struct(index.index_struct)
+
+    stats = RefreshStats(len(new_nodes), 0, len(nodes) - len(new_nodes), len(deleted_ids))
+    if stats.embedded or stats.deleted or not bm25_index_exists(persist_dir):
+        _persist(index, persist_dir, settings)
+    logger.info("Refreshed the index in %s: %s", persist_dir, stats)
+    return index, stats
@@ -0,0 +1,451 @@
+""" Vector store persisted as a memory-mapped float32 matrix (.npy) and an id table """
+
+import os
+import sys
+import glob
+import json
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+# import the logging module
+import logging
+
+import numpy as np
+from rich.console import Console
+
+from llama_index.core import StorageContext, load_index_from_storage
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.indices.base import BaseIndex
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.simple import SimpleVectorStore
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+
+from llamaindex_course.llamaindex.similarity import normalize_rows, top_k_indices
+
+logger = logging.getLogger(__name__)
+
+# Persist path of the default vector store in a persist directory: the
+# store writes its arrays and id table next to it
+VECTOR_STORE_FNAME = "default__vector_store.json"
+
+# Vector store of the new indexes, can be set with the VECTOR_STORE_BACKEND
+# environment variable: "exact" (MmapVectorStore), "ivf" or "chroma" for an
+# approximate search (see ann_vector_store), "int8" for quantized embeddings
+# (see quantized_vector_store)
+VECTOR_STORE_BACKEND = os.environ.get("VECTOR_STORE_BACKEND", "exact")
+
+# Times a load reads the id table again when a persist removed the files it named
+_LOAD_ATTEMPTS = 5
+
+
+def store_paths(persist_path: str) -> tuple:
+    """Paths of the matrix (as persisted before the generations) and of the id table"""
+    base = os.path.splitext(persist_path)[0]
+    return f"{base}.npy", f"{base}.ids.json"
+
+
+def _remove_stale_arrays(persist_path: str, keep: set) -> None:
+    """Remove the array files of the previous persists of a store"""
+    base = os.path.splitext(persist_path)[0]
+    paths = glob.glob(f"{glob.escape(base)}.*.npy") + [store_paths(persist_path)[0]]
+    for path in paths:
+        if os.path.basename(path) in keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except PermissionError:
+            # Windows does not remove a mapped file, the next persist will
+            logger.debug("Cannot remove %s, it is in use", path)
+
+
+class MmapVectorStore(BasePydanticVectorStore):
+    """Vector store keeping the embeddings in one contiguous float32 matrix
+
+    The default SimpleVectorStore persists the embeddings as JSON lists of
+    floats: loading an index parses every float, and each query process
+    holds its own copy. This store persists a .npy matrix of the
+    normalized embeddings and a small JSON table of the node ids. On load
+    the matrix is memory-mapped: the load time does not depend on the
+    number of embeddings, and the query processes share the pages of the
+    file in the OS page cache.
+
+    The added and deleted nodes are buffered, and applied to the matrix in
+    one copy on the next query or persist: an incremental refresh of k
+    documents copies the matrix once, not k times, and a process adding
+    nodes keeps reading the shared memory map until then. A persist
+    writes new files and switches the id table to them last, so
+    that the processes mapping the previous files are not disturbed and a
+    reader never pairs a matrix with the ids of another persist.
+
+    The subclasses take their search parameters as keyword arguments of
+    query. A retriever only passes its vector_store_kwargs to the store, so
+    they are set per retriever with:
+        index.as_retriever(vector_store_kwargs={"n_probe": 16})
+    """
+
+    stores_text: bool = False
+
+    # The rows of the matrix then of the pending blocks, a deleted row has a None id
+    _ids: List[Optional[str]] = PrivateAttr(default_factory=list)
+    _ref_doc_ids: List[Optional[str]] = PrivateAttr(default_factory=list)
+    _positions: Dict[str, int] = PrivateAttr(default_factory=dict)
+    _doc_rows: Dict[Optional[str], List[int]] = PrivateAttr(default_factory=dict)
+    _vectors: Optional[np.ndarray] = PrivateAttr(default=None)
+    _pending: List[np.ndarray] = PrivateAttr(default_factory=list)
+
+    def __init__(
+        self,
+        vectors: Optional[np.ndarray] = None,
+        ids: Optional[List[str]] = None,
+        ref_doc_ids: Optional[List[Optional[str]]] = None,
+        **kwargs: Any,
+    ):
+        """Create a store
+        Args:
+            vectors: The normalized embeddings, one row per node (a memory map when loaded)
+            ids: The node ids of the rows
+            ref_doc_ids: The ids of the documents of the nodes
+        """
+        super().__init__(**kwargs)
+        self._vectors = vectors
+        self._ids = list(ids or [])
+        self._ref_doc_ids = list(ref_doc_ids or [None] * len(self._ids))
+        self._index_rows()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MmapVectorStore"
+
+    @property
+    def client(self) -> None:
+        return None
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """The normalized embeddings, one row per node"""
+        self._compact()
+        if self._vectors is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self._vectors
+
+    # No __len__: StorageContext.from_defaults tests "if vector_store" and
+    # would replace an empty store with a SimpleVectorStore
+    @property
+    def ids(self) -> List[str]:
+        """The node ids of the rows"""
+        return [node_id for node_id in self._ids if node_id is not None]
+
+    def get(self, text_id: str) -> List[float]:
+        """Get the (normalized) embedding of a node"""
+        return self.vectors[self._positions[text_id]].tolist()
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        """Add the embeddings of nodes"""
+        if not nodes:
+            return []
+        self._pending.append(
+            normalize_rows(np.array([node.get_embedding() for node in nodes], dtype=np.float32))
+        )
+        for node in nodes:
+            # A node added again replaces its previous embedding
+            self._delete_row(self._positions.get(node.node_id))
+            self._positions[node.node_id] = len(self._ids)
+            self._doc_rows.setdefault(node.ref_doc_id, []).append(len(self._ids))
+            self._ids.append(node.node_id)
+            self._ref_doc_ids.append(node.ref_doc_id)
+        return [node.node_id for node in nodes]
+
+    def _delete_row(self, row: Optional[int]) -> None:
+        """Mark a row as deleted, it is dropped by the next _compact"""
+        if row is not None and self._ids[row] is not None:
+            del self._positions[self._ids[row]]
+            self._ids[row] = None
+
+    def _index_rows(self) -> None:
+        self._positions = {node_id: row for row, node_id in enumerate(self._ids) if node_id is not None}
+        self._doc_rows = {}
+        for row, ref_doc_id in enumerate(self._ref_doc_ids):
+            self._doc_rows.setdefault(ref_doc_id, []).append(row)
+
+    def _compact(self) -> None:
+        """Apply the pending additions and deletions to the matrix, in one copy"""
+        if not self._pending and len(self._positions) == len(self._ids):
+            return
+        new_vectors = np.concatenate(self._pending) if self._pending else None
+        mask = (
+            np.array([node_id is not None for node_id in self._ids], dtype=bool)
+            if len(self._positions) != len(self._ids)
+            else None
+        )
+        self._compact_rows(new_vectors, mask)
+        blocks = ([] if self._vectors is None else [self._vectors]) + (
+            [] if new_vectors is None else [new_vectors]
+        )
+        if mask is not None:
+            bounds = np.cumsum([0] + [len(block) for block in blocks])
+            blocks = [block[mask[start:end]] for block, start, end in zip(blocks, bounds, bounds[1:])]
+        vectors = np.concatenate(blocks) if len(blocks) > 1 else blocks[0]
+        self._vectors = vectors if len(vectors) else None
+        self._ref_doc_ids = [
+            ref_doc_id for ref_doc_id, node_id in zip(self._ref_doc_ids, self._ids) if node_id is not None
+        ]
+        self._ids = [node_id for node_id in self._ids if node_id is not None]
+        self._pending = []
+        self._index_rows()
+
+    def _compact_rows(self, new_vectors: Optional[np.ndarray], mask: Optional[np.ndarray]) -> None:
+        """Apply the pending rows to the arrays of a subclass
+
+        Args:
+            new_vectors: The rows added since the last compaction, None if there are none
+            mask: The rows kept, of the matrix then of new_vectors; None when every row is kept
+        """
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        """Delete the embeddings of the nodes of a document"""
+        for row in self._doc_rows.pop(ref_doc_id, []):
+            self._delete_row(row)
+
+    def delete_nodes(
+        self, node_ids: Optional[List[str]] = None, filters: Any = None, **delete_kwargs: Any
+    ) -> None:
+        """Delete the embeddings of nodes"""
+        if filters is not None:
+            raise ValueError("Metadata filters are not supported by MmapVectorStore")
+        for node_id in node_ids or []:
+            self._delete_row(self._positions.get(node_id))
+
+    def clear(self) -> None:
+        """Delete every embedding"""
+        self._vectors = None
+        self._pending = []
+        self._ids = []
+        self._ref_doc_ids = []
+        self._positions = {}
+        self._doc_rows = {}
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        """Get the top k nodes by cosine similarity"""
+        if query.filters is not None:
+            raise ValueError("Metadata filters are not supported by MmapVectorStore")
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            raise ValueError(f"Query mode {query.mode} is not supported by MmapVectorStore")
+        self._compact()
+        if not self._ids or query.query_embedding is None:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+
+        query_vector = normalize_rows(np.array([query.query_embedding], dtype=np.float32))[0]
+        if query.node_ids is not None:
+            positions = np.array(
+                [self._positions[node_id] for node_id in query.node_ids if node_id in self._positions],
+                dtype=np.int64,
+            )
+            scores = self.vectors[positions] @ query_vector
+        else:
+            positions = None
+            scores = self.vectors @ query_vector
+
+        best = top_k_indices(scores, query.similarity_top_k)
+        rows = best if positions is None else positions[best]
+        return VectorStoreQueryResult(
+            similarities=scores[best].tolist(),
+            ids=[self._ids[row] for row in rows],
+        )
+
+    def persist(self, persist_path: str, fs: Any = None) -> None:
+        """Write the arrays and the id table next to persist_path
+
+        Each persist writes a new generation of .npy files, then replaces
+        the id table, which names them, atomically: the readers switch to
+        the new generation as a whole. The files of the previous generation
+        are removed last, the processes that mapped them keep reading them.
+        Only local directories are supported (fs must be None).
+        """
+        if fs is not None:
+            raise ValueError("MmapVectorStore only persists to local directories")
+        self._compact()
+        base = os.path.splitext(persist_path)[0]
+        ids_path = store_paths(persist_path)[1]
+        os.makedirs(os.path.dirname(ids_path) or ".", exist_ok=True)
+
+        generation = uuid.uuid4().hex[:12]
+        files = {}
+        for name, array in self._arrays().items():
+            files[name] = f"{os.path.basename(base)}.{generation}.{name}.npy"
+            with open(os.path.join(os.path.dirname(ids_path), files[name]), "wb") as file:
+                np.save(file, np.ascontiguousarray(array))
+        temporary_path = f"{ids_path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump({**self._table(), "arrays": files}, file)
+        os.replace(temporary_path, ids_path)
+        _remove_stale_arrays(persist_path, set(files.values()))
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        """The arrays written next to the id table, by name"""
+        return {"vectors": np.asarray(self.vectors, dtype=np.float32)}
+
+    def _table(self) -> dict:
+        """The id table written next to the arrays"""
+        return {"ids": self._ids, "ref_doc_ids": self._ref_doc_ids}
+
+    @classmethod
+    def _legacy_arrays(cls, persist_path: str) -> Dict[str, str]:
+        """Paths of the arrays of a store persisted before the generations"""
+        return {"vectors": store_paths(persist_path)[0]}
+
+    def _restore(self, table: dict, arrays: Dict[str, np.ndarray]) -> None:
+        """Restore what a subclass persisted, called when the store is loaded"""
+
+    @classmethod
+    def from_persist_path(cls, persist_path: str, mmap: bool = True) -> "MmapVectorStore":
+        """Load a store, memory-mapping its matrix
+        Args:
+            persist_path: The persist path of the store (eg. .../default__vector_store.json)
+            mmap: Memory-map the matrix (read-only, shared) instead of reading it
+        """
+        ids_path = store_paths(persist_path)[1]
+        for attempt in range(_LOAD_ATTEMPTS):
+            with open(ids_path, "r", encoding="utf-8") as file:
+                table = json.load(file)
+            files = table.get("arrays") or cls._legacy_arrays(persist_path)
+            try:
+                arrays = {
+                    name: np.load(
+                        os.path.join(os.path.dirname(ids_path), filename),
+                        mmap_mode="r" if mmap else None,
+                    )
+                    for name, filename in files.items()
+                }
+                break
+            except FileNotFoundError:
+                # A persist replaced the id table and removed the files it named
+                if attempt == _LOAD_ATTEMPTS - 1:
+                    raise
+                logger.debug("%s was persisted again while loading it, retrying", persist_path)
+        vectors = arrays["vectors"] if arrays["vectors"].size else None
+        store = cls(vectors=vectors, ids=table["ids"], ref_doc_ids=table["ref_doc_ids"])
+        if vectors is not None and len(vectors) != len(store.ids):
+            raise ValueError(
+                f"{persist_path} has {len(vectors)} vectors for {len(store.ids)} ids"
+            )
+        store._restore(table, arrays)
+        return store
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str, mmap: bool = True) -> "MmapVectorStore":
+        """Load the default store of a persist directory"""
+        return cls.from_persist_path(os.path.join(persist_dir, VECTOR_STORE_FNAME), mmap)
+
+    @classmethod
+    def from_simple_vector_store(cls, vector_store: SimpleVectorStore) -> "MmapVectorStore":
+        """Convert a SimpleVectorStore"""
+        data = vector_store.data
+        ids = list(data.embedding_dict)
+        vectors = (
+            normalize_rows(np.array([data.embedding_dict[node_id] for node_id in ids], dtype=np.float32))
+            if ids
+            else None
+        )
+        return cls(
+            vectors=vectors,
+            ids=ids,
+            ref_doc_ids=[data.text_id_to_ref_doc_id.get(node_id) for node_id in ids],
+        )
+
+
+def mmap_store_exists(persist_dir: str) -> bool:
+    """True if persist_dir has an MmapVectorStore"""
+    return os.path.exists(store_paths(os.path.join(persist_dir, VECTOR_STORE_FNAME))[1])
+
+
+def new_storage_context(
+    persist_dir: Optional[str] = None, backend: str = VECTOR_STORE_BACKEND
+) -> StorageContext:
+    """Storage context of a new index
+
+    Args:
+        persist_dir: The persist directory of the index (required by chroma)
+        backend: "exact" (MmapVectorStore), "ivf", "int8" or "chroma"
+    """
+    if backend == "exact":
+        return StorageContext.from_defaults(vector_store=MmapVectorStore())
+    # pylint: disable=import-outside-toplevel
+    from llamaindex_course.llamaindex.ann_vector_store import create_vector_store
+
+    return StorageContext.from_defaults(vector_store=create_vector_store(backend, persist_dir))
+
+
+def storage_context_from_persist_dir(persist_dir: str) -> StorageContext:
+    """Load the storage context of a persisted index
+
+    The vector store is memory-mapped when the index was persisted with an
+    MmapVectorStore (or an IvfVectorStore or Int8VectorStore), the chroma store is opened when
+    there is one, and the JSON vector store is loaded otherwise.
+    """
+    # pylint: disable=import-outside-toplevel
+    from llamaindex_course.llamaindex.ann_vector_store import load_ann_vector_store
+
+    vector_store = load_ann_vector_store(persist_dir)
+    if vector_store is None and mmap_store_exists(persist_dir):
+        vector_store = MmapVectorStore.from_persist_dir(persist_dir)
+    if vector_store is not None:
+        return StorageContext.from_defaults(persist_dir=persist_dir, vector_store=vector_store)
+    return StorageContext.from_defaults(persist_dir=persist_dir)
+
+
+def load_index(persist_dir: str, **index_kwargs: Any) -> BaseIndex:
+    """Load a persisted index (see storage_context_from_persist_dir)"""
+    return load_index_from_storage(storage_context_from_persist_dir(persist_dir), **index_kwargs)
+
+
+def convert_persist_dir(persist_dir: str) -> int:
+    """Convert the JSON vector store of a persisted index to an MmapVectorStore
+
+    The JSON file is kept, it is ignored once the .npy matrix exists.
+
+    Returns:
+        The number of embeddings converted
+    """
+    vector_store = MmapVectorStore.from_simple_vector_store(
+        SimpleVectorStore.from_persist_dir(persist_dir, namespace="default")
+    )
+    vector_store.persist(os.path.join(persist_dir, VECTOR_STORE_FNAME))
+    return len(vector_store.ids)
+
+
+def main():
+    """
+    Convert a persisted index and compare the load times of both formats
+
+    Usage: python -m llamaindex_course.llamaindex.mmap_vector_store [persist dir]
+    """
+    console = Console()
+    persist_dir = sys.argv[1] if len(sys.argv) > 1 else os.environ.get("PERSIST_DIR")
+    if not persist_dir or not os.path.exists(os.path.join(persist_dir, VECTOR_STORE_FNAME)):
+        console.print("No JSON vector store found, set PERSIST_DIR or pass a persist directory")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    SimpleVectorStore.from_persist_dir(persist_dir, namespace="default")
+    json_seconds = time.perf_counter() - start
+
+    count = convert_persist_dir(persist_dir)
+    start = time.perf_counter()
+    MmapVectorStore.from_persist_dir(persist_dir)
+    mmap_seconds = time.perf_counter() - start
+    console.print(
+        f"{count} embeddings: JSON load {json_seconds * 1000:.1f} ms, "
+        f"memory-mapped load {mmap_seconds * 1000:.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
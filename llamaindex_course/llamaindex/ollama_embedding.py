@@ -0,0 +1,202 @@
+""" Batched and concurrent embeddings with Ollama """
+
+import os
+import time
+import asyncio
+import threading
+
+# import the logging module
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, NamedTuple
+
+import httpx
+from rich.console import Console
+
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+
+logger = logging.getLogger(__name__)
+
+# URL of the Ollama server, can be set with the OLLAMA_BASE_URL environment variable
+OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434")
+
+# Status codes worth retrying: rate limit and server errors (eg. model loading)
+_RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+
+class EmbeddingStats(NamedTuple):
+    """Counters of an OllamaBatchEmbedding"""
+
+    texts: int
+    requests: int
+    retries: int
+    seconds: float
+
+    @property
+    def texts_per_second(self) -> float:
+        """Throughput of the embedding calls"""
+        return self.texts / self.seconds if self.seconds else 0.0
+
+
+class OllamaBatchEmbedding(BaseEmbedding):
+    """Ollama embedding model sending batches of texts concurrently
+
+    OllamaEmbeddings sends one request per text, one after the other. This
+    model sends batches of texts to /api/embed with up to max_concurrency
+    requests in flight over a pool of keep-alive connections, retries the
+    failed requests with an exponential backoff, and returns the embeddings
+    in the order of the texts. Servers without /api/embed (Ollama before
+    0.2) are detected and sent one text per /api/embeddings request.
+
+    Use it as the embed_model of a ServiceContext.
+    """
+
+    base_url: str = Field(default=OLLAMA_BASE_URL, description="URL of the Ollama server")
+    batch_size: int = Field(default=32, gt=0, description="Number of texts per request")
+    max_concurrency: int = Field(default=4, gt=0, description="Maximum number of requests in flight")
+    max_retries: int = Field(default=3, ge=0, description="Number of retries of a failed request")
+    retry_delay: float = Field(default=0.5, ge=0, description="Delay before the first retry, in seconds")
+    request_timeout: float = Field(default=120.0, description="Timeout of a request, in seconds")
+
+    _client: httpx.Client = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _batch_endpoint: bool = PrivateAttr(default=True)
+    _texts: int = PrivateAttr(default=0)
+    _requests: int = PrivateAttr(default=0)
+    _retries: int = PrivateAttr(default=0)
+    _seconds: float = PrivateAttr(default=0.0)
+
+    def __init__(self, model_name: str = "nomic-embed-text", **kwargs: Any):
+        # get_text_embedding_batch hands embed_batch_size texts at a time to
+        # _get_text_embeddings: make it large so that the requests run concurrently
+        kwargs.setdefault("embed_batch_size", 512)
+        super().__init__(model_name=model_name, **kwargs)
+        self._client = httpx.Client(
+            base_url=self.base_url,
+            timeout=self.request_timeout,
+            limits=httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=self.max_concurrency,
+            ),
+        )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "OllamaBatchEmbedding"
+
+    @property
+    def stats(self) -> EmbeddingStats:
+        """Number of texts, requests and retries, and time spent embedding"""
+        return EmbeddingStats(self._texts, self._requests, self._retries, self._seconds)
+
+    def close(self) -> None:
+        """Close the connection pool"""
+        self._client.close()
+
+    def _post(self, path: str, payload: dict) -> dict:
+        """POST a request, retrying the connection errors and the retryable status codes"""
+        for attempt in range(self.max_retries + 1):
+            with self._lock:
+                self._requests += 1
+            try:
+                response = self._client.post(path, json=payload)
+                if response.status_code not in _RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                    return response.json()
+                error: Exception = httpx.HTTPStatusError(
+                    f"{response.status_code} from {path}",
+                    request=response.request,
+                    response=response,
+                )
+            except httpx.TransportError as exception:
+                error = exception
+            if attempt == self.max_retries:
+                raise error
+            with self._lock:
+                self._retries += 1
+            delay = self.retry_delay * 2**attempt
+            logger.warning("Embedding request failed (%s), retrying in %.1fs", error, delay)
+            time.sleep(delay)
+        raise AssertionError("unreachable")
+
+    def _embed_batch(self, texts: List[str]) -> List[Embedding]:
+        """Embed a batch of texts in one request, or one request per text on old servers"""
+        if self._batch_endpoint:
+            try:
+                return self._post("/api/embed", {"model": self.model_name, "input": texts})[
+                    "embeddings"
+                ]
+            except httpx.HTTPStatusError as error:
+                if error.response.status_code != 404:
+                    raise
+                logger.info("No /api/embed on %s, using /api/embeddings", self.base_url)
+                self._batch_endpoint = False
+        return [
+            self._post("/api/embeddings", {"model": self.model_name, "prompt": text})[
+                "embedding"
+            ]
+            for text in texts
+        ]
+
+    def _embed(self, texts: List[str]) -> List[Embedding]:
+        start = time.perf_counter()
+        batches = [
+            texts[index : index + self.batch_size]
+            for index in range(0, len(texts), self.batch_size)
+        ]
+        if len(batches) == 1:
+            results = [self._embed_batch(batches[0])]
+        else:
+            # map keeps the order of the batches whatever the order they complete in
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                results = list(executor.map(self._embed_batch, batches))
+        embeddings = [embedding for result in results for embedding in result]
+        if len(embeddings) != len(texts):
+            raise ValueError(f"Got {len(embeddings)} embeddings for {len(texts)} texts")
+
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self._texts += len(texts)
+            self._seconds += seconds
+        logger.info(
+            "Embedded %s texts in %.2fs (%.1f texts/s)",
+            len(texts),
+            seconds,
+            len(texts) / seconds if seconds else 0.0,
+        )
+        return embeddings
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._embed([query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        # In a worker thread: the concurrent queries of a batch do not block the event loop
+        return await asyncio.to_thread(self._get_query_embedding, query)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._embed([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return self._embed(texts)
+
+
+def main():
+    """
+    Embed a few texts with a local Ollama server and print the throughput
+    """
+    console = Console()
+    embed_model = OllamaBatchEmbedding()
+    texts = [f"Observation {index}: Body Height = {150 + index} cm" for index in range(256)]
+    embeddings = embed_model.get_text_embedding_batch(texts)
+    stats = embed_model.stats
+    console.print(
+        f"{len(embeddings)} embeddings of size {len(embeddings[0])}: "
+        f"{stats.texts_per_second:.1f} texts/s, {stats.requests} requests, "
+        f"{stats.retries} retries"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+""" Load a directory with the PDF pages extracted in parallel and cached per file hash """
+
+import os
+import sys
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# import the logging module
+import logging
+
+from rich.console import Console
+
+from llama_index.core import Document, SimpleDirectoryReader
+from llama_index.core.readers.base import BaseReader
+
+logger = logging.getLogger(__name__)
+
+# Path of the cache, can be set with the PDF_CACHE_PATH environment variable
+PDF_CACHE_PATH = os.environ.get("PDF_CACHE_PATH", "pdf_pages.db")
+
+# Number of pages extracted per task of the process pool
+PAGES_PER_TASK = 16
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    file_hash BLOB PRIMARY KEY,
+    pages INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS pages (
+    file_hash BLOB NOT NULL,
+    page INTEGER NOT NULL,
+    label TEXT NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (file_hash, page)
+) WITHOUT ROWID;
+"""
+
+# A page: its label (as printed on the page) and its text
+Page = Tuple[str, str]
+
+
+@lru_cache(maxsize=65536)
+def _content_hash(path: str, size: int, mtime_ns: int) -> bytes:
+    # size and mtime_ns are part of the key: a modified file is hashed again
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.digest()
+
+
+def file_hash(path: str) -> bytes:
+    """sha256 of the content of a file, computed once per version of the file"""
+    stat = os.stat(path)
+    return _content_hash(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def page_count(path: str) -> int:
+    """Number of pages of a PDF (only the cross-reference table is parsed)"""
+    # pylint: disable=import-outside-toplevel
+    from pypdf import PdfReader
+
+    return len(PdfReader(path).pages)
+
+
+def _page_count_or_none(path: str) -> Optional[int]:
+    try:
+        return page_count(path)
+    except ImportError:
+        raise
+    except Exception as error:  # pylint: disable=broad-except
+        logger.warning("Cannot read %s: %s", path, error)
+        return None
+
+
+def extract_pages(path: str, start: int = 0, stop: Optional[int] = None) -> List[Page]:
+    """Extract the labels and texts of the pages [start, stop) of a PDF
+
+    The same extraction as the PDFReader of SimpleDirectoryReader. It runs
+    in the worker processes of load_documents.
+
+    You need to install pypdf to use it.
+    """
+    # pylint: disable=import-outside-toplevel
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    stop = len(reader.pages) if stop is None else min(stop, len(reader.pages))
+    labels = reader.page_labels
+    return [(labels[page], reader.pages[page].extract_text()) for page in range(start, stop)]
+
+
+class PageCache:
+    """SQLite cache of the extracted pages of the PDFs, keyed by the file hash
+
+    A file is cached with all its pages or not at all. The hash covers the
+    content only: a renamed or copied PDF is not extracted again.
+    """
+
+    def __init__(self, cache_path: str = PDF_CACHE_PATH):
+        if os.path.dirname(cache_path):
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self._connection.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        """Close the cache"""
+        self._connection.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT count(*) FROM files").fetchone()[0]
+
+    def __contains__(self, key: bytes) -> bool:
+        with self._lock:
+            return (
+                self._connection.execute("SELECT 1 FROM files WHERE file_hash = ?", (key,)).fetchone()
+                is not None
+            )
+
+    def get(self, key: bytes) -> Optional[List[Page]]:
+        """The pages of a file, None when it is not cached"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT pages FROM files WHERE file_hash = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            return [
+                (label, text)
+                for label, text in self._connection.execute(
+                    "SELECT label, text FROM pages WHERE file_hash = ? ORDER BY page", (key,)
+                )
+            ]
+
+    def put(self, key: bytes, pages: Sequence[Page]) -> None:
+        """Cache the pages of a file"""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM pages WHERE file_hash = ?", (key,))
+            self._connection.executemany(
+                "INSERT INTO pages (file_hash, page, label, text) VALUES (?, ?, ?, ?)",
+                [(key, page, label, text) for page, (label, text) in enumerate(pages)],
+            )
+            self._connection.execute(
+                "INSERT OR REPLACE INTO files (file_hash, pages) VALUES (?, ?)", (key, len(pages))
+            )
+
+
+def _page_documents(pages: Sequence[Page], file: Path, extra_info: Optional[Dict]) -> List[Document]:
+    """One document per page, with the metadata of the PDFReader of SimpleDirectoryReader"""
+    documents = []
+    for label, text in pages:
+        metadata = {"page_label": label, "file_name": file.name}
+        metadata.update(extra_info or {})
+        documents.append(Document(text=text, metadata=metadata))
+    return documents
+
+
+class CachedPDFReader(BaseReader):
+    """PDF reader of SimpleDirectoryReader serving the pages from a PageCache
+
+    A PDF that is not cached yet is extracted in the calling process and
+    cached; load_documents extracts them in parallel beforehand.
+    """
+
+    def __init__(self, cache: PageCache):
+        self.cache = cache
+
+    def load_data(self, file: Path, extra_info: Optional[Dict] = None, **kwargs: Any) -> List[Document]:
+        key = file_hash(str(file))
+        pages = self.cache.get(key)
+        if pages is None:
+            pages = extract_pages(str(file))
+            self.cache.put(key, pages)
+        return _page_documents(pages, Path(file), extra_info)
+
+
+def extract_pdfs(
+    paths: Sequence[str], cache: PageCache, max_workers: Optional[int] = None
+) -> Tuple[int, int]:
+    """Extract the pages of the PDFs that are not cached, in a process pool
+
+    Each PDF is split into tasks of PAGES_PER_TASK pages, so the pages of
+    a large report are extracted in parallel too.
+
+    Args:
+        paths: The paths of the PDFs
+        cache: The cache of the pages
+        max_workers: Number of processes, the number of CPUs by default
+    Returns:
+        The number of PDFs served from the cache and the number extracted
+    """
+    keys = {path: file_hash(path) for path in paths}
+    missing = {path: key for path, key in keys.items() if key not in cache}
+    cached = len(paths) - len(missing)
+    if not missing:
+        return cached, 0
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        counts = dict(zip(missing, executor.map(_page_count_or_none, missing)))
+        # The unreadable PDFs are left to SimpleDirectoryReader, which reports and skips them
+        missing = {path: key for path, key in missing.items() if counts[path] is not None}
+        tasks = [
+            (path, first, first + PAGES_PER_TASK)
+            for path in missing
+            for first in range(0, counts[path], PAGES_PER_TASK)
+        ]
+        # map returns the page ranges in the order of the tasks
+        results = executor.map(extract_pages, *zip(*tasks)) if tasks else []
+        pages: Dict[str, List[Page]] = {path: [] for path in missing}
+        for (path, _, _), task_pages in zip(tasks, results):
+            pages[path].extend(task_pages)
+    for path, key in missing.items():
+        cache.put(key, pages[path])
+    logger.info(
+        "Extracted %s pages of %s PDFs in %.1fs (%s PDFs cached)",
+        sum(len(file_pages) for file_pages in pages.values()),
+        len(missing),
+        time.perf_counter() - start,
+        cached,
+    )
+    return cached, len(missing)
+
+
+def load_documents(
+    input_dir: str,
+    cache_path: str = PDF_CACHE_PATH,
+    max_workers: Optional[int] = None,
+    **reader_kwargs: Any,
+) -> List[Document]:
+    """SimpleDirectoryReader(input_dir, **reader_kwargs).load_data() with cached PDF pages
+
+    The pages of the new or changed PDFs are extracted in a process pool,
+    the pages of the unchanged PDFs are read from the cache. The documents
+    (ids with filename_as_id, metadata) are the ones SimpleDirectoryReader
+    returns. The other files are read by SimpleDirectoryReader.
+
+    Args:
+        input_dir: The directory of the documents
+        cache_path: The path of the page cache
+        max_workers: Number of extraction processes, the number of CPUs by default
+        reader_kwargs: Arguments of SimpleDirectoryReader (filename_as_id, recursive, ...)
+    """
+    cache = PageCache(cache_path)
+    try:
+        reader = SimpleDirectoryReader(
+            input_dir, file_extractor={".pdf": CachedPDFReader(cache)}, **reader_kwargs
+        )
+        pdfs = [str(path) for path in reader.input_files if Path(path).suffix.lower() == ".pdf"]
+        extract_pdfs(pdfs, cache, max_workers)
+        return reader.load_data()
+    finally:
+        cache.close()
+
+
+def main():
+    """
+    Load a directory and print the time spent, run it twice to see the cache
+
+    Usage: python -m llamaindex_course.llamaindex.pdf_loader [directory] [workers]
+    """
+    console = Console()
+    input_dir = sys.argv[1] if len(sys.argv) > 1 else "data"
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    start = time.perf_counter()
+    documents = load_documents(input_dir, max_workers=max_workers)
+    console.print(f"{len(documents)} documents in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
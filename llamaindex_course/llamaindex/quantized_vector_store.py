@@ -0,0 +1,258 @@
+""" Vector store searching int8 quantized embeddings, re-ranked with the full vectors """
+
+import os
+import sys
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+# import the logging module
+import logging
+
+import numpy as np
+from rich.console import Console
+
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.vector_stores.types import VectorStoreQuery, VectorStoreQueryResult
+
+from llamaindex_course.llamaindex.mmap_vector_store import MmapVectorStore
+from llamaindex_course.llamaindex.similarity import normalize_rows, top_k_indices
+
+logger = logging.getLogger(__name__)
+
+# Number of candidates re-ranked per result: top_k * DEFAULT_RERANK_FACTOR
+# candidates are scored again with the full vectors, 0 to skip the re-ranking
+DEFAULT_RERANK_FACTOR = 4
+
+# Rows converted to float32 per matrix product (32 MB for 256 dimensions)
+_SCORE_BLOCK_SIZE = 32768
+
+
+def _int8_paths(persist_path: str) -> tuple:
+    """Paths of the codes and of the scales, as persisted before the generations"""
+    base = os.path.splitext(persist_path)[0]
+    return f"{base}.int8.npy", f"{base}.scales.npy"
+
+
+def quantize_int8(vectors: np.ndarray, scales: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric scalar quantization of each dimension to int8
+
+    Args:
+        vectors: The vectors, one row per vector
+        scales: The scales of the dimensions, computed from the vectors when
+        None (the values out of range are clipped)
+    Returns:
+        The codes, vectors ~= codes * scales, and the scales
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if scales is None:
+        scales = np.abs(vectors).max(axis=0) / 127 if len(vectors) else np.ones(vectors.shape[1])
+        scales = np.where(scales > 0, scales, 1).astype(np.float32)
+    codes = np.clip(np.rint(vectors / scales), -127, 127).astype(np.int8)
+    return codes, scales
+
+
+class Int8VectorStore(MmapVectorStore):
+    """MmapVectorStore searching int8 codes of the embeddings
+
+    Each dimension is quantized to int8 with its own scale: the codes take
+    a quarter of the memory of the float32 matrix, so four times as many
+    embeddings fit in RAM (or in the page cache of a memory-mapped file).
+    A query scores every code, keeps top_k * rerank_factor candidates, and
+    scores them again with the full vectors: only the candidate rows of the
+    memory-mapped float32 matrix are read. The rerank factor can be set per
+    retriever, like the n_probe of IvfVectorStore (see MmapVectorStore).
+
+    The codes and scales are persisted next to the matrix and
+    memory-mapped on load.
+    """
+
+    rerank_factor: int = Field(
+        default=DEFAULT_RERANK_FACTOR,
+        ge=0,
+        description="Number of candidates re-ranked with the full vectors per result, 0 to skip",
+    )
+
+    _codes: Optional[np.ndarray] = PrivateAttr(default=None)
+    _scales: Optional[np.ndarray] = PrivateAttr(default=None)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "Int8VectorStore"
+
+    def _quantize_if_needed(self) -> None:
+        self._compact()
+        if self._codes is None or len(self._codes) != len(self._ids):
+            self.quantize()
+
+    @property
+    def codes(self) -> np.ndarray:
+        """The int8 codes of the embeddings, one row per node"""
+        self._quantize_if_needed()
+        return self._codes
+
+    @property
+    def scales(self) -> np.ndarray:
+        """The scale of each dimension"""
+        self._quantize_if_needed()
+        return self._scales
+
+    def quantize(self) -> None:
+        """Compute the scales and quantize every embedding"""
+        self._codes, self._scales = quantize_int8(self.vectors)
+
+    def memory_usage(self) -> Tuple[int, int]:
+        """Size in bytes of the codes searched and of the full vectors"""
+        return self.codes.nbytes, self.vectors.nbytes
+
+    def _compact_rows(self, new_vectors: Optional[np.ndarray], mask: Optional[np.ndarray]) -> None:
+        """Quantize the added vectors with the current scales, drop the deleted ones"""
+        if self._codes is None:
+            return
+        if new_vectors is not None:
+            self._codes = np.concatenate([self._codes, quantize_int8(new_vectors, self._scales)[0]])
+        if mask is not None:
+            self._codes = np.asarray(self._codes)[mask]
+
+    def clear(self) -> None:
+        super().clear()
+        self._codes = self._scales = None
+
+    def _scores(self, query_vector: np.ndarray) -> np.ndarray:
+        """Approximate cosine similarity of the query with every embedding"""
+        codes = self.codes
+        # codes @ (query * scales) == (codes * scales) @ query
+        scaled_query = query_vector * self.scales
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), _SCORE_BLOCK_SIZE):
+            block = codes[start : start + _SCORE_BLOCK_SIZE].astype(np.float32)
+            scores[start : start + len(block)] = block @ scaled_query
+        return scores
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        """Get the top k nodes by cosine similarity of the codes, re-ranked
+
+        Args:
+            query: The query, exact search when it is restricted to node ids
+            rerank_factor: Candidates re-ranked per result, defaults to the rerank_factor of the store
+        """
+        self._compact()
+        if not self._ids or query.node_ids is not None or query.query_embedding is None:
+            return super().query(query, **kwargs)
+        if query.filters is not None:
+            raise ValueError("Metadata filters are not supported by Int8VectorStore")
+
+        query_vector = normalize_rows(np.array([query.query_embedding], dtype=np.float32))[0]
+        scores = self._scores(query_vector)
+        rerank_factor = kwargs.get("rerank_factor", self.rerank_factor)
+        if rerank_factor:
+            # Sorted rows read the memory-mapped matrix in file order
+            rows = np.sort(top_k_indices(scores, query.similarity_top_k * rerank_factor))
+            scores = self.vectors[rows] @ query_vector
+        else:
+            rows = np.arange(len(scores))
+        best = top_k_indices(scores, query.similarity_top_k)
+        return VectorStoreQueryResult(
+            similarities=scores[best].tolist(),
+            ids=[self._ids[row] for row in rows[best]],
+        )
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        """The matrix, the codes and the scales"""
+        return {**super()._arrays(), "codes": self.codes, "scales": self.scales}
+
+    def _table(self) -> dict:
+        return {**super()._table(), "int8": {"rerank_factor": self.rerank_factor}}
+
+    @classmethod
+    def _legacy_arrays(cls, persist_path: str) -> Dict[str, str]:
+        arrays = super()._legacy_arrays(persist_path)
+        codes_path, scales_path = _int8_paths(persist_path)
+        if os.path.exists(codes_path):
+            arrays.update(codes=codes_path, scales=scales_path)
+        return arrays
+
+    def _restore(self, table: dict, arrays: Dict[str, np.ndarray]) -> None:
+        self.rerank_factor = table.get("int8", {}).get("rerank_factor", DEFAULT_RERANK_FACTOR)
+        if "codes" in arrays:
+            self._codes = arrays["codes"]
+            self._scales = np.asarray(arrays["scales"])
+
+
+class BenchmarkRow(NamedTuple):
+    """Recall, latency and memory of a search"""
+
+    search: str
+    recall: float
+    latency_ms: float
+    megabytes: float
+
+
+def benchmark(
+    size: int = 100000,
+    dimension: int = 256,
+    n_queries: int = 100,
+    top_k: int = 10,
+    rerank_factors: Sequence[int] = (0, 2, 4, 8),
+) -> List[BenchmarkRow]:
+    """Compare the recall@k, the latency and the memory of the int8 search with the exact search
+
+    Args:
+        size: The number of vectors
+        dimension: The dimension of the vectors
+        n_queries: The number of queries
+        top_k: The k of recall@k
+        rerank_factors: The rerank factors measured
+    Returns:
+        One row per search, the latency is per query and the memory is
+        the size of the matrix scored by every query
+    """
+    # pylint: disable=import-outside-toplevel
+    from llamaindex_course.llamaindex.ann_vector_store import _clustered_vectors
+
+    vectors = _clustered_vectors(size + n_queries, dimension)
+    vectors, queries = vectors[:size], vectors[size:]
+    ids = [str(index) for index in range(size)]
+    exact = MmapVectorStore(vectors=vectors, ids=ids)
+    quantized = Int8VectorStore(vectors=vectors, ids=ids)
+    quantized.quantize()
+    codes_bytes, vectors_bytes = quantized.memory_usage()
+
+    def run(store: MmapVectorStore, **kwargs: Any) -> tuple:
+        start = time.perf_counter()
+        found = [
+            store.query(
+                VectorStoreQuery(query_embedding=query.tolist(), similarity_top_k=top_k), **kwargs
+            ).ids
+            for query in queries
+        ]
+        return found, (time.perf_counter() - start) * 1000 / n_queries
+
+    truth, latency = run(exact)
+    rows = [BenchmarkRow("float32", 1.0, latency, vectors_bytes / 1024**2)]
+    for rerank_factor in rerank_factors:
+        found, latency = run(quantized, rerank_factor=rerank_factor)
+        recall = np.mean([len(set(ids) & set(true_ids)) / top_k for ids, true_ids in zip(found, truth)])
+        rows.append(
+            BenchmarkRow(f"int8 rerank x{rerank_factor}", float(recall), latency, codes_bytes / 1024**2)
+        )
+    return rows
+
+
+def main():
+    """
+    Benchmark the int8 search against the exact search
+
+    Usage: python -m llamaindex_course.llamaindex.quantized_vector_store [size] [dimension]
+    """
+    console = Console()
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    dimension = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    for row in benchmark(size, dimension):
+        console.print(
+            f"{row.search:<16} recall@10 {row.recall:.3f} {row.latency_ms:8.2f} ms "
+            f"{row.megabytes:8.1f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,400 @@
+""" Sharded indexes: build the shards in worker processes and merge their results at query time """
+
+import os
+import sys
+import json
+import time
+import pickle
+import asyncio
+import hashlib
+import dataclasses
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# import the logging module
+import logging
+
+from rich.console import Console
+
+from llama_index.core import Document
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.indices.base import BaseIndex
+from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.schema import BaseNode, NodeWithScore, QueryBundle
+from llama_index.core.settings import Settings, llm_from_settings_or_context
+
+from llamaindex_course.llamaindex.bm25_index import HYBRID_ALPHA, BM25Index, HybridRetriever, load_bm25_index
+from llamaindex_course.llamaindex.embedding_cache import CachedEmbedding
+from llamaindex_course.llamaindex.incremental_index import RefreshStats, index_exists, refresh_index
+from llamaindex_course.llamaindex.mmap_vector_store import load_index
+
+logger = logging.getLogger(__name__)
+
+# Number of shards of the indexing scripts, can be set with the INDEX_SHARDS
+# environment variable; 1 builds a single index
+INDEX_SHARDS = int(os.environ.get("INDEX_SHARDS", "1"))
+
+# File recording the number of shards in the persist directory
+SHARDS_FNAME = "shards.json"
+
+
+def shard_of(doc_id: str, shards: int) -> int:
+    """Shard of a document, from the hash of its id
+
+    The hash is stable between runs (unlike hash()), so a refresh sends a
+    document to the shard that already has it.
+    """
+    digest = hashlib.blake2b(doc_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shards
+
+
+def partition(documents: Sequence[Document], shards: int) -> List[List[Document]]:
+    """Split the documents into shards (see shard_of)"""
+    partitions: List[List[Document]] = [[] for _ in range(shards)]
+    for document in documents:
+        partitions[shard_of(document.doc_id, shards)].append(document)
+    return partitions
+
+
+def shard_dir(persist_dir: str, shard: int) -> str:
+    """Persist directory of a shard"""
+    return os.path.join(persist_dir, f"shard_{shard:03d}")
+
+
+def shard_count(persist_dir: str) -> Optional[int]:
+    """Number of shards of a persisted sharded index, None when there is none"""
+    path = os.path.join(persist_dir, SHARDS_FNAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)["shards"]
+
+
+def sharded_index_exists(persist_dir: str) -> bool:
+    """True if a sharded index was persisted in persist_dir"""
+    return shard_count(persist_dir) is not None
+
+
+def _write_shard_count(persist_dir: str, shards: int) -> None:
+    path = os.path.join(persist_dir, SHARDS_FNAME)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as file:
+        json.dump({"shards": shards}, file)
+    os.replace(temporary_path, path)
+
+
+def _refresh_shard(
+    documents: Sequence[Document], persist_dir: str, index_kwargs: Dict[str, Any]
+) -> RefreshStats:
+    """Refresh a shard, in a worker process of refresh_sharded_index"""
+    _, stats = refresh_index(documents, persist_dir, **index_kwargs)
+    return stats
+
+
+def _picklable(index_kwargs: Dict[str, Any]) -> bool:
+    """True if the index arguments can be sent to a worker process"""
+    try:
+        pickle.dumps(index_kwargs)
+    except Exception:  # pylint: disable=broad-except
+        return False
+    return True
+
+
+def refresh_sharded_index(
+    documents: Sequence[Document],
+    persist_dir: str,
+    shards: int = INDEX_SHARDS,
+    max_workers: Optional[int] = None,
+    **index_kwargs: Any,
+) -> RefreshStats:
+    """Create or incrementally update a sharded index from documents
+
+    The documents are partitioned by the hash of their id, and each shard
+    is an index of its own (see refresh_index) in a subdirectory of
+    persist_dir. The shards are split, embedded and persisted in parallel
+    worker processes, which receive a pickled copy of index_kwargs: when it
+    cannot be pickled, the shards are refreshed one after the other. The
+    documents need stable ids, and the number of shards cannot change: use
+    another persist_dir to reshard.
+
+    Args:
+        documents: The documents of the corpus
+        persist_dir: The directory of the sharded index
+        shards: The number of shards
+        max_workers: Number of processes, the number of CPUs by default
+        index_kwargs: Arguments of the index of each shard (service_context, transformations, ...)
+    Returns:
+        What was done, summed over the shards (load the shards with load_indexes)
+    """
+    if shards < 1:
+        raise ValueError(f"The number of shards must be at least 1, got {shards}")
+    if "storage_context" in index_kwargs:
+        raise ValueError("Each shard has its own storage context, do not pass one")
+    if index_exists(persist_dir):
+        raise ValueError(f"{persist_dir} has a single index: use another persist_dir to shard")
+    existing = shard_count(persist_dir)
+    if existing is not None and existing != shards:
+        raise ValueError(
+            f"{persist_dir} has {existing} shards, not {shards}: use another persist_dir to reshard"
+        )
+
+    os.makedirs(persist_dir, exist_ok=True)
+    start = time.perf_counter()
+    tasks = [
+        (shard_documents, shard_dir(persist_dir, shard))
+        for shard, shard_documents in enumerate(partition(documents, shards))
+    ]
+    max_workers = min(shards, max_workers or os.cpu_count() or 1)
+    if max_workers > 1 and not _picklable(index_kwargs):
+        logger.warning("The index arguments cannot be pickled, refreshing the shards in this process")
+        max_workers = 1
+    if max_workers > 1:
+        # The scripts calling it have a __main__ guard: the workers can be
+        # spawned (the default start method on Windows and macOS)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_refresh_shard, *zip(*tasks), [index_kwargs] * shards))
+    else:
+        results = [_refresh_shard(*task, index_kwargs) for task in tasks]
+    _write_shard_count(persist_dir, shards)
+
+    stats = RefreshStats(*(sum(values) for values in zip(*results)))
+    logger.info(
+        "Refreshed %s shards in %s with %s processes in %.1fs: %s",
+        shards,
+        persist_dir,
+        max_workers,
+        time.perf_counter() - start,
+        stats,
+    )
+    return stats
+
+
+def refresh_index_or_shards(
+    documents: Sequence[Document],
+    persist_dir: str,
+    shards: int = INDEX_SHARDS,
+    max_workers: Optional[int] = None,
+    **index_kwargs: Any,
+) -> RefreshStats:
+    """Refresh a single index (see refresh_index), or a sharded one when shards > 1
+
+    The layout of an existing index cannot change: a single index is not
+    sharded, and a sharded index is not refreshed as a single index next to
+    its shards (the query scripts would keep reading the shards).
+
+    Args:
+        documents: The documents of the corpus
+        persist_dir: The directory of the index
+        shards: The number of shards, INDEX_SHARDS by default
+        max_workers: Number of processes building the shards, the number of CPUs by default
+        index_kwargs: Arguments of the index (service_context, transformations, ...)
+    Returns:
+        What was done
+    """
+    if shards > 1:
+        return refresh_sharded_index(documents, persist_dir, shards, max_workers, **index_kwargs)
+    existing = shard_count(persist_dir)
+    if existing is not None:
+        raise ValueError(
+            f"{persist_dir} has {existing} shards: set INDEX_SHARDS={existing} or use another persist_dir"
+        )
+    _, stats = refresh_index(documents, persist_dir, **index_kwargs)
+    return stats
+
+
+def load_shards(persist_dir: str, **index_kwargs: Any) -> List[BaseIndex]:
+    """Load the indexes of the shards of a sharded index (see load_index)"""
+    shards = shard_count(persist_dir)
+    if shards is None:
+        raise FileNotFoundError(f"No sharded index in {persist_dir}")
+    return [load_index(shard_dir(persist_dir, shard), **index_kwargs) for shard in range(shards)]
+
+
+def load_indexes(persist_dir: str, **index_kwargs: Any) -> List[Tuple[str, BaseIndex]]:
+    """The (persist directory, index) of the index of persist_dir, or of each of its shards
+
+    It loads any index of refresh_index_or_shards: load_index raises
+    FileNotFoundError on a sharded index.
+    """
+    if sharded_index_exists(persist_dir):
+        return [
+            (shard_dir(persist_dir, shard), index)
+            for shard, index in enumerate(load_shards(persist_dir, **index_kwargs))
+        ]
+    return [(persist_dir, load_index(persist_dir, **index_kwargs))]
+
+
+def merge_top_k(results: Sequence[List[NodeWithScore]], top_k: int) -> List[NodeWithScore]:
+    """The top k nodes of the results of the shards, best first"""
+    nodes = [node for result in results for node in result]
+    return sorted(nodes, key=lambda node: (-(node.score or 0.0), node.node.node_id))[:top_k]
+
+
+class ShardedRetriever(BaseRetriever):
+    """Retriever querying every shard and merging their top k nodes
+
+    The query is embedded once and each shard returns its similarity_top_k
+    nodes: the global top k is among them. The shards are searched in
+    parallel threads (numpy releases the GIL). The scores are the cosine
+    similarities of the same embedding model, so they compare across the
+    shards as they are.
+    """
+
+    def __init__(
+        self,
+        indexes: Sequence[BaseIndex],
+        similarity_top_k: int = 2,
+        embed_model: Optional[BaseEmbedding] = None,
+        **retriever_kwargs: Any,
+    ):
+        """Create the retriever
+        Args:
+            indexes: The indexes of the shards
+            similarity_top_k: Number of nodes retrieved
+            embed_model: The model embedding the query, the one of the first shard by default
+            retriever_kwargs: Arguments of the retriever of each shard
+        """
+        if not indexes:
+            raise ValueError("No shard to query")
+        self.similarity_top_k = similarity_top_k
+        self.retrievers = [
+            index.as_retriever(similarity_top_k=similarity_top_k, **retriever_kwargs) for index in indexes
+        ]
+        self.embed_model = embed_model or getattr(indexes[0], "_embed_model", None) or Settings.embed_model
+        super().__init__(callback_manager=self.retrievers[0].callback_manager)
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        if query_bundle.embedding is None:
+            # The retrievers would each embed the query, and set the embedding of the shared bundle
+            query_bundle = dataclasses.replace(
+                query_bundle,
+                embedding=self.embed_model.get_agg_embedding_from_queries(query_bundle.embedding_strs),
+            )
+        # The threads end with the query: a retriever holds no pool to shut down
+        with ThreadPoolExecutor(max_workers=len(self.retrievers)) as executor:
+            results = list(executor.map(lambda retriever: retriever.retrieve(query_bundle), self.retrievers))
+        return merge_top_k(results, self.similarity_top_k)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        if query_bundle.embedding is None:
+            query_bundle = dataclasses.replace(
+                query_bundle,
+                embedding=await self.embed_model.aget_agg_embedding_from_queries(query_bundle.embedding_strs),
+            )
+        results = await asyncio.gather(*(retriever.aretrieve(query_bundle) for retriever in self.retrievers))
+        return merge_top_k(results, self.similarity_top_k)
+
+
+class ShardedHybridRetriever(HybridRetriever):
+    """HybridRetriever of the shards of an index
+
+    The vector candidates come from a ShardedRetriever, the BM25 candidates
+    from the BM25 index of each shard (in its persist directory), merged
+    by score: the documents are partitioned by the hash of their id, so the
+    term statistics of the shards are close. The scores are then fused
+    once, over the candidates of every shard.
+    """
+
+    def __init__(
+        self,
+        indexes: Sequence[Tuple[str, BaseIndex]],
+        similarity_top_k: int = 2,
+        alpha: float = HYBRID_ALPHA,
+        **retriever_kwargs: Any,
+    ):
+        """Create the retriever
+        Args:
+            indexes: The (persist directory, index) of the shards (see load_indexes)
+            similarity_top_k: Number of nodes retrieved
+            alpha: Weight of the vector score, 1 for vector search only, 0 for BM25 only
+            retriever_kwargs: Arguments of the retriever of each shard
+        """
+        if not indexes:
+            raise ValueError("No shard to query")
+        self.shards = list(indexes)
+        self._bm25_indexes: Optional[List[BM25Index]] = None
+        super().__init__(self.shards[0][1], None, similarity_top_k, alpha, **retriever_kwargs)
+
+    def _vector_retriever(self, similarity_top_k: int, **retriever_kwargs: Any) -> BaseRetriever:
+        return ShardedRetriever([index for _, index in self.shards], similarity_top_k, **retriever_kwargs)
+
+    def _bm25_top_k(self, query: str, top_k: int) -> List[Tuple[str, float]]:
+        if self._bm25_indexes is None:
+            self._bm25_indexes = [load_bm25_index(index, directory) for directory, index in self.shards]
+        hits = [hit for bm25_index in self._bm25_indexes for hit in bm25_index.top_k(query, top_k)]
+        return sorted(hits, key=lambda hit: (-hit[1], hit[0]))[:top_k]
+
+    def _get_nodes(self, node_ids: Sequence[str]) -> List[BaseNode]:
+        nodes = {
+            node.node_id: node
+            for _, index in self.shards
+            for node in index.docstore.get_nodes(list(node_ids), raise_error=False)
+            if node is not None
+        }
+        return [nodes[node_id] for node_id in node_ids]
+
+
+def persisted_query_engine(
+    indexes: Sequence[Tuple[str, BaseIndex]],
+    similarity_top_k: int = 2,
+    hybrid: bool = False,
+    alpha: float = HYBRID_ALPHA,
+    **kwargs: Any,
+) -> RetrieverQueryEngine:
+    """Query engine of a persisted index, sharded or not
+
+    Args:
+        indexes: The (persist directory, index) of the index or of its shards (see load_indexes)
+        similarity_top_k: Number of nodes sent to the LLM
+        hybrid: Fuse the BM25 and the vector scores (see HybridRetriever)
+        alpha: Weight of the vector score in the fused score
+        kwargs: Arguments of RetrieverQueryEngine.from_args (streaming, node_postprocessors, ...)
+    """
+    if not indexes:
+        raise ValueError("No index to query")
+    persist_dir, index = indexes[0]
+    if hybrid and len(indexes) > 1:
+        retriever: BaseRetriever = ShardedHybridRetriever(indexes, similarity_top_k, alpha)
+    elif hybrid:
+        retriever = HybridRetriever(index, persist_dir, similarity_top_k, alpha)
+    elif len(indexes) > 1:
+        retriever = ShardedRetriever([shard for _, shard in indexes], similarity_top_k)
+    else:
+        retriever = index.as_retriever(similarity_top_k=similarity_top_k)
+    if "llm" not in kwargs:
+        # resolving the default LLM needs its package (and key) even when one is passed
+        kwargs["llm"] = llm_from_settings_or_context(Settings, index.service_context)
+    return RetrieverQueryEngine.from_args(retriever, **kwargs)
+
+
+def main():
+    """
+    Build a sharded index of a directory and run a query on it
+
+    Usage: python -m llamaindex_course.llamaindex.sharded_index persist_dir [shards] [data dir] [question]
+    """
+    # pylint: disable=import-outside-toplevel
+    from llamaindex_course.llamaindex.pdf_loader import load_documents
+
+    console = Console()
+    if len(sys.argv) < 2:
+        console.print(main.__doc__)
+        sys.exit(1)
+    persist_dir = sys.argv[1]
+    shards = int(sys.argv[2]) if len(sys.argv) > 2 else INDEX_SHARDS
+    input_dir = sys.argv[3] if len(sys.argv) > 3 else "data"
+    question = sys.argv[4] if len(sys.argv) > 4 else "Explain the result of Air Liquide in 2023 ?"
+
+    embed_model = CachedEmbedding("default")
+    start = time.perf_counter()
+    stats = refresh_sharded_index(
+        load_documents(input_dir, filename_as_id=True), persist_dir, shards, embed_model=embed_model
+    )
+    console.print(f"{stats} in {time.perf_counter() - start:.1f}s")
+    query_engine = persisted_query_engine(load_indexes(persist_dir, embed_model=embed_model))
+    console.print(query_engine.query(question))
+
+
+if __name__ == "__main__":
+    main()
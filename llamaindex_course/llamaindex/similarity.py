@@ -0,0 +1,229 @@
+""" Vectorized cosine similarity and top-k search over a matrix of embeddings """
+
+import sys
+import time
+from typing import Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from rich.console import Console
+
+# Number of queries scored per matrix product: bounds the score matrix to
+# QUERY_BLOCK_SIZE x ROW_BLOCK_SIZE floats (128 MB with the defaults)
+QUERY_BLOCK_SIZE = 256
+
+# Number of embeddings scored per matrix product
+ROW_BLOCK_SIZE = 131072
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Scale the rows to unit length, so that a dot product is a cosine similarity"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Indices of the top_k highest scores, best first"""
+    top_k = min(top_k, len(scores))
+    if top_k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    best = np.argpartition(-scores, top_k - 1)[:top_k]
+    return best[np.argsort(-scores[best])]
+
+
+def cosine_similarity(a: Sequence[Sequence[float]], b: Sequence[Sequence[float]]) -> np.ndarray:
+    """Cosine similarity of every row of a with every row of b
+
+    Same result as sklearn.metrics.pairwise.cosine_similarity(a, b).
+    """
+    return normalize_rows(np.asarray(a)) @ normalize_rows(np.asarray(b)).T
+
+
+class SimilarityIndex:
+    """Exact top-k cosine similarity search over a matrix of embeddings
+
+    The embeddings are normalized once and kept in one contiguous matrix,
+    so a batch of queries is answered with matrix products and
+    argpartition instead of one similarity call per pair. The queries and
+    the embeddings are processed in blocks to bound the memory used by
+    the scores.
+
+    With dtype=np.float16 the matrix takes half the memory; each block is
+    converted to float32 for the product (numpy has no fast float16
+    matrix product), the scores differ by about 1e-3.
+    """
+
+    def __init__(
+        self,
+        vectors: Sequence[Sequence[float]],
+        ids: Optional[List[str]] = None,
+        dtype: type = np.float32,
+    ):
+        """Create the index
+        Args:
+            vectors: The embeddings, one row per embedding
+            ids: The ids of the embeddings, defaults to their positions
+            dtype: np.float32 or np.float16
+        """
+        if dtype not in (np.float32, np.float16):
+            raise ValueError(f"Unsupported dtype {dtype}, use np.float32 or np.float16")
+        self.matrix = np.ascontiguousarray(normalize_rows(np.asarray(vectors)), dtype=dtype)
+        self.ids = ids if ids is not None else [str(index) for index in range(len(self.matrix))]
+        if len(self.ids) != len(self.matrix):
+            raise ValueError(f"Got {len(self.ids)} ids for {len(self.matrix)} vectors")
+
+    def __len__(self) -> int:
+        return len(self.matrix)
+
+    def _row_blocks(self, row_block_size: int):
+        for start in range(0, len(self.matrix), row_block_size):
+            yield start, self.matrix[start : start + row_block_size].astype(np.float32, copy=False)
+
+    def scores(self, queries: Sequence[Sequence[float]]) -> np.ndarray:
+        """Cosine similarity of each query with every embedding, shape (queries, embeddings)"""
+        queries = normalize_rows(np.atleast_2d(np.asarray(queries)))
+        return np.concatenate(
+            [queries @ block.T for _, block in self._row_blocks(ROW_BLOCK_SIZE)], axis=1
+        )
+
+    def top_k(
+        self,
+        queries: Sequence[Sequence[float]],
+        top_k: int = 10,
+        query_block_size: int = QUERY_BLOCK_SIZE,
+        row_block_size: int = ROW_BLOCK_SIZE,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Top k embeddings of a batch of queries
+
+        Args:
+            queries: The query embeddings, one row per query
+            top_k: Number of embeddings per query
+            query_block_size: Number of queries per matrix product
+            row_block_size: Number of embeddings per matrix product
+        Returns:
+            The positions of the embeddings and their similarities, best
+            first, both of shape (queries, min(top_k, embeddings))
+        """
+        queries = normalize_rows(np.atleast_2d(np.asarray(queries)))
+        top_k = min(top_k, len(self.matrix))
+        positions = np.zeros((len(queries), top_k), dtype=np.int64)
+        similarities = np.zeros((len(queries), top_k), dtype=np.float32)
+        if top_k == 0:
+            return positions, similarities
+
+        for query_start in range(0, len(queries), query_block_size):
+            query_block = queries[query_start : query_start + query_block_size]
+            rows = np.arange(len(query_block))[:, None]
+            # The best candidates so far, merged with the candidates of each block
+            best_positions = np.zeros((len(query_block), 0), dtype=np.int64)
+            best_scores = np.zeros((len(query_block), 0), dtype=np.float32)
+            for row_start, block in self._row_blocks(row_block_size):
+                scores = query_block @ block.T
+                if scores.shape[1] > top_k:
+                    candidates = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+                else:
+                    candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+                best_positions = np.concatenate([best_positions, candidates + row_start], axis=1)
+                best_scores = np.concatenate([best_scores, scores[rows, candidates]], axis=1)
+                if best_scores.shape[1] > top_k:
+                    keep = np.argpartition(-best_scores, top_k - 1, axis=1)[:, :top_k]
+                    best_positions = best_positions[rows, keep]
+                    best_scores = best_scores[rows, keep]
+            order = np.argsort(-best_scores, axis=1)
+            positions[query_start : query_start + len(query_block)] = best_positions[rows, order]
+            similarities[query_start : query_start + len(query_block)] = best_scores[rows, order]
+        return positions, similarities
+
+    def search(self, queries: Sequence[Sequence[float]], top_k: int = 10) -> List[List[Tuple[str, float]]]:
+        """Top k (id, similarity) of each query"""
+        positions, similarities = self.top_k(queries, top_k)
+        return [
+            [(self.ids[position], float(similarity)) for position, similarity in zip(*row)]
+            for row in zip(positions, similarities)
+        ]
+
+
+class BenchmarkRow(NamedTuple):
+    """Time to answer a batch of queries"""
+
+    method: str
+    seconds: float
+    queries_per_second: float
+
+
+def _pairwise_function() -> Tuple[str, Callable]:
+    """sklearn cosine_similarity when installed, the same formula in numpy otherwise"""
+    try:
+        # pylint: disable=import-outside-toplevel
+        from sklearn.metrics.pairwise import cosine_similarity as sklearn_cosine_similarity
+
+        return "sklearn", sklearn_cosine_similarity
+    except ImportError:
+        return "numpy", cosine_similarity
+
+
+def benchmark(
+    n_vectors: int = 10000,
+    n_queries: int = 1000,
+    dimension: int = 768,
+    top_k: int = 10,
+    n_pair_queries: int = 5,
+) -> List[BenchmarkRow]:
+    """Compare the per-pair similarity calls, one call per query and SimilarityIndex
+
+    Args:
+        n_vectors: The number of embeddings
+        n_queries: The number of queries
+        dimension: The dimension of the embeddings
+        top_k: The number of results per query
+        n_pair_queries: The number of queries timed with one call per pair
+        (the rate is extrapolated, it is very slow)
+    Returns:
+        One row per method
+    """
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((n_vectors, dimension)).astype(np.float32)
+    queries = rng.standard_normal((n_queries, dimension)).astype(np.float32)
+    name, pairwise = _pairwise_function()
+    rows = []
+
+    start = time.perf_counter()
+    for query in queries[:n_pair_queries]:
+        scores = np.array([pairwise([query], [vector])[0][0] for vector in vectors])
+        top_k_indices(scores, top_k)
+    seconds = (time.perf_counter() - start) * n_queries / n_pair_queries
+    rows.append(BenchmarkRow(f"{name} per pair", seconds, n_queries / seconds))
+
+    start = time.perf_counter()
+    for query in queries:
+        top_k_indices(pairwise([query], vectors)[0], top_k)
+    seconds = time.perf_counter() - start
+    rows.append(BenchmarkRow(f"{name} per query", seconds, n_queries / seconds))
+
+    for dtype in (np.float32, np.float16):
+        start = time.perf_counter()
+        SimilarityIndex(vectors, dtype=dtype).top_k(queries, top_k)
+        seconds = time.perf_counter() - start
+        rows.append(
+            BenchmarkRow(f"SimilarityIndex {np.dtype(dtype).name}", seconds, n_queries / seconds)
+        )
+    return rows
+
+
+def main():
+    """
+    Benchmark the top k search
+
+    Usage: python -m llamaindex_course.llamaindex.similarity [vectors] [queries] [dimension]
+    """
+    console = Console()
+    arguments = [int(argument) for argument in sys.argv[1:4]]
+    for row in benchmark(*arguments):
+        console.print(
+            f"{row.method:<26} {row.seconds:9.3f} s {row.queries_per_second:12.1f} queries/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
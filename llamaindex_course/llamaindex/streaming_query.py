@@ -0,0 +1,111 @@
+""" Stream the answer of a llama_index query engine token by token """
+
+import sys
+import time
+from typing import Iterator, List, NamedTuple, Optional, TextIO
+
+# import the logging module
+import logging
+
+from llama_index.core.base.base_query_engine import BaseQueryEngine
+from llama_index.core.base.response.schema import StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+
+class StreamTimings(NamedTuple):
+    """Latencies of a streamed answer, in seconds from the start of the query"""
+
+    time_to_first_token: float
+    total: float
+    tokens: int
+
+    @property
+    def tokens_per_second(self) -> float:
+        """Generation rate after the first token"""
+        generation = self.total - self.time_to_first_token
+        return (self.tokens - 1) / generation if self.tokens > 1 and generation > 0 else 0.0
+
+
+class StreamingAnswer:
+    """Tokens of the answer to a question, timed as they are consumed
+
+    The query engine must be created with streaming=True:
+        answer = StreamingAnswer(index.as_query_engine(streaming=True), question)
+        for token in answer:
+            print(token, end="", flush=True)
+        print(answer.timings)
+
+    The time to first token includes the retrieval. A query engine without
+    streaming returns its whole answer as a single token.
+    """
+
+    def __init__(self, query_engine: BaseQueryEngine, question: str):
+        self.query_engine = query_engine
+        self.question = question
+        self.response = None
+        self._tokens: List[str] = []
+        self._start = 0.0
+        self._first_token: Optional[float] = None
+        self._end: Optional[float] = None
+
+    def __iter__(self) -> Iterator[str]:
+        if self._end is not None:
+            yield from self._tokens
+            return
+        self._start = time.perf_counter()
+        self.response = self.query_engine.query(self.question)
+        if isinstance(self.response, StreamingResponse):
+            tokens = self.response.response_gen
+        else:
+            tokens = iter([str(self.response)])
+        for token in tokens:
+            if not token:
+                continue
+            if self._first_token is None:
+                self._first_token = time.perf_counter()
+            self._tokens.append(token)
+            yield token
+        self._end = time.perf_counter()
+        timings = self.timings
+        logger.info(
+            "Answered in %.2fs, first token after %.2fs (%.1f tokens/s)",
+            timings.total,
+            timings.time_to_first_token,
+            timings.tokens_per_second,
+        )
+
+    @property
+    def text(self) -> str:
+        """The answer, streamed to the end if it was not consumed yet"""
+        if self._end is None:
+            for _ in self:
+                pass
+        return "".join(self._tokens)
+
+    @property
+    def timings(self) -> StreamTimings:
+        """Time to first token and total latency, once the answer is consumed"""
+        if self._end is None:
+            raise RuntimeError("The answer was not consumed yet")
+        first_token = self._first_token if self._first_token is not None else self._end
+        return StreamTimings(first_token - self._start, self._end - self._start, len(self._tokens))
+
+
+def print_streaming(
+    query_engine: BaseQueryEngine, question: str, file: TextIO = sys.stdout
+) -> StreamTimings:
+    """Print the answer to a question as it is generated
+
+    Args:
+        query_engine: The query engine, created with streaming=True
+        question: The question
+        file: Where the tokens are printed
+    Returns:
+        The latencies of the answer
+    """
+    answer = StreamingAnswer(query_engine, question)
+    for token in answer:
+        print(token, end="", file=file, flush=True)
+    print(file=file)
+    return answer.timings
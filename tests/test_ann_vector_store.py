@@ -0,0 +1,85 @@
+import numpy as np
+from llama_index.core import Document, MockEmbedding, ServiceContext
+from llama_index.core.llms import MockLLM
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from llamaindex_course.llamaindex import ann_vector_store
+from llamaindex_course.llamaindex.ann_vector_store import (
+    IvfVectorStore,
+    _clustered_vectors,
+    benchmark,
+)
+from llamaindex_course.llamaindex.incremental_index import refresh_index
+from llamaindex_course.llamaindex.mmap_vector_store import (
+    MmapVectorStore,
+    load_index,
+    new_storage_context,
+)
+
+
+def _store(cls, vectors, **kwargs):
+    return cls(vectors=vectors, ids=[str(index) for index in range(len(vectors))], **kwargs)
+
+
+def test_ivf_recall(tmp_path):
+    """Test the IVF search finds most of the exact neighbors, all of them when every list is probed"""
+    vectors = _clustered_vectors(5020, 32)
+    vectors, queries = vectors[:5000], vectors[5000:]
+    exact = _store(MmapVectorStore, vectors)
+    ivf = _store(IvfVectorStore, vectors, n_probe=8)
+    ivf.train()
+    assert ivf.is_trained
+
+    def search(store, query, **kwargs):
+        return store.query(
+            VectorStoreQuery(query_embedding=query.tolist(), similarity_top_k=10), **kwargs
+        ).ids
+
+    recall = np.mean(
+        [len(set(search(ivf, query)) & set(search(exact, query))) / 10 for query in queries]
+    )
+    assert recall > 0.8
+    for query in queries[:3]:
+        assert search(ivf, query, n_probe=10_000) == search(exact, query)
+
+    # The centroids and lists are persisted and reloaded
+    persist_path = str(tmp_path / "default__vector_store.json")
+    ivf.persist(persist_path)
+    loaded = IvfVectorStore.from_persist_path(persist_path)
+    assert loaded.is_trained
+    assert loaded.n_probe == 8
+    assert search(loaded, queries[0]) == search(ivf, queries[0])
+
+    # Added vectors are assigned to a list, deleted ones removed from it
+    loaded.add([TextNode(text="new", id_="new", embedding=queries[0].tolist())])
+    assert search(loaded, queries[0])[0] == "new"
+    loaded.delete_nodes(["new"])
+    assert "new" not in search(loaded, queries[0])
+
+
+def test_ivf_backend(tmp_path, monkeypatch):
+    """Test an index created with the ivf backend is reloaded with an IvfVectorStore"""
+    monkeypatch.setattr(ann_vector_store, "MIN_TRAIN_SIZE", 4)
+    persist_dir = str(tmp_path / "index")
+    service_context = ServiceContext.from_defaults(
+        llm=MockLLM(), embed_model=MockEmbedding(embed_dim=8)
+    )
+    documents = [Document(text=f"Document {index}", id_=str(index)) for index in range(8)]
+    storage_context = new_storage_context(persist_dir, backend="ivf")
+    refresh_index(
+        documents, persist_dir, storage_context=storage_context, service_context=service_context
+    )
+
+    index = load_index(persist_dir, service_context=service_context)
+    assert isinstance(index.vector_store, IvfVectorStore)
+    assert index.vector_store.is_trained
+    assert len(index.as_retriever(similarity_top_k=3).retrieve("Document")) == 3
+
+
+
+def test_benchmark():
+    """Test the benchmark runs on a small size"""
+    rows = benchmark([2000], dimension=16, n_queries=5, n_probes=(2,))
+    assert [row.search for row in rows] == ["exact", "ivf n_probe=2"]
+    assert 0 < rows[1].recall <= 1
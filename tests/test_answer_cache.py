@@ -0,0 +1,114 @@
+from typing import List
+
+from llama_index.core import Document, MockEmbedding, ServiceContext, VectorStoreIndex
+from llama_index.core.base.response.schema import StreamingResponse
+from llama_index.core.llms import MockLLM
+from llama_index.core.postprocessor import SimilarityPostprocessor
+
+from llamaindex_course.llamaindex.answer_cache import SemanticCacheQueryEngine, index_version
+
+WORDS = ["air", "liquide", "2023", "summary", "revenue", "margin", "2022"]
+
+
+class KeywordEmbedding(MockEmbedding):
+    """Embedding counting a few words, similar questions get similar embeddings"""
+
+    def _embedding(self, text: str) -> List[float]:
+        tokens = text.lower().replace("?", " ").split()
+        return [float(tokens.count(word)) for word in WORDS] + [0.1]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embedding(text)
+
+
+def _index(texts):
+    service_context = ServiceContext.from_defaults(
+        llm=MockLLM(max_tokens=4), embed_model=KeywordEmbedding(embed_dim=len(WORDS) + 1)
+    )
+    return VectorStoreIndex.from_documents(
+        [Document(text=text, id_=str(index)) for index, text in enumerate(texts)],
+        service_context=service_context,
+    )
+
+
+def test_semantic_cache(tmp_path):
+    """Test a near-duplicate question is answered from the cache, with the source nodes"""
+    cache_path = str(tmp_path / "answers.db")
+    index = _index(["Air Liquide revenue 2023", "Air Liquide margin 2022"])
+    engine = SemanticCacheQueryEngine(index, cache_path=cache_path, similarity_top_k=1)
+
+    first = engine.query("Explain the result of Air Liquide in 2023 ? Make a summary")
+    assert not (first.metadata or {}).get("cached")
+    second = engine.query("explain the results of Air Liquide in 2023 ? make a summary please")
+    assert second.metadata["cached"]
+    assert second.response == first.response
+    assert [node.node.node_id for node in second.source_nodes] == [
+        node.node.node_id for node in first.source_nodes
+    ]
+    assert not (engine.query("Air Liquide margin in 2022").metadata or {}).get("cached")
+    assert engine.stats.hits == 1 and engine.stats.misses == 2
+    assert engine.stats.hit_rate == 1 / 3
+
+    # The cache is shared by the engines of the same index version and configuration
+    engine = SemanticCacheQueryEngine(index, cache_path=cache_path, similarity_top_k=1)
+    assert len(engine) == 2
+    assert engine.query("Air Liquide margin in 2022").metadata["cached"]
+
+    # Another top k, LLM or postprocessor gives other answers
+    assert len(SemanticCacheQueryEngine(index, cache_path=cache_path, similarity_top_k=2)) == 0
+    engine = SemanticCacheQueryEngine(
+        index, cache_path=cache_path, similarity_top_k=1, llm=MockLLM(max_tokens=8)
+    )
+    assert len(engine) == 0
+    engine = SemanticCacheQueryEngine(
+        index,
+        cache_path=cache_path,
+        similarity_top_k=1,
+        node_postprocessors=[SimilarityPostprocessor(similarity_cutoff=0.5)],
+    )
+    assert len(engine) == 0
+    # without deleting the answers of the other configurations
+    assert len(SemanticCacheQueryEngine(index, cache_path=cache_path, similarity_top_k=1)) == 2
+
+
+def test_semantic_cache_invalidation(tmp_path):
+    """Test the cached answers are deleted when the index changes"""
+    cache_path = str(tmp_path / "answers.db")
+    index = _index(["Air Liquide revenue 2023"])
+    version = index_version(index)
+    engine = SemanticCacheQueryEngine(index, cache_path=cache_path)
+    engine.query("Air Liquide revenue 2023?")
+    assert len(engine) == 1
+
+    index.insert(Document(text="Air Liquide margin 2023", id_="new"))
+    assert index_version(index) != version
+    engine = SemanticCacheQueryEngine(index, cache_path=cache_path)
+    assert len(engine) == 0
+
+
+def test_semantic_cache_eviction(tmp_path):
+    """Test the least recently used answers are evicted"""
+    index = _index(["Air Liquide revenue 2023"])
+    engine = SemanticCacheQueryEngine(index, cache_path=str(tmp_path / "answers.db"), max_entries=2)
+    for question in ["revenue", "margin", "revenue", "summary"]:
+        engine.query(question)
+    assert len(engine) == 2
+    assert engine.query("revenue").metadata["cached"]
+    assert not (engine.query("margin").metadata or {}).get("cached")
+
+
+def test_semantic_cache_streaming(tmp_path):
+    """Test a streaming answer is cached once consumed"""
+    index = _index(["Air Liquide revenue 2023"])
+    engine = SemanticCacheQueryEngine(
+        index, cache_path=str(tmp_path / "answers.db"), streaming=True
+    )
+    response = engine.query("revenue")
+    assert isinstance(response, StreamingResponse)
+    assert len(engine) == 0
+    answer = "".join(response.response_gen)
+    assert len(engine) == 1
+    assert engine.query("revenue").response == answer
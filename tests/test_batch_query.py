@@ -0,0 +1,115 @@
+import asyncio
+import time
+
+import pytest
+from llama_index.core import Document, MockEmbedding, ServiceContext, VectorStoreIndex
+from llama_index.core.llms import MockLLM
+
+from llamaindex_course.llamaindex.incremental_index import refresh_index
+
+from llamaindex_course.llamaindex import batch_query, sharded_index
+from llamaindex_course.llamaindex.batch_query import (
+    aquery_batch,
+    batch_stats,
+    query_batch,
+    read_questions,
+)
+
+
+class SlowQueryEngine:
+    """Query engine answering after a delay, counting the questions in flight"""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def aquery(self, question):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        # The first questions take the longest, so they complete last
+        await asyncio.sleep(self.delay / (1 + len(question)))
+        self.in_flight -= 1
+        if question == "fail":
+            raise RuntimeError("no answer")
+        return f"answer to {question}"
+
+    def query(self, question):
+        time.sleep(self.delay)
+        return f"answer to {question}"
+
+
+def test_query_batch_order_and_concurrency():
+    """Test the answers come back in the order of the questions, with at most concurrency in flight"""
+    engine = SlowQueryEngine()
+    questions = ["q" * (1 + index) for index in range(10)]
+    results = query_batch(engine, questions, concurrency=3)
+    assert [result.answer for result in results] == [f"answer to {question}" for question in questions]
+    assert engine.max_in_flight == 3
+    assert all(result.ok and result.latency > 0 for result in results)
+
+
+def test_query_batch_errors():
+    """Test a failed question is reported without aborting the batch"""
+    results = asyncio.run(aquery_batch(SlowQueryEngine(), ["a", "fail", "b"]))
+    assert [result.ok for result in results] == [True, False, True]
+    assert "no answer" in results[1].error
+    stats = batch_stats(results, 1.0)
+    assert stats.questions == 3 and stats.errors == 1
+    with pytest.raises(ValueError):
+        query_batch(SlowQueryEngine(), ["a"], concurrency=0)
+
+
+def test_query_batch_threads():
+    """Test the synchronous queries run concurrently in worker threads"""
+    start = time.perf_counter()
+    results = query_batch(SlowQueryEngine(delay=0.2), ["a", "b", "c", "d"], 4, use_threads=True)
+    assert time.perf_counter() - start < 0.6
+    assert [result.answer for result in results] == [f"answer to {q}" for q in "abcd"]
+
+
+def test_query_batch_index():
+    """Test a batch against a real query engine"""
+    service_context = ServiceContext.from_defaults(
+        llm=MockLLM(), embed_model=MockEmbedding(embed_dim=8)
+    )
+    index = VectorStoreIndex.from_documents(
+        [Document(text="Air Liquide results in 2023")], service_context=service_context
+    )
+    results = query_batch(index.as_query_engine(), ["Revenue?", "Margin?"])
+    assert [result.question for result in results] == ["Revenue?", "Margin?"]
+    assert all(result.ok for result in results)
+
+
+def test_read_questions(tmp_path):
+    """Test the empty lines and comments are skipped"""
+    path = tmp_path / "questions.txt"
+    path.write_text("# nightly report\nRevenue in 2023?\n\n  Margin?  \n", encoding="utf-8")
+    assert read_questions(str(path)) == ["Revenue in 2023?", "Margin?"]
+
+
+def test_main_uses_the_ollama_models(tmp_path, monkeypatch, capsys):
+    """Test --ollama loads and queries the index with the models of 08b"""
+    service_context = ServiceContext.from_defaults(
+        llm=MockLLM(max_tokens=4), embed_model=MockEmbedding(embed_dim=8)
+    )
+    persist_dir = str(tmp_path / "index")
+    documents = [Document(text="Air Liquide results in 2023", id_="a")]
+    refresh_index(documents, persist_dir, service_context=service_context)
+    questions = tmp_path / "questions.txt"
+    questions.write_text("Revenue?\nMargin?\n", encoding="utf-8")
+
+    loaded = []
+    load = sharded_index.load_indexes
+
+    def load_indexes(directory, **index_kwargs):
+        loaded.append(index_kwargs)
+        return load(directory, **index_kwargs)
+
+    monkeypatch.setenv("PERSIST_DIR", persist_dir)
+    monkeypatch.setattr(batch_query, "ollama_service_context", lambda: service_context)
+    monkeypatch.setattr(sharded_index, "load_indexes", load_indexes)
+    monkeypatch.setattr("sys.argv", ["batch_query", str(questions), "2", "--ollama", "--threads"])
+    batch_query.main()
+    assert loaded == [{"service_context": service_context}]
+    assert "2 questions (0 errors)" in capsys.readouterr().out
@@ -0,0 +1,66 @@
+import os
+
+from llama_index.core import Document, MockEmbedding, ServiceContext
+from llama_index.core.llms import MockLLM
+
+from llamaindex_course.llamaindex.bm25_index import (
+    BM25_FNAME,
+    BM25Index,
+    HybridRetriever,
+    hybrid_query_engine,
+    tokenize,
+)
+from llamaindex_course.llamaindex.incremental_index import refresh_index
+
+TEXTS = {
+    "gas": "Gas & Services revenue was 27,6 billion euros in 2023",
+    "engineering": "Engineering & Construction revenue grew with the energy transition",
+    "electronics": "Electronics sales were stable, the margin improved",
+    "outlook": "The outlook for 2024 confirms the margin improvement",
+}
+
+
+def test_tokenize():
+    """Test the numbers keep their separators"""
+    assert tokenize("Revenue: 27,6 bn€ (+3.5%)") == ["revenue", "27,6", "bn", "3.5"]
+
+
+def test_bm25_scores(tmp_path):
+    """Test the BM25 ranking and its persistence"""
+    bm25_index = BM25Index.build(TEXTS.items())
+    assert [node_id for node_id, _ in bm25_index.top_k("27,6 billion", 2)] == ["gas"]
+    ranking = [node_id for node_id, _ in bm25_index.top_k("margin improvement", 4)]
+    assert ranking[0] == "outlook"
+    assert set(ranking) == {"outlook", "electronics"}
+    assert bm25_index.top_k("unknown words", 3) == []
+
+    path = str(tmp_path / BM25_FNAME)
+    bm25_index.save(path)
+    loaded = BM25Index.load(path)
+    assert loaded.node_ids == bm25_index.node_ids
+    assert loaded.top_k("revenue 2023", 4) == bm25_index.top_k("revenue 2023", 4)
+
+
+def test_hybrid_retriever(tmp_path):
+    """Test the exact terms missed by the vector search are found, and the index persisted"""
+    persist_dir = str(tmp_path / "index")
+    service_context = ServiceContext.from_defaults(
+        llm=MockLLM(max_tokens=4), embed_model=MockEmbedding(embed_dim=8)
+    )
+    documents = [Document(text=text, id_=doc_id) for doc_id, text in TEXTS.items()]
+    index, _ = refresh_index(documents, persist_dir, service_context=service_context)
+    assert os.path.exists(os.path.join(persist_dir, BM25_FNAME))
+
+    # MockEmbedding gives every node the same vector score: the BM25 score decides
+    retriever = HybridRetriever(index, persist_dir, similarity_top_k=1)
+    nodes = retriever.retrieve("What was the revenue of Gas & Services, 27,6 billion ?")
+    assert [node.node.ref_doc_id for node in nodes] == ["gas"]
+
+    # The BM25 index is rebuilt when the index changes
+    documents.append(Document(text="Hydrogen capacity doubled", id_="hydrogen"))
+    index, _ = refresh_index(documents, persist_dir, service_context=service_context)
+    retriever = HybridRetriever(index, persist_dir, similarity_top_k=2)
+    assert retriever.retrieve("hydrogen")[0].node.ref_doc_id == "hydrogen"
+
+    response = hybrid_query_engine(index, persist_dir, similarity_top_k=2).query("margin")
+    assert len(response.source_nodes) == 2
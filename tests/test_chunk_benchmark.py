@@ -0,0 +1,55 @@
+import json
+
+import numpy as np
+from llama_index.core import Document
+
+from llamaindex_course.llamaindex.chunk_benchmark import benchmark, read_questions
+from llamaindex_course.llamaindex.hashing_embedding import HashingEmbedding
+
+SEGMENTS = {
+    "Gas & Services": "revenue reached 27,6 billion euros, driven by healthcare and industrial merchants",
+    "Engineering & Construction": "order intake doubled thanks to the energy transition projects",
+    "Global Markets & Technologies": "sales grew in biogas and hydrogen mobility across Europe",
+}
+
+
+def _documents():
+    text = " ".join(
+        f"The {segment} segment: {sentence}. " + "Filler sentence about the group. " * 20
+        for segment, sentence in SEGMENTS.items()
+    )
+    return [Document(text=text)]
+
+
+def test_hashing_embedding():
+    """Test the embedding is deterministic, normalized, and closer for texts sharing words"""
+    embed_model = HashingEmbedding(dimension=256)
+    first = np.array(embed_model.get_text_embedding("Air Liquide revenue 2023"))
+    assert first.tolist() == embed_model.get_text_embedding("Air Liquide revenue 2023")
+    assert np.isclose(np.linalg.norm(first), 1)
+    close = np.array(embed_model.get_query_embedding("revenue of Air Liquide in 2023"))
+    far = np.array(embed_model.get_query_embedding("hydrogen mobility projects"))
+    assert first @ close > first @ far
+
+
+def test_benchmark(tmp_path):
+    """Test every setting is measured and the passages are found"""
+    path = tmp_path / "questions.json"
+    path.write_text(
+        json.dumps(
+            [
+                {"question": f"What about {segment}?", "expected": sentence}
+                for segment, sentence in SEGMENTS.items()
+            ]
+        ),
+        encoding="utf-8",
+    )
+    questions = read_questions(str(path))
+    rows = benchmark(_documents(), questions, chunk_sizes=(64, 256), chunk_overlaps=(0, 16, 64))
+    assert [(row.chunk_size, row.chunk_overlap) for row in rows] == [(64, 0), (64, 16), (256, 0), (256, 16), (256, 64)]
+    assert rows[0].nodes > rows[2].nodes
+    for row in rows:
+        assert row.build_seconds > 0 and row.peak_mb > 0
+        assert 0 < row.p50_ms <= row.p95_ms
+        assert 0 <= row.mrr <= row.hit_rate <= 1
+    assert rows[0].hit_rate == 1.0
@@ -0,0 +1,81 @@
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle, TextNode
+
+from llamaindex_course.llamaindex.context_packing import ContextPackingPostprocessor, split_sentences
+
+QUERY = QueryBundle("What was the revenue of Air Liquide in 2023?")
+
+
+def _nodes(metadata=None):
+    nodes = [
+        NodeWithScore(
+            node=TextNode(
+                id_="first",
+                text="The revenue of Air Liquide reached 27.6 billion euros in 2023. "
+                "The weather was sunny at the annual meeting.",
+            ),
+            score=0.9,
+        ),
+        NodeWithScore(
+            node=TextNode(
+                id_="second",
+                # the overlap of the two chunks repeats the first sentence
+                text="The revenue of Air Liquide reached 27.6 billion euros in 2023. "
+                "Hydrogen projects grew in Europe.",
+            ),
+            score=0.8,
+        ),
+    ]
+    for node in nodes:
+        node.node.metadata = dict(metadata or {})
+    return nodes
+
+
+def _words(text):
+    return text.split()
+
+
+def test_split_sentences():
+    """Test the sentences are split on the punctuation, not on decimals nor abbreviations"""
+    assert split_sentences("Revenue was 27.6 billion, e.g. up. Margins grew!\n\nOutlook") == [
+        "Revenue was 27.6 billion, e.g. up.",
+        "Margins grew!",
+        "Outlook",
+    ]
+
+
+def test_redundant_sentences_are_dropped():
+    """Test a sentence repeated across the chunks is kept once, in the best node"""
+    packing = ContextPackingPostprocessor(tokenizer=_words, token_budget=1000)
+    nodes = packing.postprocess_nodes(_nodes(), QUERY)
+    texts = [node.node.get_content() for node in nodes]
+    assert sum(text.count("27.6 billion") for text in texts) == 1
+    assert "Hydrogen projects grew in Europe." in texts[-1]
+    assert packing.last_stats.tokens_saved == 11
+    # the retrieved nodes are not modified
+    assert "27.6" in _nodes()[1].node.get_content()
+
+
+def test_token_budget():
+    """Test the context fits in the budget with the most relevant sentence first"""
+    packing = ContextPackingPostprocessor(tokenizer=_words, token_budget=12)
+    nodes = packing.postprocess_nodes(_nodes(), QUERY)
+    assert [node.node.node_id for node in nodes] == ["first"]
+    assert nodes[0].node.get_content() == "The revenue of Air Liquide reached 27.6 billion euros in 2023."
+    assert nodes[0].score == 0.9
+    assert packing.last_stats.tokens_out <= 12
+
+    packing.postprocess_nodes(_nodes(), QUERY)
+    assert packing.stats.tokens_in == 2 * packing.last_stats.tokens_in
+    assert 0 < packing.stats.ratio < 1
+
+
+def test_token_budget_counts_the_metadata():
+    """Test the budget holds the text sent to the LLM, with the metadata of each kept node"""
+    metadata = {"page_label": "3", "file_path": "data/report.pdf"}
+    packing = ContextPackingPostprocessor(tokenizer=_words, token_budget=16)
+    nodes = packing.postprocess_nodes(_nodes(metadata), QUERY)
+    # the first sentence and the metadata of its node: 11 + 4 tokens, no room for another node
+    assert [node.node.node_id for node in nodes] == ["first"]
+    assert nodes[0].node.metadata == metadata
+    sent = sum(len(_words(node.node.get_content(metadata_mode=MetadataMode.LLM))) for node in nodes)
+    assert sent == packing.last_stats.tokens_out == 15
@@ -0,0 +1,103 @@
+from typing import List
+
+from llama_index.core import Document, MockEmbedding, ServiceContext, VectorStoreIndex
+from llama_index.core.llms import MockLLM
+
+from llamaindex_course.llamaindex.embedding_cache import CachedEmbedding
+
+
+class CountingEmbedding(MockEmbedding):
+    """Mock embedding model counting the embedded texts, one vector per text"""
+
+    calls: int = 0
+
+    def _get_vector(self, text: str) -> List[float]:
+        codes = [float(ord(char)) for char in text[: self.embed_dim - 1]]
+        return [float(len(text))] + codes + [0.0] * (self.embed_dim - 1 - len(codes))
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        self.calls += 1
+        return self._get_vector(text)
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        self.calls += 1
+        return self._get_vector(query)
+
+
+def test_cache_persists(tmp_path):
+    """Test the embeddings are computed once and read back from the cache file"""
+    cache_path = str(tmp_path / "embeddings.db")
+    embed_model = CountingEmbedding(embed_dim=4)
+    cache = CachedEmbedding(embed_model, cache_path=cache_path)
+    # an empty cache is not taken for a missing model
+    assert len(cache) == 0 and cache
+
+    texts = ["glucose", "height", "glucose", "weight"]
+    embeddings = cache.get_text_embedding_batch(texts)
+    assert embeddings == [embed_model._get_vector(text) for text in texts]
+    assert embed_model.calls == 3
+    cache.close()
+
+    cache = CachedEmbedding(embed_model, cache_path=cache_path)
+    assert cache.get_text_embedding_batch([" glucose ", "height"]) == embeddings[:2]
+    assert embed_model.calls == 3
+    assert cache.stats.hits == 2
+    assert cache.stats.hit_rate == 1.0
+
+    # Query embeddings are cached apart from the text embeddings
+    assert cache.get_query_embedding("glucose") == embeddings[0]
+    assert embed_model.calls == 4
+
+
+def test_models_are_kept_apart(tmp_path):
+    """Test the embeddings of another model are not served"""
+    cache_path = str(tmp_path / "embeddings.db")
+    CachedEmbedding(CountingEmbedding(embed_dim=4), cache_path=cache_path).get_text_embedding("a")
+
+    other_model = CountingEmbedding(embed_dim=4, model_name="other")
+    CachedEmbedding(other_model, cache_path=cache_path).get_text_embedding("a")
+    assert other_model.calls == 1
+
+
+def test_lru_eviction():
+    """Test the least recently used embeddings are evicted"""
+    embed_model = CountingEmbedding(embed_dim=4)
+    cache = CachedEmbedding(embed_model, cache_path=":memory:", max_entries=2)
+
+    cache.get_text_embedding("a")
+    cache.get_text_embedding("b")
+    cache.get_text_embedding("a")
+    cache.get_text_embedding("c")
+    assert len(cache) == 2
+
+    embed_model.calls = 0
+    cache.get_text_embedding("a")
+    assert embed_model.calls == 0
+    cache.get_text_embedding("b")
+    assert embed_model.calls == 1
+
+
+def test_rebuild_without_embedding_calls(tmp_path):
+    """Test rebuilding an index with unchanged content does not call the embedding model"""
+    embed_model = CountingEmbedding(embed_dim=4)
+    service_context = ServiceContext.from_defaults(
+        llm=MockLLM(),
+        embed_model=CachedEmbedding(embed_model, cache_path=str(tmp_path / "embeddings.db")),
+    )
+    documents = [Document(text=f"Result {index} of the year") for index in range(5)]
+
+    VectorStoreIndex.from_documents(documents, service_context=service_context)
+    calls = embed_model.calls
+    VectorStoreIndex.from_documents(documents, service_context=service_context)
+    assert embed_model.calls == calls
+
+
+def test_index_uses_an_empty_cache(tmp_path):
+    """Test an index built with embed_model=<empty cache> embeds through the cache"""
+    embed_model = CountingEmbedding(embed_dim=4)
+    cache = CachedEmbedding(embed_model, cache_path=str(tmp_path / "embeddings.db"))
+    documents = [Document(text=f"Result {index} of the year") for index in range(5)]
+
+    index = VectorStoreIndex.from_documents(documents, embed_model=cache)
+    assert index._embed_model is cache
+    assert len(cache) == 5
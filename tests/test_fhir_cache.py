@@ -0,0 +1,66 @@
+import os
+import shutil
+
+from llamaindex_course.demo_medical.fhir_cache import FhirBundleCache
+from llamaindex_course.demo_medical.fhir_reader import read_fhir_file
+
+FHIR_FILE = "./data_json/0d5f5a77-b49d-4f8b-887f-70e9de390751.json"
+
+
+def test_cache_hits_and_misses(tmp_path):
+    """Test a bundle is parsed once and then loaded from the cache"""
+    cache = FhirBundleCache(str(tmp_path / "cache"))
+    bundle_file = tmp_path / "bundle.json"
+    shutil.copy(FHIR_FILE, bundle_file)
+
+    cold = cache.load(str(bundle_file))
+    warm = cache.load(str(bundle_file))
+    assert cache.stats == (1, 1)
+    assert warm.entries == cold.entries
+    assert sorted(map(str, warm.entries)) == sorted(map(str, read_fhir_file(FHIR_FILE)))
+
+    observations = cache.load(str(bundle_file), resource_types=["Observation"])
+    assert observations.resource_types == ["Observation"]
+    assert cache.stats.hits == 2
+
+    # A copy with the same content shares the cached bundle
+    copy_file = tmp_path / "copy.json"
+    shutil.copy(bundle_file, copy_file)
+    cache.load(str(copy_file))
+    assert cache.stats.hits == 3
+
+
+def test_cache_invalidation(tmp_path):
+    """Test a modified bundle is parsed again and the cache can be cleared"""
+    cache = FhirBundleCache(str(tmp_path / "cache"))
+    bundle_file = tmp_path / "bundle.json"
+    bundle_file.write_text('{"resourceType": "Bundle", "entry": []}')
+    assert len(cache.load(str(bundle_file))) == 0
+
+    bundle_file.write_text(
+        '{"resourceType": "Bundle", "entry": '
+        '[{"resource": {"resourceType": "Patient", "id": "p1"}}]}'
+    )
+    os.utime(bundle_file, ns=(0, 1))
+    assert len(cache.load(str(bundle_file))) == 1
+    assert cache.stats == (0, 2)
+
+    assert cache.invalidate(str(bundle_file)) == 2
+    assert cache.invalidate() == 1
+    assert not os.listdir(tmp_path / "cache")
+
+
+def test_corrupt_cache_file_is_a_miss(tmp_path):
+    """Test a truncated or corrupt cached bundle is deleted and parsed again"""
+    cache = FhirBundleCache(str(tmp_path / "cache"))
+    bundle_file = tmp_path / "bundle.json"
+    shutil.copy(FHIR_FILE, bundle_file)
+    expected = cache.load(str(bundle_file)).entries
+    (bundle_path,) = (tmp_path / "cache").glob("*.bundle")
+
+    for content in (bundle_path.read_bytes()[:-100], bundle_path.read_bytes()[:20], b""):
+        bundle_path.write_bytes(content)
+        assert cache.load(str(bundle_file)).entries == expected
+    assert cache.stats == (0, 4)
+    assert cache.load(str(bundle_file)).entries == expected
+    assert cache.stats.hits == 1
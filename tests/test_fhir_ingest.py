@@ -0,0 +1,53 @@
+import json
+import shutil
+
+from llamaindex_course.demo_medical import fhir_ingest
+from llamaindex_course.demo_medical.fhir_ingest import (
+    ingest_fhir_files,
+    iter_ndjson_resources,
+)
+from llamaindex_course.demo_medical.fhir_reader import read_fhir_file
+
+FHIR_FILE = "./data_json/0d5f5a77-b49d-4f8b-887f-70e9de390751.json"
+
+
+def _write_ndjson(file_path, entries):
+    with open(file_path, "w", encoding="utf-8") as file:
+        for entry in entries:
+            file.write(json.dumps(entry["resource"]) + "\n")
+
+
+def test_iter_ndjson_resources_byte_ranges(tmp_path):
+    """Test the byte ranges of an NDJSON file cover every line exactly once"""
+    entries = read_fhir_file(FHIR_FILE)
+    file_path = tmp_path / "export.ndjson"
+    _write_ndjson(file_path, entries)
+    size = file_path.stat().st_size
+
+    resources = []
+    for start in range(0, size, 10000):
+        for batch in iter_ndjson_resources(
+            str(file_path), batch_size=50, start=start, end=min(start + 10000, size)
+        ):
+            assert len(batch) <= 50
+            resources.extend(batch)
+    assert resources == [entry["resource"] for entry in entries]
+
+
+def test_ingest_fhir_files_in_parallel(tmp_path, monkeypatch):
+    """Test bundles and NDJSON files are ingested and merged by resource type"""
+    monkeypatch.setattr(fhir_ingest, "NDJSON_CHUNK_BYTES", 50000)
+    entries = read_fhir_file(FHIR_FILE)
+    shutil.copy(FHIR_FILE, tmp_path / "bundle_1.json")
+    shutil.copy(FHIR_FILE, tmp_path / "bundle_2.json")
+    _write_ndjson(tmp_path / "export.ndjson", entries)
+
+    bundle_index = ingest_fhir_files(str(tmp_path), max_workers=2)
+    assert len(bundle_index) == 3 * len(entries)
+    assert bundle_index.count("Observation") == 3 * 184
+
+    observations = ingest_fhir_files(
+        str(tmp_path / "*.json"), resource_types=["Observation"], max_workers=1
+    )
+    assert observations.resource_types == ["Observation"]
+    assert observations.count("Observation") == 2 * 184
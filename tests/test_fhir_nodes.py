@@ -0,0 +1,74 @@
+from llamaindex_course.demo_medical.fhir_nodes import (
+    build_encounter_nodes,
+    build_resource_nodes,
+)
+from llamaindex_course.demo_medical.fhir_reader import FhirBundleIndex, iter_fhir_entries
+
+FHIR_FILE = "./data_json/0d5f5a77-b49d-4f8b-887f-70e9de390751.json"
+INDEXED_RESOURCE_TYPES = ("Patient", "Observation", "Condition", "Encounter")
+
+
+def _bundle_index():
+    return FhirBundleIndex(
+        iter_fhir_entries(FHIR_FILE, resource_types=INDEXED_RESOURCE_TYPES)
+    )
+
+
+def test_encounter_nodes_are_fewer_and_within_budget():
+    """Test the encounter nodes group the resources within the token budget"""
+    bundle_index = _bundle_index()
+    resource_nodes = build_resource_nodes(bundle_index)
+    encounter_nodes = build_encounter_nodes(bundle_index, max_tokens=200, tokenizer=str.split)
+
+    assert len(resource_nodes) == len(bundle_index)
+    assert len(encounter_nodes) < len(resource_nodes) / 4
+    assert encounter_nodes[0].text.startswith("Patient: ")
+    for node in encounter_nodes[1:]:
+        assert node.text.startswith("Encounter ")
+        assert len(node.text.split()) <= 200
+        assert node.metadata["encounter"].startswith("urn:uuid:")
+
+    # Every resource is rendered in exactly one node
+    lines = [line for node in encounter_nodes for line in node.text.split("\n")]
+    assert sum(line.startswith("Observation ") for line in lines) == 184
+
+
+def test_encounter_node_ids_are_stable():
+    """Test the node ids only depend on the content and the source of the nodes"""
+    first = build_encounter_nodes(_bundle_index(), tokenizer=str.split)
+    second = build_encounter_nodes(_bundle_index(), tokenizer=str.split)
+    assert [node.node_id for node in first] == [node.node_id for node in second]
+    assert len({node.node_id for node in first}) == len(first)
+
+
+def _twin_patients():
+    """Two patients with the same demographics and the same encounter"""
+    entries = []
+    for patient in ("p1", "p2"):
+        entries.append({
+            "fullUrl": f"urn:uuid:{patient}",
+            "resource": {"resourceType": "Patient", "id": patient, "gender": "female", "birthDate": "1980-01-01"},
+        })
+        entries.append({
+            "fullUrl": f"urn:uuid:e-{patient}",
+            "resource": {
+                "resourceType": "Encounter",
+                "id": f"e-{patient}",
+                "type": [{"text": "Checkup"}],
+                "subject": {"reference": f"urn:uuid:{patient}"},
+                "period": {"start": "2023-01-01T10:00:00Z"},
+            },
+        })
+    return FhirBundleIndex(entries)
+
+
+def test_same_text_of_two_patients_gets_two_node_ids():
+    """Test two patients whose records render to the same text keep their own nodes"""
+    nodes = build_encounter_nodes(_twin_patients(), tokenizer=str.split)
+    assert len(nodes) == 4
+    assert nodes[1].text == nodes[3].text
+    assert [node.metadata["patient"] for node in nodes] == ["urn:uuid:p1"] * 2 + ["urn:uuid:p2"] * 2
+    assert len({node.node_id for node in nodes}) == 4
+
+    resource_nodes = build_resource_nodes(_twin_patients())
+    assert len({node.node_id for node in resource_nodes}) == len(resource_nodes) == 4
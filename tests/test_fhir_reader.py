@@ -0,0 +1,92 @@
+import json
+
+import pytest
+
+from llamaindex_course.demo_medical.fhir_reader import (
+    FhirBundleIndex,
+    get_fhir_resource_types,
+    get_list_of_resources,
+    iter_fhir_entries,
+    read_fhir_file,
+)
+
+FHIR_FILE = "./data_json/0d5f5a77-b49d-4f8b-887f-70e9de390751.json"
+PATIENT_ID = "0d5f5a77-b49d-4f8b-887f-70e9de390751"
+
+
+def test_bundle_index_counts():
+    """Test the resource counts of the bundle index"""
+    data = read_fhir_file(FHIR_FILE)
+    bundle_index = FhirBundleIndex(data)
+
+    assert len(bundle_index) == len(data) == 292
+    assert bundle_index.count("Observation") == 184
+    assert bundle_index.count("Unknown") == 0
+    assert bundle_index.counts()["Encounter"] == 18
+    assert bundle_index.resource_types[0] == "Patient"
+
+
+def test_bundle_index_lookups():
+    """Test the lookups by id and fullUrl of the bundle index"""
+    bundle_index = FhirBundleIndex(read_fhir_file(FHIR_FILE))
+
+    patient = bundle_index.get_by_id("Patient", PATIENT_ID)
+    assert patient is not None
+    assert bundle_index.get_by_full_url(f"urn:uuid:{PATIENT_ID}") is patient
+    assert bundle_index.get_by_id("Observation", PATIENT_ID) is None
+
+
+def test_helpers_match_bundle_index():
+    """Test the helper functions accept both entries and a bundle index"""
+    data = read_fhir_file(FHIR_FILE)
+    bundle_index = FhirBundleIndex(data)
+
+    expected = [
+        entry["resource"]
+        for entry in data
+        if entry["resource"]["resourceType"] == "Condition"
+    ]
+    assert get_fhir_resource_types(data, "Condition") == expected
+    assert get_fhir_resource_types(bundle_index, "Condition") == expected
+    assert get_list_of_resources(data) == get_list_of_resources(bundle_index)
+
+
+@pytest.mark.parametrize("chunk_size", [7, 4096])
+def test_iter_fhir_entries_matches_read_fhir_file(chunk_size):
+    """Test the streaming reader yields the same entries as read_fhir_file"""
+    entries = list(iter_fhir_entries(FHIR_FILE, chunk_size=chunk_size))
+    assert entries == read_fhir_file(FHIR_FILE)
+
+
+def test_iter_fhir_entries_filters_resource_types():
+    """Test the streaming reader only yields the requested resource types"""
+    entries = list(iter_fhir_entries(FHIR_FILE, resource_types=["Patient", "Condition"]))
+    assert [entry["resource"]["resourceType"] for entry in entries] == [
+        "Patient",
+        "Condition",
+        "Condition",
+    ]
+
+
+def test_iter_fhir_entries_rejects_non_bundle(tmp_path):
+    """Test the streaming reader raises a ValueError for a non Bundle document"""
+    file_path = tmp_path / "patient.json"
+    file_path.write_text(json.dumps({"resourceType": "Patient", "id": "1"}))
+    with pytest.raises(ValueError):
+        list(iter_fhir_entries(str(file_path)))
+
+    file_path.write_text(json.dumps({"entry": [], "resourceType": "Bundle", "total": 12}))
+    assert not list(iter_fhir_entries(str(file_path), chunk_size=3))
+
+
+def test_iter_fhir_entries_numbers_cut_by_any_block(tmp_path):
+    """Test the top level numbers are decoded whatever block cuts them"""
+    document = (
+        '{"resourceType":"Bundle","total":12.5,"score":1e3,"count":-7,'
+        '"entry":[{"resource":{"resourceType":"Patient","id":"1"}}],"ratio":2.5E-1}'
+    )
+    file_path = tmp_path / "bundle.json"
+    file_path.write_text(document)
+    expected = json.loads(document)["entry"]
+    for chunk_size in range(1, len(document) + 1):
+        assert list(iter_fhir_entries(str(file_path), chunk_size=chunk_size)) == expected
@@ -0,0 +1,46 @@
+from llamaindex_course.demo_medical.fhir_reader import FhirBundleIndex, read_fhir_file
+from llamaindex_course.demo_medical.fhir_reference_graph import FhirReferenceGraph
+
+FHIR_FILE = "./data_json/0d5f5a77-b49d-4f8b-887f-70e9de390751.json"
+PATIENT = "urn:uuid:0d5f5a77-b49d-4f8b-887f-70e9de390751"
+ENCOUNTER = "urn:uuid:dc26ba76-ca84-436d-83aa-efc5bb9a3d52"
+CLAIM = "urn:uuid:5798d4da-fdb7-49a7-8013-1ecd820b8bd2"
+
+
+def test_reference_graph_adjacency():
+    """Test the adjacency lists of the reference graph in both directions"""
+    entries = read_fhir_file(FHIR_FILE)
+    graph = FhirReferenceGraph.from_bundle_index(FhirBundleIndex(entries))
+
+    expected = [
+        entry["fullUrl"]
+        for entry in entries
+        if entry["resource"]["resourceType"] == "Observation"
+        and entry["resource"].get("encounter", {}).get("reference") == ENCOUNTER
+    ]
+    assert graph.referenced_by(ENCOUNTER, "Observation") == expected
+    assert CLAIM in graph.referenced_by(ENCOUNTER)
+    assert ENCOUNTER in graph.references(CLAIM)
+    assert PATIENT in graph.references(ENCOUNTER)
+    assert len(graph.referenced_by(PATIENT, "Observation")) == 184
+
+
+def test_reference_graph_resolves_relative_references():
+    """Test "ResourceType/id" references are resolved for entries without fullUrl"""
+    graph = FhirReferenceGraph(
+        [
+            {"resource": {"resourceType": "Patient", "id": "p1"}},
+            {
+                "resource": {
+                    "resourceType": "Condition",
+                    "id": "c1",
+                    "subject": {"reference": "Patient/p1"},
+                    "asserter": {"reference": "Practitioner/unknown"},
+                }
+            },
+        ]
+    )
+    assert graph.resolve("Patient/p1") == {"resourceType": "Patient", "id": "p1"}
+    assert graph.references("Condition/c1") == ["Patient/p1"]
+    assert graph.referenced_by_resources("Patient/p1", "Condition")[0]["id"] == "c1"
+    assert graph.resolve("Practitioner/unknown") is None
@@ -0,0 +1,46 @@
+from llamaindex_course.demo_medical.fhir_reader import FhirBundleIndex, read_fhir_file
+from llamaindex_course.demo_medical.fhir_renderer import (
+    RENDERERS,
+    measure_rendering,
+    render_resource,
+)
+
+FHIR_FILE = "./data_json/0d5f5a77-b49d-4f8b-887f-70e9de390751.json"
+
+
+def test_render_resources():
+    """Test the compact rendering of the main resource types"""
+    bundle_index = FhirBundleIndex(read_fhir_file(FHIR_FILE))
+
+    patient = render_resource(bundle_index.get_resources("Patient")[0])
+    assert patient.startswith("Patient: Kiara Zahara Torres, female, born 2012-11-11")
+
+    observation = render_resource(bundle_index.get_resources("Observation")[0])
+    assert observation == "Observation 2018-03-17: Body temperature = 37.367 Cel"
+
+    condition = render_resource(bundle_index.get_resources("Condition")[0])
+    assert "Acute viral pharyngitis (disorder), resolved" in condition
+
+    for resource_type in bundle_index.resource_types:
+        text = render_resource(bundle_index.get_resources(resource_type)[0])
+        assert "urn:uuid" not in text
+        assert "{" not in text
+
+
+def test_render_resource_custom_renderer():
+    """Test a renderer can be overridden for a resource type"""
+    renderers = {**RENDERERS, "Patient": lambda patient: f"Patient {patient['id']}"}
+    patient = {"resourceType": "Patient", "id": "p1"}
+    assert render_resource(patient, renderers) == "Patient p1"
+    assert render_resource({"resourceType": "Device", "status": "active"}) == (
+        "Device: status active"
+    )
+
+
+def test_measure_rendering():
+    """Test the rendering is several times smaller than str(resource)"""
+    resources = [entry["resource"] for entry in read_fhir_file(FHIR_FILE)]
+    stats = measure_rendering(resources, tokenizer=str.split)
+    assert stats.resources == 292
+    assert stats.char_reduction > 5
+    assert stats.token_reduction > 2
@@ -0,0 +1,43 @@
+from llamaindex_course.demo_medical.fhir_reader import FhirBundleIndex, read_fhir_file
+from llamaindex_course.demo_medical.fhir_store import FhirResourceStore
+
+FHIR_FILE = "./data_json/0d5f5a77-b49d-4f8b-887f-70e9de390751.json"
+PATIENT = "urn:uuid:0d5f5a77-b49d-4f8b-887f-70e9de390751"
+ENCOUNTER = "urn:uuid:dc26ba76-ca84-436d-83aa-efc5bb9a3d52"
+BODY_HEIGHT = "8302-2"
+
+
+def test_fhir_store_queries(tmp_path):
+    """Test the structured queries of the SQLite store"""
+    bundle_index = FhirBundleIndex(read_fhir_file(FHIR_FILE))
+    db_path = str(tmp_path / "fhir.db")
+    with FhirResourceStore(db_path) as store:
+        assert store.ingest_bundle_index(bundle_index) == 292
+        # Ingesting the same resources again replaces them
+        store.ingest(bundle_index.entries, batch_size=50)
+        assert store.counts() == bundle_index.counts()
+
+    with FhirResourceStore(db_path) as store:
+        assert store.get(PATIENT)["resourceType"] == "Patient"
+        assert store.get("urn:uuid:unknown") is None
+
+        conditions = store.find("Condition", patient=PATIENT)
+        assert [condition["id"] for condition in conditions] == [
+            condition["id"]
+            for condition in sorted(
+                bundle_index.get_resources("Condition"),
+                key=lambda condition: condition["onsetDateTime"],
+            )
+        ]
+
+        observations = store.find("Observation", encounter=ENCOUNTER)
+        assert [observation["code"]["text"] for observation in observations] == [
+            "Body temperature"
+        ]
+
+        heights = store.find("Observation", code=BODY_HEIGHT)
+        dates = [height["effectiveDateTime"] for height in heights]
+        assert dates == sorted(dates)
+        in_2016 = store.find("Observation", code=BODY_HEIGHT, start="2016", end="2017")
+        assert 0 < len(in_2016) < len(heights)
+        assert len(store.find(limit=3)) == 3
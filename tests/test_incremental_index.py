@@ -0,0 +1,105 @@
+from typing import List
+
+from llama_index.core import Document, MockEmbedding, ServiceContext
+from llama_index.core.llms import MockLLM
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import TextNode
+
+from llamaindex_course.llamaindex.incremental_index import (
+    RefreshStats,
+    refresh_index,
+    refresh_node_index,
+)
+
+
+class CountingEmbedding(MockEmbedding):
+    """Mock embedding model counting the embedded texts"""
+
+    calls: int = 0
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        self.calls += 1
+        return super()._get_text_embedding(text)
+
+
+def _service_context(embed_model):
+    return ServiceContext.from_defaults(llm=MockLLM(), embed_model=embed_model)
+
+
+def test_refresh_index(tmp_path):
+    """Test only the new or changed documents are embedded and removed ones deleted"""
+    persist_dir = str(tmp_path / "index")
+    embed_model = CountingEmbedding(embed_dim=8)
+    service_context = _service_context(embed_model)
+    documents = [
+        Document(text="Revenue grew in 2023.", id_="a"),
+        Document(text="Margin improved.", id_="b"),
+    ]
+
+    _, stats = refresh_index(documents, persist_dir, service_context=service_context)
+    assert stats == RefreshStats(2, 0, 0, 0)
+    assert embed_model.calls == 2
+
+    _, stats = refresh_index(documents, persist_dir, service_context=service_context)
+    assert stats == RefreshStats(0, 0, 2, 0)
+    assert embed_model.calls == 2
+
+    documents = [
+        Document(text="Revenue grew strongly in 2023.", id_="a"),
+        Document(text="Net debt decreased.", id_="c"),
+    ]
+    index, stats = refresh_index(documents, persist_dir, service_context=service_context)
+    assert stats == RefreshStats(added=1, updated=1, unchanged=0, deleted=1)
+    assert embed_model.calls == 4
+    assert set(index.ref_doc_info) == {"a", "c"}
+
+    _, stats = refresh_index(documents, persist_dir, service_context=service_context)
+    assert stats.embedded == 0
+
+
+def test_refresh_node_index(tmp_path):
+    """Test only the new nodes are embedded and the missing ones deleted"""
+    persist_dir = str(tmp_path / "index")
+    embed_model = CountingEmbedding(embed_dim=8)
+    service_context = _service_context(embed_model)
+    nodes = [TextNode(text="Patient: A", id_="n1"), TextNode(text="Encounter", id_="n2")]
+
+    refresh_node_index(nodes, persist_dir, service_context=service_context)
+    _, stats = refresh_node_index(nodes, persist_dir, service_context=service_context)
+    assert stats == RefreshStats(0, 0, 2, 0)
+    assert embed_model.calls == 2
+
+    nodes = [nodes[0], TextNode(text="Encounter 2", id_="n3")]
+    index, stats = refresh_node_index(nodes, persist_dir, service_context=service_context)
+    assert stats == RefreshStats(1, 0, 1, 1)
+    assert embed_model.calls == 3
+    assert set(index.index_struct.nodes_dict.values()) == {"n1", "n3"}
+    assert set(index.docstore.docs) == {"n1", "n3"}
+
+
+def test_refresh_index_rebuilds_on_new_settings(tmp_path):
+    """Test another chunk size or embedding model rebuilds the index"""
+    persist_dir = str(tmp_path / "index")
+    documents = [Document(text="Revenue grew in 2023. " * 60, id_="a")]
+
+    def refresh(chunk_size, model_name="unknown"):
+        return refresh_index(
+            documents,
+            persist_dir,
+            service_context=_service_context(CountingEmbedding(embed_dim=8, model_name=model_name)),
+            transformations=[SentenceSplitter(chunk_size=chunk_size, chunk_overlap=0)],
+        )
+
+    index, _ = refresh(512)
+    nodes = len(index.index_struct.nodes_dict)
+    _, stats = refresh(512)
+    assert stats == RefreshStats(0, 0, 1, 0)
+
+    index, stats = refresh(64)
+    assert stats == RefreshStats(1, 0, 0, 0)
+    assert len(index.index_struct.nodes_dict) > nodes
+
+    _, stats = refresh(64, model_name="other")
+    assert stats == RefreshStats(1, 0, 0, 0)
+    _, stats = refresh(64, model_name="other")
+    assert stats.unchanged == 1
@@ -4,6 +4,8 @@ import json
 
 from pathlib import Path
 
+import pytest
+
 from llamaindex_course.demo_medical.medical_record_format import read_medical_file,Bundle
 
 ## get a loggger
@@ -41,3 +43,33 @@ def test_read_medical_record_format():
     
     # Display nicely bundler
    # logger.debug(bundle.entry[0])
+
+
+def test_read_medical_file_lazy_validation():
+    """Test the fast path builds the same bundle as the validated path"""
+    bundle = read_medical_file(Path(DOCUMENTS_DIR))
+    validated_bundle = read_medical_file(Path(DOCUMENTS_DIR), validate=True)
+    compact_bundle = read_medical_file(Path(DOCUMENTS_DIR), compact=True)
+
+    assert len(bundle.entry) == 292
+    assert bundle.model_dump(exclude_unset=True) == validated_bundle.model_dump(
+        exclude_unset=True
+    )
+    assert compact_bundle.model_dump(exclude_unset=True) == bundle.model_dump(
+        exclude_unset=True
+    )
+
+    observations = bundle.validate_resources("Observation")
+    assert len(observations) == 184
+    assert observations[0].code.text == "Body temperature"
+    assert type(observations[0]) is type(validated_bundle.get_resources("Observation")[0])
+
+
+def test_read_medical_file_rejects_non_bundle(tmp_path):
+    """Test a document that is not a FHIR Bundle raises a ValueError"""
+    file_path = tmp_path / "patient.json"
+    file_path.write_text(json.dumps({"resourceType": "Patient", "id": "1"}))
+    with pytest.raises(ValueError):
+        read_medical_file(file_path)
+    with pytest.raises(ValueError):
+        read_medical_file(file_path, validate=True)
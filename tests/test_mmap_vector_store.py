@@ -0,0 +1,221 @@
+import json
+
+import numpy as np
+import pytest
+from llama_index.core import Document, MockEmbedding, ServiceContext, VectorStoreIndex
+from llama_index.core.llms import MockLLM
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from llamaindex_course.llamaindex import ann_vector_store
+from llamaindex_course.llamaindex.ann_vector_store import IvfVectorStore
+from llamaindex_course.llamaindex.incremental_index import refresh_index
+from llamaindex_course.llamaindex.mmap_vector_store import (
+    MmapVectorStore,
+    convert_persist_dir,
+    load_index,
+    mmap_store_exists,
+    new_storage_context,
+)
+from llamaindex_course.llamaindex.quantized_vector_store import Int8VectorStore
+
+
+def _node(node_id, embedding, ref_doc_id=None):
+    node = TextNode(text=node_id, id_=node_id, embedding=embedding)
+    if ref_doc_id:
+        node.relationships = {"1": {"node_id": ref_doc_id}}
+    return node
+
+
+def test_query_persist_and_mmap(tmp_path):
+    """Test the top k query and the memory-mapped reload"""
+    store = MmapVectorStore()
+    store.add(
+        [
+            _node("a", [1.0, 0.0, 0.0]),
+            _node("b", [0.0, 2.0, 0.0]),
+            _node("c", [1.0, 1.0, 0.0]),
+        ]
+    )
+    query = VectorStoreQuery(query_embedding=[1.0, 0.1, 0.0], similarity_top_k=2)
+    result = store.query(query)
+    assert result.ids == ["a", "c"]
+    assert result.similarities[0] > result.similarities[1]
+
+    persist_path = str(tmp_path / "default__vector_store.json")
+    store.persist(persist_path)
+    loaded = MmapVectorStore.from_persist_path(persist_path)
+    assert isinstance(loaded.vectors, np.memmap)
+    assert loaded.query(query).ids == ["a", "c"]
+
+    # Restricted to some nodes
+    query = VectorStoreQuery(query_embedding=[1.0, 0.1, 0.0], similarity_top_k=5, node_ids=["b", "c"])
+    assert loaded.query(query).ids == ["c", "b"]
+
+    # Updating a loaded store does not write in the mapped file
+    loaded.delete_nodes(["a"])
+    loaded.add([_node("d", [0.0, 0.0, 1.0])])
+    assert loaded.ids == ["b", "c", "d"]
+    assert MmapVectorStore.from_persist_path(persist_path).query(
+        VectorStoreQuery(query_embedding=[1.0, 0.0, 0.0], similarity_top_k=1)
+    ).ids == ["a"]
+
+
+def test_index_round_trip(tmp_path):
+    """Test an index persisted with an MmapVectorStore answers the same queries once loaded"""
+    persist_dir = str(tmp_path / "index")
+    service_context = ServiceContext.from_defaults(
+        llm=MockLLM(), embed_model=MockEmbedding(embed_dim=8)
+    )
+    documents = [Document(text=f"Document number {index}", id_=str(index)) for index in range(4)]
+    index = VectorStoreIndex.from_documents(
+        documents, storage_context=new_storage_context(), service_context=service_context
+    )
+    index.storage_context.persist(persist_dir=persist_dir)
+    assert mmap_store_exists(persist_dir)
+
+    loaded = load_index(persist_dir, service_context=service_context)
+    nodes = loaded.as_retriever(similarity_top_k=4).retrieve("Document")
+    assert sorted(node.node.ref_doc_id for node in nodes) == ["0", "1", "2", "3"]
+
+    loaded.delete_ref_doc("0", delete_from_docstore=True)
+    nodes = loaded.as_retriever(similarity_top_k=4).retrieve("Document")
+    assert sorted(node.node.ref_doc_id for node in nodes) == ["1", "2", "3"]
+
+
+def test_convert_json_store(tmp_path):
+    """Test converting the JSON vector store of a persisted index"""
+    persist_dir = str(tmp_path / "index")
+    service_context = ServiceContext.from_defaults(
+        llm=MockLLM(), embed_model=MockEmbedding(embed_dim=8)
+    )
+    index = VectorStoreIndex.from_documents(
+        [Document(text="Revenue"), Document(text="Margin")], service_context=service_context
+    )
+    index.storage_context.persist(persist_dir=persist_dir)
+    assert not mmap_store_exists(persist_dir)
+
+    assert convert_persist_dir(persist_dir) == 2
+    loaded = load_index(persist_dir, service_context=service_context)
+    assert isinstance(loaded.vector_store, MmapVectorStore)
+    assert len(loaded.as_retriever(similarity_top_k=2).retrieve("Revenue")) == 2
+
+
+def test_persist_switches_generations(tmp_path, monkeypatch):
+    """Test a persist replaces the matrix and the ids together and removes the old files"""
+    persist_path = str(tmp_path / "default__vector_store.json")
+    store = MmapVectorStore()
+    store.add([_node("a", [1.0, 0.0]), _node("b", [0.0, 1.0])])
+    store.persist(persist_path)
+    store.delete_nodes(["a"])
+    store.add([_node("a", [1.0, 1.0])])
+    store.persist(persist_path)
+
+    (npy_file,) = tmp_path.glob("*.npy")
+    assert json.loads((tmp_path / "default__vector_store.ids.json").read_text())["arrays"] == {
+        "vectors": npy_file.name
+    }
+    loaded = MmapVectorStore.from_persist_path(persist_path)
+    assert loaded.ids == ["b", "a"]
+    assert np.allclose(loaded.get("b"), [0.0, 1.0])
+
+    # A reader that read the id table of a persist that was just replaced reads it again
+    calls = []
+    load = np.load
+
+    def stale_load(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            raise FileNotFoundError(args[0])
+        return load(*args, **kwargs)
+
+    monkeypatch.setattr(np, "load", stale_load)
+    assert MmapVectorStore.from_persist_path(persist_path).ids == ["b", "a"]
+    assert len(calls) == 2
+
+
+def test_load_store_persisted_before_generations(tmp_path):
+    """Test a matrix and id table written by the previous layout are still loaded"""
+    np.save(tmp_path / "default__vector_store.npy", np.eye(2, dtype=np.float32))
+    (tmp_path / "default__vector_store.ids.json").write_text(
+        json.dumps({"ids": ["a", "b"], "ref_doc_ids": [None, None]})
+    )
+    loaded = MmapVectorStore.from_persist_dir(str(tmp_path))
+    assert loaded.query(VectorStoreQuery(query_embedding=[0.0, 1.0], similarity_top_k=1)).ids == ["b"]
+
+    loaded.persist(str(tmp_path / "default__vector_store.json"))
+    assert not (tmp_path / "default__vector_store.npy").exists()
+
+
+@pytest.mark.parametrize("store_class", [MmapVectorStore, IvfVectorStore, Int8VectorStore])
+def test_updates_are_applied_in_one_copy(tmp_path, monkeypatch, store_class):
+    """Test an incremental refresh copies the matrix once, and answers as a store built at once"""
+    rng = np.random.default_rng(0)
+    embeddings = {f"n{i}": rng.normal(size=8).tolist() for i in range(60)}
+    store = store_class()
+    store.add([_node(node_id, embeddings[node_id], f"doc-{node_id}") for node_id in list(embeddings)[:40]])
+    if store_class is IvfVectorStore:
+        store.train()
+    persist_path = str(tmp_path / "default__vector_store.json")
+    store.persist(persist_path)
+    loaded = store_class.from_persist_path(persist_path)
+
+    concatenations = []
+    concatenate = np.concatenate
+
+    def counting_concatenate(*args, **kwargs):
+        concatenations.append(1)
+        return concatenate(*args, **kwargs)
+
+    monkeypatch.setattr(np, "concatenate", counting_concatenate)
+    # one document at a time, like refresh_index: changed, new and deleted documents
+    for node_id in list(embeddings)[30:60]:
+        loaded.delete(f"doc-{node_id}")
+        loaded.add([_node(node_id, embeddings[node_id], f"doc-{node_id}")])
+    for node_id in list(embeddings)[:5]:
+        loaded.delete(f"doc-{node_id}")
+    assert not concatenations
+    assert isinstance(loaded._vectors, np.memmap)  # pylint: disable=protected-access
+
+    query = VectorStoreQuery(query_embedding=rng.normal(size=8).tolist(), similarity_top_k=5)
+    result = loaded.query(query)
+    monkeypatch.undo()
+    assert loaded.ids == list(embeddings)[5:40] + list(embeddings)[40:60]
+
+    expected = MmapVectorStore()
+    expected.add([_node(node_id, embeddings[node_id]) for node_id in list(embeddings)[5:]])
+    if store_class is MmapVectorStore:
+        assert result.ids == expected.query(query).ids
+        np.testing.assert_allclose(loaded.vectors, expected.vectors)
+    assert set(result.ids) <= set(loaded.ids)
+
+
+@pytest.mark.parametrize(
+    "backend, store_class, search_kwargs",
+    [("ivf", IvfVectorStore, {"n_probe": 16}), ("int8", Int8VectorStore, {"rerank_factor": 8})],
+)
+def test_retriever_passes_search_kwargs(tmp_path, monkeypatch, backend, store_class, search_kwargs):
+    """Test the search parameters of a store are set per retriever with vector_store_kwargs"""
+    monkeypatch.setattr(ann_vector_store, "MIN_TRAIN_SIZE", 4)
+    persist_dir = str(tmp_path / "index")
+    service_context = ServiceContext.from_defaults(
+        llm=MockLLM(), embed_model=MockEmbedding(embed_dim=8)
+    )
+    documents = [Document(text=f"Document {index}", id_=str(index)) for index in range(8)]
+    storage_context = new_storage_context(persist_dir, backend=backend)
+    refresh_index(
+        documents, persist_dir, storage_context=storage_context, service_context=service_context
+    )
+    index = load_index(persist_dir, service_context=service_context)
+
+    received = []
+    query = store_class.query
+
+    def recording_query(self, vector_store_query, **kwargs):
+        received.append(kwargs)
+        return query(self, vector_store_query, **kwargs)
+
+    monkeypatch.setattr(store_class, "query", recording_query)
+    retriever = index.as_retriever(similarity_top_k=3, vector_store_kwargs=search_kwargs)
+    assert len(retriever.retrieve("Document")) == 3
+    assert received == [search_kwargs]
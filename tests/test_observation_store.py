@@ -0,0 +1,59 @@
+import numpy as np
+
+from llamaindex_course.demo_medical.fhir_reader import FhirBundleIndex, read_fhir_file
+from llamaindex_course.demo_medical.observation_store import ObservationStore
+
+FHIR_FILE = "./data_json/0d5f5a77-b49d-4f8b-887f-70e9de390751.json"
+BODY_HEIGHT = "8302-2"
+SYSTOLIC_BLOOD_PRESSURE = "8480-6"
+
+
+def _body_heights(bundle_index):
+    """Body heights of the bundle as (effective date, value), computed without the store"""
+    return sorted(
+        (observation["effectiveDateTime"], observation["valueQuantity"]["value"])
+        for observation in bundle_index.get_resources("Observation")
+        if observation["code"]["coding"][0]["code"] == BODY_HEIGHT
+    )
+
+
+def test_observation_store_queries():
+    """Test the latest value, trend and statistics of a code"""
+    bundle_index = FhirBundleIndex(read_fhir_file(FHIR_FILE))
+    store = ObservationStore.from_bundle_index(bundle_index)
+    heights = [value for _, value in _body_heights(bundle_index)]
+
+    latest = store.latest_values()[BODY_HEIGHT]
+    assert latest.value == heights[-1]
+    assert latest.unit == "cm"
+
+    stats = store.stats()[BODY_HEIGHT]
+    assert stats.count == len(heights)
+    assert stats.min == min(heights)
+    assert stats.max == max(heights)
+    assert np.isclose(stats.mean, np.mean(heights))
+
+    dates, values = store.trend(BODY_HEIGHT)
+    assert list(values) == heights
+    assert np.all(dates[1:] >= dates[:-1])
+    _, values = store.trend(BODY_HEIGHT, start="2015-01-01", end="2018-12-31T23:59:59")
+    assert 0 < len(values) < len(heights)
+    # FHIR partial dates, the end of the range includes the whole period
+    _, partial_values = store.trend(BODY_HEIGHT, start="2015", end="2018")
+    assert list(partial_values) == list(values)
+    _, month_values = store.trend(BODY_HEIGHT, start="2015-01", end="2018-12")
+    assert list(month_values) == list(values)
+
+    last_date = _body_heights(bundle_index)[-1][0]
+    _, values = store.trend(BODY_HEIGHT, start=last_date[:10], end=last_date[:10])
+    assert list(values) == [heights[-1]]
+
+
+def test_observation_store_components():
+    """Test the components of the blood pressure observations are stored as rows"""
+    store = ObservationStore.from_resources(
+        entry["resource"] for entry in read_fhir_file(FHIR_FILE)
+    )
+    assert store.stats()[SYSTOLIC_BLOOD_PRESSURE].count == 16
+    assert store.trend("unknown")[0].size == 0
+    assert len(store.for_encounter("urn:uuid:unknown")) == 0
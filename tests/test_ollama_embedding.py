@@ -0,0 +1,104 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+from llamaindex_course.llamaindex.ollama_embedding import OllamaBatchEmbedding
+
+
+def _embedding(text):
+    return [float(len(text)), float(sum(map(ord, text)))]
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    """Fake Ollama server: failures is the number of 503 answers to send first"""
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        server = self.server
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.paths.append(self.path)
+            fail = server.failures > 0
+            server.failures -= fail
+        if fail:
+            self.send_response(503)
+            self.end_headers()
+            return
+        if self.path == "/api/embed" and server.batch_endpoint:
+            body = {"embeddings": [_embedding(text) for text in payload["input"]]}
+        elif self.path == "/api/embeddings":
+            body = {"embedding": _embedding(payload["prompt"])}
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOllamaHandler)
+    server.lock = threading.Lock()
+    server.paths = []
+    server.failures = 0
+    server.batch_endpoint = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _embed_model(server, **kwargs):
+    host, port = server.server_address
+    return OllamaBatchEmbedding(base_url=f"http://{host}:{port}", retry_delay=0, **kwargs)
+
+
+def test_batches_keep_order(server):
+    """Test the texts are sent in batches and the embeddings come back in order"""
+    embed_model = _embed_model(server, batch_size=4, max_concurrency=3)
+    texts = [f"text {index}" * (index % 5 + 1) for index in range(37)]
+
+    embeddings = embed_model.get_text_embedding_batch(texts)
+
+    assert embeddings == [_embedding(text) for text in texts]
+    assert server.paths == ["/api/embed"] * 10
+    assert embed_model.stats.texts == 37
+    assert embed_model.stats.texts_per_second > 0
+
+
+def test_retries(server):
+    """Test the failed requests are retried"""
+    server.failures = 2
+    embed_model = _embed_model(server, batch_size=2)
+
+    assert embed_model.get_query_embedding("blood pressure") == _embedding("blood pressure")
+    assert embed_model.stats.retries == 2
+    assert embed_model.stats.requests == 3
+
+    server.failures = 10
+    with pytest.raises(httpx.HTTPStatusError):
+        embed_model.get_text_embedding("too many failures")
+
+
+def test_fallback_to_single_text_endpoint(server):
+    """Test a server without /api/embed gets one request per text"""
+    server.batch_endpoint = False
+    embed_model = _embed_model(server, batch_size=8)
+
+    assert embed_model.get_text_embedding_batch(["a", "bb", "ccc"]) == [
+        _embedding("a"),
+        _embedding("bb"),
+        _embedding("ccc"),
+    ]
+    assert server.paths == ["/api/embed"] + ["/api/embeddings"] * 3
@@ -0,0 +1,65 @@
+import pytest
+
+from llamaindex_course.llamaindex.pdf_loader import (
+    PageCache,
+    extract_pdfs,
+    file_hash,
+    load_documents,
+)
+
+
+def test_page_cache(tmp_path):
+    """Test the pages of a file are cached together, keyed by the content hash"""
+    path = tmp_path / "report.pdf"
+    path.write_bytes(b"%PDF-1.4 content")
+    copy = tmp_path / "copy.pdf"
+    copy.write_bytes(b"%PDF-1.4 content")
+    assert file_hash(str(path)) == file_hash(str(copy))
+
+    cache = PageCache(str(tmp_path / "pages.db"))
+    key = file_hash(str(path))
+    assert key not in cache and cache.get(key) is None
+    cache.put(key, [("i", "Summary"), ("1", "Revenue")])
+    assert key in cache
+    assert cache.get(key) == [("i", "Summary"), ("1", "Revenue")]
+    # A cached PDF is not extracted again (no process pool, no pypdf needed)
+    assert extract_pdfs([str(path), str(copy)], cache) == (2, 0)
+
+    path.write_bytes(b"%PDF-1.4 changed content")
+    assert file_hash(str(path)) != key
+
+
+def test_load_documents(tmp_path):
+    """Test the documents are the ones of SimpleDirectoryReader, the PDF pages read from the cache"""
+    # SimpleDirectoryReader needs it to read any file
+    pytest.importorskip("llama_index.readers.file")
+    data = tmp_path / "data"
+    data.mkdir()
+    (data / "notes.txt").write_text("Air Liquide notes", encoding="utf-8")
+    (data / "report.pdf").write_bytes(b"%PDF-1.4 report")
+    cache_path = str(tmp_path / "pages.db")
+    cache = PageCache(cache_path)
+    cache.put(file_hash(str(data / "report.pdf")), [("1", "Revenue 27,6"), ("2", "Outlook")])
+    cache.close()
+
+    documents = load_documents(str(data), cache_path=cache_path, filename_as_id=True)
+    assert [document.text for document in documents] == ["Air Liquide notes", "Revenue 27,6", "Outlook"]
+    assert documents[1].doc_id == f"{data / 'report.pdf'}_part_0"
+    assert documents[2].metadata["page_label"] == "2"
+    assert documents[2].metadata["file_name"] == "report.pdf"
+
+
+def test_extract_pdfs(tmp_path):
+    """Test the pages of a new PDF are extracted in the process pool"""
+    pypdf = pytest.importorskip("pypdf")
+    writer = pypdf.PdfWriter()
+    for _ in range(20):
+        writer.add_blank_page(width=200, height=200)
+    path = str(tmp_path / "blank.pdf")
+    with open(path, "wb") as file:
+        writer.write(file)
+
+    cache = PageCache(str(tmp_path / "pages.db"))
+    assert extract_pdfs([path], cache, max_workers=2) == (0, 1)
+    assert len(cache.get(file_hash(path))) == 20
+    assert extract_pdfs([path], cache, max_workers=2) == (1, 0)
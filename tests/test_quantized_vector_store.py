@@ -0,0 +1,101 @@
+import numpy as np
+from llama_index.core import Document, MockEmbedding, ServiceContext
+from llama_index.core.llms import MockLLM
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from llamaindex_course.llamaindex.ann_vector_store import _clustered_vectors
+from llamaindex_course.llamaindex.incremental_index import refresh_index
+from llamaindex_course.llamaindex.mmap_vector_store import (
+    MmapVectorStore,
+    load_index,
+    new_storage_context,
+)
+from llamaindex_course.llamaindex.quantized_vector_store import (
+    Int8VectorStore,
+    benchmark,
+    quantize_int8,
+)
+
+
+def _store(cls, vectors, **kwargs):
+    return cls(vectors=vectors, ids=[str(index) for index in range(len(vectors))], **kwargs)
+
+
+def _search(store, query, **kwargs):
+    return store.query(
+        VectorStoreQuery(query_embedding=query.tolist(), similarity_top_k=10), **kwargs
+    ).ids
+
+
+def test_quantize_int8():
+    """Test the codes approximate the vectors within half a step of each dimension"""
+    vectors = _clustered_vectors(100, 16)
+    codes, scales = quantize_int8(vectors)
+    assert codes.dtype == np.int8
+    assert np.all(np.abs(codes * scales - vectors) <= scales / 2 + 1e-6)
+
+    # Values out of the range of the scales are clipped
+    codes, _ = quantize_int8(vectors * 2, scales)
+    assert codes.min() >= -127 and codes.max() <= 127
+
+
+def test_int8_recall(tmp_path):
+    """Test the int8 search finds the exact neighbors once re-ranked, and is persisted"""
+    vectors = _clustered_vectors(2020, 32)
+    vectors, queries = vectors[:2000], vectors[2000:]
+    exact = _store(MmapVectorStore, vectors)
+    quantized = _store(Int8VectorStore, vectors)
+    codes_bytes, vectors_bytes = quantized.memory_usage()
+    assert codes_bytes * 4 == vectors_bytes
+
+    recall = np.mean(
+        [
+            len(set(_search(quantized, query, rerank_factor=0)) & set(_search(exact, query))) / 10
+            for query in queries
+        ]
+    )
+    assert recall > 0.9
+    for query in queries:
+        assert _search(quantized, query) == _search(exact, query)
+
+    persist_path = str(tmp_path / "default__vector_store.json")
+    quantized.rerank_factor = 8
+    quantized.persist(persist_path)
+    loaded = Int8VectorStore.from_persist_path(persist_path)
+    assert isinstance(loaded.codes, np.memmap)
+    assert loaded.rerank_factor == 8
+    assert _search(loaded, queries[0]) == _search(quantized, queries[0])
+
+    # Added vectors are quantized with the same scales, deleted ones removed
+    loaded.add([TextNode(text="new", id_="new", embedding=queries[0].tolist())])
+    assert len(loaded.codes) == 2001
+    assert _search(loaded, queries[0])[0] == "new"
+    loaded.delete_nodes(["new"])
+    assert "new" not in _search(loaded, queries[0])
+
+
+def test_int8_backend(tmp_path):
+    """Test an index created with the int8 backend is reloaded with an Int8VectorStore"""
+    persist_dir = str(tmp_path / "index")
+    service_context = ServiceContext.from_defaults(
+        llm=MockLLM(), embed_model=MockEmbedding(embed_dim=8)
+    )
+    documents = [Document(text=f"Document {index}", id_=str(index)) for index in range(8)]
+    storage_context = new_storage_context(persist_dir, backend="int8")
+    refresh_index(
+        documents, persist_dir, storage_context=storage_context, service_context=service_context
+    )
+
+    index = load_index(persist_dir, service_context=service_context)
+    assert isinstance(index.vector_store, Int8VectorStore)
+    assert len(index.as_retriever(similarity_top_k=3).retrieve("Document")) == 3
+
+
+
+def test_benchmark():
+    """Test the benchmark runs on a small size"""
+    rows = benchmark(2000, dimension=16, n_queries=5, rerank_factors=(0, 4))
+    assert [row.search for row in rows] == ["float32", "int8 rerank x0", "int8 rerank x4"]
+    assert rows[2].recall == 1.0
+    assert rows[1].megabytes * 4 == rows[0].megabytes
@@ -0,0 +1,144 @@
+import os
+import asyncio
+import threading
+
+import pytest
+from llama_index.core import Document, MockEmbedding, VectorStoreIndex
+from llama_index.core.llms import MockLLM
+from llama_index.core.node_parser import SentenceSplitter
+
+from llamaindex_course.llamaindex.embedding_cache import CachedEmbedding
+from llamaindex_course.llamaindex.hashing_embedding import HashingEmbedding
+from llamaindex_course.llamaindex.mmap_vector_store import new_storage_context
+from llamaindex_course.llamaindex.sharded_index import (
+    ShardedHybridRetriever,
+    ShardedRetriever,
+    load_indexes,
+    load_shards,
+    partition,
+    persisted_query_engine,
+    refresh_index_or_shards,
+    refresh_sharded_index,
+    shard_count,
+    shard_of,
+)
+
+TOPICS = [
+    "revenue of the Gas and Services segment",
+    "order intake of Engineering and Construction",
+    "hydrogen mobility in Europe",
+    "biogas production in the United States",
+    "healthcare home care patients",
+    "electronics carrier gases for semiconductors",
+    "industrial merchant pricing",
+    "carbon capture projects",
+]
+
+
+def _documents(topics=TOPICS):
+    return [Document(text=f"The report describes the {topic}.", id_=f"doc-{i}") for i, topic in enumerate(topics)]
+
+
+def test_partition():
+    """Test every document goes to one stable shard"""
+    partitions = partition(_documents(), 3)
+    assert sorted(doc.doc_id for part in partitions for doc in part) == sorted(d.doc_id for d in _documents())
+    for shard, part in enumerate(partitions):
+        assert all(shard_of(document.doc_id, 3) == shard for document in part)
+
+
+def test_refresh_sharded_index(tmp_path):
+    """Test the shards are built in worker processes and refreshed incrementally"""
+    persist_dir = str(tmp_path / "index")
+    embed_model = CachedEmbedding(HashingEmbedding(), cache_path=str(tmp_path / "embeddings.db"))
+
+    stats = refresh_sharded_index(_documents(), persist_dir, 3, max_workers=2, embed_model=embed_model)
+    assert stats.added == len(TOPICS)
+    assert shard_count(persist_dir) == 3
+    # the workers filled the shared embedding cache
+    assert len(embed_model) == len(TOPICS)
+
+    stats = refresh_sharded_index(_documents(TOPICS[:-1]), persist_dir, 3, embed_model=embed_model)
+    assert (stats.added, stats.unchanged, stats.deleted) == (0, len(TOPICS) - 1, 1)
+
+    with pytest.raises(ValueError):
+        refresh_sharded_index(_documents(), persist_dir, 2, embed_model=embed_model)
+
+
+def test_index_layout_cannot_change(tmp_path):
+    """Test a sharded index is not refreshed as a single index, nor a single index sharded"""
+    embed_model = HashingEmbedding()
+    sharded_dir = str(tmp_path / "sharded")
+    # the workers get a pickled copy of the model and of the splitter
+    stats = refresh_index_or_shards(
+        _documents(),
+        sharded_dir,
+        2,
+        max_workers=2,
+        embed_model=embed_model,
+        transformations=[SentenceSplitter(chunk_size=64, chunk_overlap=0)],
+    )
+    assert stats.added == len(TOPICS) and shard_count(sharded_dir) == 2
+    with pytest.raises(ValueError):
+        refresh_index_or_shards(_documents(), sharded_dir, 1, embed_model=embed_model)
+    assert not os.path.exists(os.path.join(sharded_dir, "docstore.json"))
+
+    single_dir = str(tmp_path / "single")
+    assert refresh_index_or_shards(_documents(), single_dir, 1, embed_model=embed_model).added == len(TOPICS)
+    with pytest.raises(ValueError):
+        refresh_index_or_shards(_documents(), single_dir, 2, embed_model=embed_model)
+    assert shard_count(single_dir) is None
+
+
+def test_sharded_retriever_matches_single_index(tmp_path):
+    """Test the merged top k of the shards is the top k of a single index"""
+    persist_dir = str(tmp_path / "index")
+    embed_model = HashingEmbedding()
+    refresh_sharded_index(_documents(), persist_dir, 3, max_workers=1, embed_model=embed_model)
+    retriever = ShardedRetriever(load_shards(persist_dir, embed_model=embed_model), similarity_top_k=3)
+
+    single = VectorStoreIndex.from_documents(
+        _documents(), embed_model=embed_model, storage_context=new_storage_context()
+    ).as_retriever(similarity_top_k=3)
+
+    question = "What about hydrogen and biogas in Europe?"
+    expected = [node.node.ref_doc_id for node in single.retrieve(question)]
+    assert [node.node.ref_doc_id for node in retriever.retrieve(question)] == expected
+    assert [node.node.ref_doc_id for node in asyncio.run(retriever.aretrieve(question))] == expected
+
+
+def test_sharded_retrievers_leave_no_threads(tmp_path):
+    """Test the threads searching the shards end with each query"""
+    persist_dir = str(tmp_path / "index")
+    embed_model = HashingEmbedding()
+    refresh_sharded_index(_documents(), persist_dir, 3, max_workers=1, embed_model=embed_model)
+    shards = load_shards(persist_dir, embed_model=embed_model)
+    threads = threading.active_count()
+    for _ in range(5):
+        assert len(ShardedRetriever(shards, similarity_top_k=3).retrieve("hydrogen")) == 3
+    assert threading.active_count() == threads
+
+
+def test_load_indexes_of_both_layouts(tmp_path):
+    """Test the single and the sharded indexes are loaded and queried, with the hybrid retriever too"""
+    # MockEmbedding gives every node the same vector score: the BM25 score decides
+    embed_model = MockEmbedding(embed_dim=8)
+    question = "Where is the biogas production?"
+    for shards in (1, 3):
+        persist_dir = str(tmp_path / f"index_{shards}")
+        refresh_index_or_shards(_documents(), persist_dir, shards, max_workers=1, embed_model=embed_model)
+        indexes = load_indexes(persist_dir, embed_model=embed_model)
+        assert [directory for directory, _ in indexes][0].startswith(persist_dir)
+        assert len(indexes) == shards
+
+        # 2 * 4 candidates: every node is a vector candidate
+        query_engine = persisted_query_engine(indexes, similarity_top_k=2, hybrid=True, llm=MockLLM(max_tokens=4))
+        assert query_engine.retrieve(question)[0].node.ref_doc_id == "doc-3"
+        response = persisted_query_engine(indexes, similarity_top_k=2, llm=MockLLM(max_tokens=4)).query(question)
+        assert len(response.source_nodes) == 2
+
+    # the BM25 candidates of every shard are merged before the fusion
+    retriever = ShardedHybridRetriever(indexes, similarity_top_k=4)
+    words = ["revenue", "order", "hydrogen", "biogas", "healthcare", "electronics", "merchant", "carbon"]
+    for i, word in enumerate(words):
+        assert retriever.retrieve(word)[0].node.ref_doc_id == f"doc-{i}"
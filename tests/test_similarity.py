@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from llamaindex_course.llamaindex.similarity import (
+    SimilarityIndex,
+    benchmark,
+    cosine_similarity,
+)
+
+
+def _brute_force(vectors, queries, top_k):
+    scores = cosine_similarity(queries, vectors)
+    return np.argsort(-scores, axis=1)[:, :top_k], np.sort(scores, axis=1)[:, ::-1][:, :top_k]
+
+
+def test_cosine_similarity():
+    """Test the example of docs/02_cos_similarity.md"""
+    d1 = [1, 1, 1, 1, 1, 0, 0]
+    d2 = [0, 0, 1, 1, 0, 1, 1]
+    assert cosine_similarity([d1], [d2])[0][0] == pytest.approx(0.44721, abs=1e-5)
+    assert cosine_similarity([d1], [[0] * 7])[0][0] == 0
+
+
+@pytest.mark.parametrize("query_block_size,row_block_size", [(256, 131072), (3, 7)])
+def test_top_k_matches_brute_force(query_block_size, row_block_size):
+    """Test the blocked top k gives the same result as sorting every score"""
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((50, 16))
+    queries = rng.standard_normal((10, 16))
+    index = SimilarityIndex(vectors)
+
+    positions, similarities = index.top_k(
+        queries, 5, query_block_size=query_block_size, row_block_size=row_block_size
+    )
+
+    expected_positions, expected_similarities = _brute_force(vectors, queries, 5)
+    assert (positions == expected_positions).all()
+    assert similarities == pytest.approx(expected_similarities, abs=1e-5)
+
+
+def test_float16_and_search():
+    """Test the float16 matrix gives close similarities, and search returns the ids"""
+    rng = np.random.default_rng(1)
+    vectors = rng.standard_normal((20, 32))
+    index = SimilarityIndex(vectors, ids=[f"node{i}" for i in range(20)], dtype=np.float16)
+    assert index.matrix.dtype == np.float16
+
+    results = index.search(vectors[:2], top_k=3)
+    assert [result[0][0] for result in results] == ["node0", "node1"]
+    assert results[0][0][1] == pytest.approx(1.0, abs=1e-3)
+    assert index.top_k(vectors, top_k=50)[0].shape == (20, 20)
+
+
+def test_benchmark():
+    """Test the benchmark runs on a small size"""
+    rows = benchmark(n_vectors=100, n_queries=10, dimension=8, n_pair_queries=1)
+    assert len(rows) == 4
+    assert all(row.queries_per_second > 0 for row in rows)
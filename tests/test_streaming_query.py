@@ -0,0 +1,61 @@
+import io
+import time
+
+import pytest
+from llama_index.core import Document, MockEmbedding, ServiceContext, VectorStoreIndex
+from llama_index.core.base.response.schema import StreamingResponse
+from llama_index.core.llms import MockLLM
+
+from llamaindex_course.llamaindex.streaming_query import StreamingAnswer, print_streaming
+
+
+class SlowStreamingEngine:
+    """Query engine streaming a few tokens after a delay"""
+
+    def query(self, question):
+        def tokens():
+            time.sleep(0.05)
+            for token in ["", "Air ", "Liquide ", "grew"]:
+                yield token
+                time.sleep(0.01)
+
+        return StreamingResponse(response_gen=tokens())
+
+
+def test_streaming_answer_timings():
+    """Test the tokens are yielded one by one and timed"""
+    answer = StreamingAnswer(SlowStreamingEngine(), "Results?")
+    with pytest.raises(RuntimeError):
+        answer.timings  # pylint: disable=pointless-statement
+    assert list(answer) == ["Air ", "Liquide ", "grew"]
+    timings = answer.timings
+    assert timings.tokens == 3
+    assert 0.05 <= timings.time_to_first_token < timings.total
+    assert timings.tokens_per_second > 0
+    # A consumed answer is not queried again
+    assert answer.text == "Air Liquide grew"
+
+
+def test_print_streaming_index():
+    """Test the answer of a streaming query engine is printed"""
+    service_context = ServiceContext.from_defaults(
+        llm=MockLLM(max_tokens=5), embed_model=MockEmbedding(embed_dim=8)
+    )
+    index = VectorStoreIndex.from_documents(
+        [Document(text="Air Liquide results in 2023")], service_context=service_context
+    )
+    output = io.StringIO()
+    timings = print_streaming(index.as_query_engine(streaming=True), "Results?", file=output)
+    assert timings.tokens == 5
+    assert output.getvalue().strip() == "text " * 4 + "text"
+
+
+def test_non_streaming_engine():
+    """Test a query engine without streaming answers in one token"""
+    service_context = ServiceContext.from_defaults(
+        llm=MockLLM(max_tokens=3), embed_model=MockEmbedding(embed_dim=8)
+    )
+    index = VectorStoreIndex.from_documents([Document(text="Results")], service_context=service_context)
+    answer = StreamingAnswer(index.as_query_engine(), "Results?")
+    assert answer.text == "text text text"
+    assert answer.timings.tokens == 1